@@ -1,51 +1,46 @@
 # 2025/10/15 編集　メーカー名にアブクマを追加
 
-import gspread
 import streamlit as st
-# 置き換え前
-# from oauth2client.service_account import ServiceAccountCredentials
-# 置き換え後
-from google.oauth2.service_account import Credentials
+from hokusei_sheets import get_client, prewarm, with_total
+from hokusei_outbox import open_outbox, submission_id
+from hokusei_summary import submitted_index, submitted_message
+from hokusei_metrics import instrument_app
+from hokusei_tasks import (
+    batch_entry_toggle, is_batch_entry, repeat_button, show_totals, task_blocks, task_form, task_key,
+)
 import socket; socket.setdefaulttimeout(10)  # 無限待ち対策（任意）
 
 
 
 # --- 認証情報読み込み  ---
 google_cloud_secret = st.secrets["google_cloud"]
-service_account_info = {
-    "type": google_cloud_secret["type"],
-    "project_id": google_cloud_secret["project_id"],
-    "private_key_id": google_cloud_secret["private_key_id"],
-    "private_key": google_cloud_secret["private_key"],
-    "client_email": google_cloud_secret["client_email"],
-    "client_id": google_cloud_secret["client_id"],
-    "auth_uri": google_cloud_secret["auth_uri"],
-    "token_uri": google_cloud_secret["token_uri"],
-    "auth_provider_x509_cert_url": google_cloud_secret["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": google_cloud_secret["client_x509_cert_url"],
-    "universe_domain": google_cloud_secret["universe_domain"]
-}
-
-
-# ✅ キャッシュ付きシート取得関数
+# サービスアカウントの項目に加え、sheets_backend / local_*（負荷試験用のローカルのシート）もそのまま渡す
+service_account_info = dict(google_cloud_secret)
+
+
+SPREADSHEET_ID = "1OHkocLV4MiYFgim2fARSSQzSrQcW3njvnnnhgkMm-l4"
+
+
+# ✅ 送信用アウトボックス（プロセスで1つ）
+#    送信ボタンではローカルにためるだけ。シートへは裏のスレッドが書き込む
 @st.cache_resource
-def get_sheet():
-    # 置き換え後（scopesは用途に合わせて）
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive.readonly",
-    ]
-    creds = Credentials.from_service_account_info(st.secrets["google_cloud"], scopes=scopes)
-    gc = gspread.authorize(creds)
+def get_outbox():
+    return open_outbox("cad", lambda: get_client(service_account_info))
 
-    spreadsheet_id = "1OHkocLV4MiYFgim2fARSSQzSrQcW3njvnnnhgkMm-l4"
-    return gc.open_by_key(spreadsheet_id).sheet1
 
+outbox = get_outbox()
 
-sheet = get_sheet()
+# 送信済みの索引（同じ日・同じ名前の二重送信を送信前に知らせる。確認はメモリを引くだけ）
+submitted = submitted_index(SPREADSHEET_ID, [None], lambda: get_client(service_account_info))
+
+# ✅ 認証・トークン取得・シート接続は裏のスレッドで先に済ませておく（画面表示は待たない）
+prewarm(service_account_info, [SPREADSHEET_ID])
 
 ##### アプリ表示開始 #####
 ### タイトル ###
+# 再実行の時間を測る（/_hokusei/metrics と /_hokusei/health は hokusei_server.py で起動したときに公開される）
+instrument_app("cad")
+
 st.title('北青 CAD課作業日報')
 st.text("メーカー名、工番、作業内容、時間を入力してください。")
 
@@ -64,7 +59,20 @@ st.text("工番に関わる仕事以外の場合はメーカー名の欄で雑
 day = st.date_input("日付を選択してください")
 name = st.selectbox('名前', ('選択してください', "富寛", "鈴木", "古郡"))
 
+# 直前の送信がシートに反映されたか
+if st.session_state.get("outbox_ids"):
+    status_msg = outbox.describe(st.session_state.outbox_ids)
+    if status_msg:
+        st.caption(status_msg)
+
 if name != '選択してください':
+    # 同じ日にもう送信していれば知らせる（スマホとPCから二重に送るのを防ぐ）
+    already_msg = submitted_message(submitted, day, name)
+    if already_msg:
+        st.warning(already_msg)
+
+    batch_entry_toggle()
+
     # --- セッション初期化 ---
     if "form_count" not in st.session_state:
         st.session_state.form_count = 1
@@ -74,37 +82,54 @@ if name != '選択してください':
     def create_input_fields(index):
         st.markdown(f"---\n### 作業 {index}")
 
-        customer = st.selectbox(
-            f'メーカー{index}',
-            ('選択してください', 'ジーテクト', 'ヨロズ', '城山', 'タチバナ', '浜岳', '三池', '東プレ', 'アブクマ','東海鉄工所', '坪山',
-             'インフェック', '千代田','海津', '雑務', 'その他メーカー'),
-            key=f'customer_{index}'
-        )
-
-        new_customer = ''
-        if customer == 'その他メーカー':
-            new_customer = st.text_input(f'メーカー名を入力{index}', key=f'new_customer_{index}',
-                                         placeholder="メーカー名を入力")
-
-        # 👇 作業内容の選択肢：雑務以外なら表示
-        if customer not in ('選択してください', '雑務'):
-            genre = st.selectbox(
-                f'作業内容{index}',
-                ('選択してください', '新規', '改修', '設変', '見積', 'SIM', 'その他'),
-                key=f'genre_{index}'
+        # まとめて入力モード：フォームの中は入力に応じて欄を出し入れできないので、
+        # 条件付きの欄も全部出しておき、確定された値で判断する
+        batch = is_batch_entry()
+
+        with task_form(index):
+            customer = st.selectbox(
+                f'メーカー{index}',
+                ('選択してください', 'ジーテクト', 'ヨロズ', '城山', 'タチバナ', '浜岳', '三池', '東プレ', 'アブクマ','東海鉄工所', '坪山',
+                 'インフェック', '千代田','海津', '雑務', 'その他メーカー'),
+                key=task_key(index, 'customer')
             )
-        else:
-            genre = ''  # 雑務なら作業内容は空欄
-        
-        if genre != '見積':
-            number = st.text_input(f'工番を入力{index}', key=f'number_{index}',
-                                   placeholder="例: 51A111").upper() if genre != '選択してください' else ''
-        else:
-            number = st.text_input(f'工番を入力{index}', key=f'number_{index}',
-                                   value="見積用造形、解析").upper() if genre != '選択してください' else ''
-            
-        # --- 時間入力（プレースホルダ付きテキスト） ---
-        time_input = st.text_input(f'時間を入力{index}', key=f'time_{index}', placeholder="例: 1.5")
+
+            new_customer = ''
+            if customer == 'その他メーカー' or batch:
+                new_customer = st.text_input(f'メーカー名を入力{index}', key=task_key(index, 'new_customer'),
+                                             placeholder="その他メーカーの時だけ入力" if batch else "メーカー名を入力")
+
+            # 👇 作業内容の選択肢：雑務以外なら表示
+            if customer not in ('選択してください', '雑務') or batch:
+                genre = st.selectbox(
+                    f'作業内容{index}',
+                    ('選択してください', '新規', '改修', '設変', '見積', 'SIM', 'その他'),
+                    key=task_key(index, 'genre')
+                )
+            else:
+                genre = ''  # 雑務なら作業内容は空欄
+
+            if batch:
+                number = st.text_input(f'工番を入力{index}', key=task_key(index, 'number'),
+                                       placeholder="例: 51A111（見積は空欄で自動入力）").upper()
+            elif genre != '見積':
+                number = st.text_input(f'工番を入力{index}', key=task_key(index, 'number'),
+                                       placeholder="例: 51A111").upper() if genre != '選択してください' else ''
+            else:
+                number = st.text_input(f'工番を入力{index}', key=task_key(index, 'number'),
+                                       value="見積用造形、解析").upper() if genre != '選択してください' else ''
+
+            # --- 時間入力（プレースホルダ付きテキスト） ---
+            time_input = st.text_input(f'時間を入力{index}', key=task_key(index, 'time'), placeholder="例: 1.5")
+
+        if batch:
+            if customer != 'その他メーカー':
+                new_customer = ''
+            if customer in ('選択してください', '雑務'):
+                genre = ''  # 雑務なら作業内容は空欄
+            if genre == '見積' and not number.strip():
+                number = "見積用造形、解析".upper()
+
         try:
             time = float(time_input) if time_input.strip() != "" else 0.0
         except ValueError:
@@ -120,34 +145,30 @@ if name != '選択してください':
         }
 
 
-    # --- 入力フォームの表示 ---
-    inputs = []
-    for i in range(1, st.session_state.form_count + 1):
-        inputs.append(create_input_fields(i))
-
-    # --- 「次へ」ボタン（最大5件） ---
-    if st.session_state.form_count < 10:
-        if st.button("次へ"):
-            st.session_state.form_count += 1
-            st.rerun()  # ✅ 即時再描画で次のフォームを表示！
-
-    # --- 有効データ抽出 ---
-    valid_inputs = []
-    total_time = 0.0
-
-    for inp in inputs:
+    # --- 有効データの判定（送れる作業なら時間を返す） ---
+    def task_hours(inp):
         if (
                 inp["customer"] != "選択してください"
                 and inp["genre"] != "選択してください"
                 and inp["number"] != ''
                 and inp["time"] > 0
         ):
-            total_time += inp["time"]
-            valid_inputs.append(inp)
+            return {"合計時間": inp["time"]}
+        return None
+
+
+    # --- 入力フォームの表示（作業ごとに st.fragment。入力した作業だけ再実行される） ---
+    valid_inputs, totals = task_blocks(st.session_state.form_count, create_input_fields, task_hours)
+    total_time = totals.get("合計時間", 0.0)
+
+    # --- 「次へ」ボタン（最大10件） ---
+    if st.session_state.form_count < 10:
+        if st.button("次へ"):
+            st.session_state.form_count += 1
+            st.rerun()  # ✅ 即時再描画で次のフォームを表示！
 
-    # --- 合計時間表示 ---
-    if total_time > 0:
-        st.markdown(f"### ✅ 合計時間: {total_time:.2f} 時間")
+    # --- 合計時間表示（作業を入力するたびに差分で更新） ---
+    show_totals()
 
     # --- 送信ボタン（有効データがある時だけ表示） ---
     if valid_inputs:
@@ -164,21 +185,24 @@ if name != '選択してください':
                 ]
                 rows_to_append.append(row)
 
-            # ✅ 現在のシート行数を取得
-            current_rows = len(sheet.get_all_values())
+            # ✅ 最後の行の7列目に total_time を入れてアウトボックスへ（シートへは1回の append）
+            rows_to_append = with_total(rows_to_append, f"合計 {total_time:.2f} 時間")
 
-            # ✅ 一括送信
-            sheet.append_rows(rows_to_append)
+            # ✅ 送信ID（内容から作る。再送・二重押し・別の端末からの同じ送信は1回分しか記録しない）
+            sid = submission_id(SPREADSHEET_ID, str(day), name, rows_to_append)
 
-            # ✅ 送信した最初の行番号（1オリジン）
-            start_row = current_rows + 1
-            end_row = start_row + len(rows_to_append) - 1
+            def send(sid, rows=rows_to_append):
+                st.session_state.outbox_ids = [outbox.enqueue(
+                    SPREADSHEET_ID, None, "append", {"rows": rows}, submission_id=sid,
+                    summary=True,  # 日別集計タブにも足す
+                )]
 
-            # ✅ 同じ日付＋名前の最後の行にだけ total_time を入れる
-            for i in range(len(rows_to_append)):
-                if i == len(rows_to_append) - 1:  # 最後の行だけ
-                    sheet.update_cell(start_row + i, 7, f"合計 {total_time:.2f} 時間")
-            st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
+            if outbox.seen(sid) is not None:
+                st.info("同じ内容はすでに送信済みです（二重には記録されません）。")
+                repeat_button(lambda rid=outbox.repeat_id(sid): send(rid))
+            else:
+                send(sid)
+                st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
             st.session_state.form_count = 1
 
             ##### プログラムエンド10/15 #####
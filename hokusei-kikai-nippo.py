@@ -5,9 +5,14 @@ import socket
 socket.setdefaulttimeout(10)  # 外部I/Oの無限待ちを物理的に防止
 
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import date
+from hokusei_sheets import get_client, prewarm
+from hokusei_outbox import open_outbox, submission_id
+from hokusei_summary import submitted_index, submitted_message
+from hokusei_metrics import instrument_app
+from hokusei_tasks import (
+    batch_entry_toggle, is_batch_entry, repeat_button, show_totals, task_blocks, task_form, task_key,
+)
 
 # ====== Google 認証情報 ======
 # st.secrets["google_cloud"] にサービスアカウントJSONをそのまま入れてください
@@ -20,22 +25,27 @@ def _service_account_info():
 
 SPREADSHEET_ID = "1XdfjbRSYWJhlYNB12okcUeVMXPzBLxsv85sw4dLoOjQ"  # 機械日報シート
 
+SHEET_MAIN = "シート1"    # 通常作業用
+SHEET_AUTO = "自動運転"   # 自動運転用
+
 @st.cache_resource(show_spinner=False)
-def get_sheets():
-    """シート接続（初回のみ）。以降は共有して再利用。"""
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive.readonly",
-    ]
-    creds = Credentials.from_service_account_info(_service_account_info(), scopes=scopes)
-    gc = gspread.authorize(creds)
-    ss = gc.open_by_key(SPREADSHEET_ID)
-    return {
-        "main": ss.worksheet("シート1"),    # 通常作業用
-        "auto": ss.worksheet("自動運転"),   # 自動運転用
-    }
+def get_outbox():
+    """送信用アウトボックス（初回のみ）。シートへの書き込みは裏のスレッドが行う。"""
+    info = _service_account_info()
+    return open_outbox("kikai", lambda: get_client(info))
+
+outbox = get_outbox()
+
+# 送信済みの索引（同じ日・同じ名前の二重送信を送信前に知らせる。確認はメモリを引くだけ）
+submitted = submitted_index(SPREADSHEET_ID, [SHEET_MAIN, SHEET_AUTO], lambda: get_client(_service_account_info()))
+
+# 認証・トークン取得・シート接続は裏のスレッドで先に済ませておく（画面表示は待たない）
+prewarm(_service_account_info(), [SPREADSHEET_ID])
 
 # ====== UI ======
+# 再実行の時間を測る（/_hokusei/metrics と /_hokusei/health は hokusei_server.py で起動したときに公開される）
+instrument_app("kikai")
+
 st.title('北青 機械課 作業日報')
 st.caption("メーカー名、工番、作業内容、時間を入力してください。")
 
@@ -55,7 +65,20 @@ st.text("工番に関わる仕事以外はメーカー名『雑務』を選択
 day = st.date_input("日付を選択してください", value=date.today())
 name = st.selectbox('名前', ('選択してください', '大地', '山岸', '坂本', '一條', '松本', '将', '出繩', 'ルオン'))
 
+# 直前の送信がシートに反映されたか
+if st.session_state.get("outbox_ids"):
+    status_msg = outbox.describe(st.session_state.outbox_ids)
+    if status_msg:
+        st.caption(status_msg)
+
 if name != '選択してください':
+    # 同じ日にもう送信していれば知らせる（スマホとPCから二重に送るのを防ぐ）
+    already_msg = submitted_message(submitted, day, name)
+    if already_msg:
+        st.warning(already_msg)
+
+    batch_entry_toggle()
+
     # セッション初期化
     if "form_count" not in st.session_state:
         st.session_state.form_count = 1
@@ -64,40 +87,52 @@ if name != '選択してください':
     def create_input_fields(index: int):
         st.markdown(f"---\n### 作業 {index}")
 
-        customer = st.selectbox(
-            f'メーカー{index}',
-            ('選択してください', 'ジーテクト', 'ヨロズ', '城山', 'タチバナ', '浜岳', '三池', '東プレ',
-             'アブクマ','千代田', "町山製作所", "須永鉄工",'武部鉄工所', 'インフェック', '東海鉄工所', '雑務', 'その他メーカー'),
-            key=f'customer_{index}'
-        )
-
-        new_customer = ''
-        if customer == 'その他メーカー':
-            new_customer = st.text_input(
-                f'メーカー名を入力{index}',
-                key=f'new_customer_{index}',
-                placeholder="メーカー名を入力"
-            )
+        # まとめて入力モード：フォームの中は入力に応じて欄を出し入れできないので、
+        # 条件付きの欄も全部出しておき、確定された値で判断する
+        batch = is_batch_entry()
 
-        if customer not in ('選択してください', '雑務'):
-            genre = st.selectbox(
-                f'作業内容{index}',
-                ('選択してください', '新規', '改修', 'その他', '自動運転'),
-                key=f'genre_{index}'
+        with task_form(index):
+            customer = st.selectbox(
+                f'メーカー{index}',
+                ('選択してください', 'ジーテクト', 'ヨロズ', '城山', 'タチバナ', '浜岳', '三池', '東プレ',
+                 'アブクマ','千代田', "町山製作所", "須永鉄工",'武部鉄工所', 'インフェック', '東海鉄工所', '雑務', 'その他メーカー'),
+                key=task_key(index, 'customer')
             )
-        else:
-            genre = ''  # 雑務は空欄
-
-        if genre != '選択してください':
-            number = st.text_input(
-                f'工番を入力{index}',
-                key=f'number_{index}',
-                placeholder="例: 51A111"
-            ).upper()
-        else:
-            number = ''
-
-        time_input = st.text_input(f'時間を入力{index}', key=f'time_{index}', placeholder="例: 1.5")
+
+            new_customer = ''
+            if customer == 'その他メーカー' or batch:
+                new_customer = st.text_input(
+                    f'メーカー名を入力{index}',
+                    key=task_key(index, 'new_customer'),
+                    placeholder="その他メーカーの時だけ入力" if batch else "メーカー名を入力"
+                )
+
+            if customer not in ('選択してください', '雑務') or batch:
+                genre = st.selectbox(
+                    f'作業内容{index}',
+                    ('選択してください', '新規', '改修', 'その他', '自動運転'),
+                    key=task_key(index, 'genre')
+                )
+            else:
+                genre = ''  # 雑務は空欄
+
+            if genre != '選択してください' or batch:
+                number = st.text_input(
+                    f'工番を入力{index}',
+                    key=task_key(index, 'number'),
+                    placeholder="例: 51A111"
+                ).upper()
+            else:
+                number = ''
+
+            time_input = st.text_input(f'時間を入力{index}', key=task_key(index, 'time'), placeholder="例: 1.5")
+
+        if batch:
+            if customer != 'その他メーカー':
+                new_customer = ''
+            if customer in ('選択してください', '雑務'):
+                genre = ''  # 雑務は空欄
+
         try:
             hours = float(time_input) if time_input.strip() != "" else 0.0
         except ValueError:
@@ -112,21 +147,8 @@ if name != '選択してください':
             "time": hours
         }
 
-    # 入力フォームの表示
-    inputs = [create_input_fields(i) for i in range(1, st.session_state.form_count + 1)]
-
-    # 「次へ」（最大10件）
-    if st.session_state.form_count < 10:
-        if st.button("次へ"):
-            st.session_state.form_count += 1
-            st.rerun()
-
-    # 有効データ抽出 & 合計
-    valid_inputs = []
-    total_time_normal = 0.0
-    total_time_auto = 0.0
-
-    for inp in inputs:
+    # 有効データの判定（送れる作業なら時間を返す。自動運転は別の合計）
+    def task_hours(inp):
         if (
             inp["customer"] != "選択してください"
             and inp["genre"] != "選択してください"
@@ -134,22 +156,27 @@ if name != '選択してください':
             and inp["time"] > 0
         ):
             if inp["genre"] == "自動運転":
-                total_time_auto += inp["time"]
-            else:
-                total_time_normal += inp["time"]
-            valid_inputs.append(inp)
+                return {"合計時間(自動)": inp["time"]}
+            return {"合計時間": inp["time"]}
+        return None
 
-    # 合計表示
-    if total_time_normal > 0:
-        st.markdown(f"### ✅ 合計時間: {total_time_normal:.2f} 時間")
-    if total_time_auto > 0:
-        st.markdown(f"### ✅ 合計時間(自動): {total_time_auto:.2f} 時間")
+    # 入力フォームの表示（作業ごとに st.fragment。入力した作業だけ再実行される）
+    valid_inputs, totals = task_blocks(st.session_state.form_count, create_input_fields, task_hours)
+    total_time_normal = totals.get("合計時間", 0.0)
+    total_time_auto = totals.get("合計時間(自動)", 0.0)
+
+    # 「次へ」（最大10件）
+    if st.session_state.form_count < 10:
+        if st.button("次へ"):
+            st.session_state.form_count += 1
+            st.rerun()
+
+    # 合計表示（作業を入力するたびに差分で更新）
+    show_totals(("合計時間", "合計時間(自動)"))
 
     # 送信
     if valid_inputs and st.button("送信"):
         try:
-            sheets = get_sheets()  # ここで初めて外部接続（遅延実行）
-
             rows_main = []
             rows_auto = []
 
@@ -167,24 +194,38 @@ if name != '選択してください':
                 else:
                     rows_main.append(row)
 
-            # 通常作業：最後の行だけ 7列目に合計を入れて一括追加
+            # 通常作業：最後の行だけ 7列目に合計を入れる
             if rows_main:
                 if total_time_normal > 0:
                     rows_main[-1] = rows_main[-1] + [f"合計 {total_time_normal:.2f} 時間"]
                 # 7列目が存在しない行には空文字で合わせる
                 rows_main = [r if len(r) == 7 else (r + [""]) for r in rows_main]
-                sheets["main"].append_rows(rows_main, value_input_option="USER_ENTERED")
 
-            # 自動運転：合計は書かずに追加
-            if rows_auto:
-                sheets["auto"].append_rows(rows_auto, value_input_option="USER_ENTERED")
-
-            st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
+            # 自動運転：合計は書かない
+            # 両方のタブへの追記を1件にまとめてアウトボックスへ
+            # （シートへは1回の batchUpdate。片方だけ書けた状態にはならない）
+            # 送信ID（内容から作る。再送・二重押し・別の端末からの同じ送信は1回分しか記録しない）
+            sheets_rows = {SHEET_MAIN: rows_main, SHEET_AUTO: rows_auto}
+            sid = submission_id(SPREADSHEET_ID, str(day), name, sheets_rows)
+
+            def send(sid, sheets_rows=sheets_rows):
+                st.session_state.outbox_ids = [outbox.enqueue(
+                    SPREADSHEET_ID, None, "append_multi",
+                    {"sheets": sheets_rows, "value_input_option": "USER_ENTERED"},
+                    submission_id=sid,
+                    summary=True,  # 日別集計タブにも足す（自動運転タブの行は自動運転時間）
+                )]
+
+            if outbox.seen(sid) is not None:
+                st.info("同じ内容はすでに送信済みです（二重には記録されません）。")
+                repeat_button(lambda rid=outbox.repeat_id(sid): send(rid))
+            else:
+                send(sid)
+                st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
             st.session_state.form_count = 1
 
         except Exception as e:
             st.error(f"送信に失敗しました: {e}")
-            st.info("Secretsのprivate_keyの改行(\\n)やシートの共有権限を確認してください。")
 
 # 依存関係メモ：
 # requirements.txt 例
@@ -1,26 +1,34 @@
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
+from hokusei_sheets import get_client, prewarm
+from hokusei_outbox import open_outbox, submission_id
+from hokusei_metrics import instrument_app
+from hokusei_tasks import repeat_button
 
 # Streamlit secrets から認証情報を取得
 service_account_info = st.secrets["google_cloud"]
 
-# 認証オブジェクトを作成
-creds = Credentials.from_service_account_info(
-    service_account_info,
-    scopes=["https://spreadsheets.google.com/feeds",
-            'https://www.googleapis.com/auth/spreadsheets',
-            "https://www.googleapis.com/auth/drive.file",
-            "https://www.googleapis.com/auth/drive"]
-    )
-
-#  gspread  クライアント作成
-client = gspread.authorize(creds)
+SCOPES = ["https://spreadsheets.google.com/feeds",
+          'https://www.googleapis.com/auth/spreadsheets',
+          "https://www.googleapis.com/auth/drive.file",
+          "https://www.googleapis.com/auth/drive"]
 
 # スプレッドシートを開く（名前）
 #sheet = client.open("memo_kyouyuu").sheet1
 # スプレッドシートを開く（id）
-sheet = client.open_by_key("1owRvyJDQj2Na_4ENEyJ7gooabtTzUM2GjqBcw-_HoqM").sheet1
+SPREADSHEET_ID = "1owRvyJDQj2Na_4ENEyJ7gooabtTzUM2GjqBcw-_HoqM"
+
+# 認証・接続はここではしない（入力のたびに再実行されるため）
+# gspread クライアントはプロセスで1つだけ作り、送信時に初めて通信する
+# 送信用アウトボックス（シートへの書き込みは裏のスレッドが再送付きで行う）
+@st.cache_resource
+def get_outbox():
+    info = dict(service_account_info)
+    return open_outbox("memo", lambda: get_client(info, SCOPES))
+
+outbox = get_outbox()
+
+# 認証・トークン取得・シート接続は裏のスレッドで先に済ませておく（入力中に通信は発生しない）
+prewarm(dict(service_account_info), [SPREADSHEET_ID], SCOPES)
 
 
 ############################################
@@ -32,6 +40,9 @@ day2 = str()
 memo = "入力してください"
 
 ############################################
+# 再実行の時間を測る（/_hokusei/metrics と /_hokusei/health は hokusei_server.py で起動したときに公開される）
+instrument_app("memo")
+
 st.title("金型メモ共有アプリ")
 st.text("型の改修内容や期限、出荷、トライ日程などメモ帳として使用してください")
 st.text("記入日、記入者名、メーカー、工番等、期限や日程、内容の順に入力してください")
@@ -61,25 +72,24 @@ memo = st.text_input(
 submit_btn = st.button('送信')
 
 if submit_btn:
-    # B列を取得（1-index なので 2列目）
-    b_values = sheet.col_values(2)  # B列全体
-
-    target_row = None
-
-    # 5行目以降で空白セルを探す
-    for i in range(4, len(b_values)):
-        if b_values[i].strip() == "":
-            target_row = i + 1  # 実際の行番号に合わせて +1
-            break
-
-    # B列がすべて埋まっている場合は最後に追加
-    if target_row is None:
-        target_row = len(b_values) + 1
-
     # 書き込むデータ（B列〜G列＝6項目）
     row_data = [str(day1), name, m_name, number, str(day2), memo]
 
-    # B列〜G列に書き込む（A列は無視）
-    sheet.update(f"B{target_row}:G{target_row}", [row_data])
-
-    st.success("送信しました！")
+    # B列の5行目以降で空白の行に書く（すべて埋まっている場合は最後に追加）
+    # 空白行探しと書き込みはアウトボックスの裏スレッドが行う
+    # 同じ内容の再送・二重押し・別の端末からの送信は1回分しか書かない
+    sid = submission_id(SPREADSHEET_ID, row_data)
+
+    def send(sid, row_data=row_data):
+        outbox.enqueue(
+            SPREADSHEET_ID, None, "fill_blank",
+            {"column": 2, "start_row": 5, "first_col": "B", "last_col": "G", "values": row_data},
+            submission_id=sid,
+        )
+
+    if outbox.seen(sid) is not None:
+        st.info("同じ内容はすでに送信済みです（二重には記録されません）。")
+        repeat_button(lambda rid=outbox.repeat_id(sid): send(rid))
+    else:
+        send(sid)
+        st.success("送信しました！")
@@ -10,9 +10,16 @@ socket.setdefaulttimeout(10)
 import re
 import unicodedata
 import streamlit as st
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import date, datetime, timedelta, timezone
+from hokusei_sheets import describe_error, get_client, prewarm
+from hokusei_outbox import open_outbox, submission_id
+from hokusei_summary import submitted_index, submitted_message
+from hokusei_metrics import instrument_app
+from hokusei_trace import add_trace_id, new_trace_id, remember_trace, span, trace, trace_panel
+from hokusei_tasks import (
+    batch_entry_toggle, is_batch_entry, repeat_button, reset_tasks, rerun_task, show_totals, task_blocks,
+    task_form, task_key,
+)
 JST = timezone(timedelta(hours=9))  # 日本時間（UTC+9）
 
 ########################################
@@ -70,6 +77,22 @@ def make_job_sequence(job1: str, count: int) -> list[str] | None:
     prefix = m.group(1)
     start = int(m.group(2))
     return [f"{prefix}{start + k:03d}" for k in range(count)]
+
+def fill_job_rows(jobs: list[str], steps: int, old_auto: list[str] | None) -> tuple[list[str], list[str] | None]:
+    """工番の表を工程数ぶんの行に揃え、工番1から連番を自動入力する（表全体を1回で計算）
+
+    空欄 or 前回の自動入力のままの行だけ更新する（手入力で崩した行は上書きしない）。
+    戻り値は (工番のリスト, 今回の連番 / 連番が作れなければ None)。
+    """
+    jobs = (list(jobs) + [""] * steps)[:steps]
+    auto = make_job_sequence(jobs[0] if jobs else "", steps)
+    if auto is not None:
+        for k in range(1, steps):
+            old = old_auto[k] if isinstance(old_auto, list) and len(old_auto) > k else None
+            if jobs[k] == "" or (old is not None and jobs[k] == old):
+                jobs[k] = auto[k]
+    return jobs, auto
+
 ########################################
 # Googleシート接続
 ########################################
@@ -85,29 +108,22 @@ def _normalized_service_account_info():
     return info
 
 @st.cache_resource(show_spinner=False)
-def get_sheet_cached():
-    scopes = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive.readonly",
-    ]
-    creds = Credentials.from_service_account_info(
-        _normalized_service_account_info(),
-        scopes=scopes
-    )
-    gc = gspread.authorize(creds)
-    sh = gc.open_by_key(GOOGLE_SHEET_ID)
-    return sh.worksheet(SHEET_NAME) if SHEET_NAME else sh.sheet1
+def get_outbox():
+    # 送信はローカルのアウトボックスにためるだけ。シートへは裏のスレッドが再送付きで書く
+    info = _normalized_service_account_info()
+    return open_outbox("siage", lambda: get_client(info))
 
 def ensure_sheet_ready():
-    if "sheet_ready" not in st.session_state:
-        st.session_state.sheet_ready = False
-    if not st.session_state.sheet_ready:
-        try:
-            _ = get_sheet_cached()
-            st.session_state.sheet_ready = True
-        except Exception:
-            # ここで失敗しても送信時にもう一度やるので黙っておく
-            pass
+    # 認証・トークン取得・open_by_key は裏のスレッドで先に済ませる（最初の画面表示を待たせない）
+    # スレッドはプロセスで1本だけ。トークンも期限切れ前に取り直し続ける
+    # クライアントはアウトボックスの書き込みスレッドと共有（トークンも共有）
+    prewarm(_normalized_service_account_info(), [GOOGLE_SHEET_ID])
+
+ensure_sheet_ready()
+outbox = get_outbox()
+
+# 送信済みの索引（同じ日・同じ名前の二重送信を送信前に知らせる。確認はメモリを引くだけ）
+submitted = submitted_index(GOOGLE_SHEET_ID, [SHEET_NAME], lambda: get_client(_normalized_service_account_info()))
 
 ########################################
 # セッション初期化
@@ -118,12 +134,14 @@ if "initialized" not in st.session_state:
     st.session_state.form_count = 1            # 表示する作業フォーム数
     st.session_state.is_sending = False        # 送信中ロック
     st.session_state.just_sent = False         # 直前に成功したか
-    ensure_sheet_ready()
 
 ########################################
 # ヘッダ表示
 ########################################
 
+# 再実行の時間を測る（/_hokusei/metrics と /_hokusei/health は hokusei_server.py で起動したときに公開される）
+instrument_app("siage")
+
 st.title('北青 仕上げ課 作業日報')
 st.caption("メーカー名、工番、作業内容、時間を入力してください。")
 
@@ -172,43 +190,87 @@ if st.session_state.just_sent:
     st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
     st.session_state.just_sent = False  # 次回は出さないように
 
+# 直前の送信がシートに反映されたか
+if st.session_state.get("outbox_ids"):
+    status_msg = outbox.describe(st.session_state.outbox_ids)
+    if status_msg:
+        st.caption(status_msg)
+
 ########################################
 # 入力フォーム
 ########################################
 
+# 客先トライの同行者に選べる名前
+COMPANION_NAMES = [
+    "吉田", "中村", "渡辺", "福田", "苫米地", "矢部", "小野",
+    "塩入", "トム", "ユン", "ティエン", "チョン", "アイン"
+]
+MAX_COMPANIONS = 10  # 1つの作業に入れられる同行者の数（以前の選択肢と同じ）
+
 if name != '選択してください':
+    # 同じ日にもう送信していれば知らせる（スマホとPCから二重に送るのを防ぐ）
+    already_msg = submitted_message(submitted, day, name)
+    if already_msg:
+        st.warning(already_msg)
+
+    batch_entry_toggle()
 
     def create_input_fields(i: int):
         st.markdown(f"---\n### 作業 {i}")
 
-        customer = st.selectbox(
-            f"メーカー{i}",
-            (
-                "選択してください", "ジーテクト", "ヨロズ", "城山", "タチバナ", "浜岳",
-                "三池", "東プレ", "アブクマ", "町山製作所", "須永鉄工", "港プレス", "武部鉄工所", "東海鉄工所",
-                "インフェック",
-                "千代田", "エスケイ", "協豊", "海津", "タツム", "雑務", "その他メーカー"
-            ),
-            key=f"customer_{i}"
-        )
-
-        new_customer = ""
-        if customer == "その他メーカー":
-            new_customer = st.text_input(
-                f"メーカー名を入力{i}",
-                key=f"new_customer_{i}",
-                placeholder="メーカー名を入力"
+        # まとめて入力モード：フォームの中は入力に応じて欄を出し入れできないので、
+        # 条件付きの欄も全部出しておき、確定された値で判断する
+        batch = is_batch_entry()
+
+        with task_form(i):
+            customer = st.selectbox(
+                f"メーカー{i}",
+                (
+                    "選択してください", "ジーテクト", "ヨロズ", "城山", "タチバナ", "浜岳",
+                    "三池", "東プレ", "アブクマ", "町山製作所", "須永鉄工", "港プレス", "武部鉄工所", "東海鉄工所",
+                    "インフェック",
+                    "千代田", "エスケイ", "協豊", "海津", "タツム", "雑務", "その他メーカー"
+                ),
+                key=task_key(i, "customer")
             )
 
-        # 雑務以外のときだけ作業内容を選ばせる
-        if customer not in ('選択してください', '雑務'):
-            genre = st.selectbox(
-                f"作業内容{i}",
-                ('選択してください', '新規', '玉成', '設変', 'パネル', '社内トライ', '客先トライ', 'その他'),
-                key=f"genre_{i}"
-            )
-        else:
-            genre = ""
+            new_customer = ""
+            if customer == "その他メーカー" or batch:
+                new_customer = st.text_input(
+                    f"メーカー名を入力{i}",
+                    key=task_key(i, "new_customer"),
+                    placeholder="その他メーカーの時だけ入力" if batch else "メーカー名を入力"
+                )
+
+            # 雑務以外のときだけ作業内容を選ばせる
+            if customer not in ('選択してください', '雑務') or batch:
+                genre = st.selectbox(
+                    f"作業内容{i}",
+                    ('選択してください', '新規', '玉成', '設変', 'パネル', '社内トライ', '客先トライ', 'その他'),
+                    key=task_key(i, "genre")
+                )
+            else:
+                genre = ""
+
+            # まとめて入力モード：通常フォームの工番・時間も同じフォームに入れる
+            # （パネル・トライの専用フォームは工番の連番入力があるのでフォームの外に出す）
+            if batch:
+                number = st.text_input(
+                    f"工番を入力{i}",
+                    key=task_key(i, "number"),
+                    placeholder="例: 51A111（パネル・トライは確定後の専用フォームで入力）"
+                ).upper().strip()
+                time_txt = st.text_input(
+                    f"時間を入力{i}",
+                    key=task_key(i, "time"),
+                    placeholder="例: 1.5（１．５ / 1,5 / 1.5h / 1.5時間 もOK）"
+                )
+
+        if batch:
+            if customer != "その他メーカー":
+                new_customer = ""
+            if customer in ('選択してください', '雑務'):
+                genre = ""
 
         # 入力欄を出して良い条件（メーカー選択済み＋作業内容選択済み / 雑務は作業内容なし）
         ready = (
@@ -231,7 +293,6 @@ if name != '選択してください':
         work_hours_raw = 0.0
         move_time_txt = ""
         move_hours = 0.0
-        companion_count = 0
         companion_names: list[str] = []
 
         if ready and is_special:
@@ -239,7 +300,7 @@ if name != '選択してください':
             if genre == '客先トライ':
                 move_time_txt = st.text_input(
                     f"移動時間{i}",
-                    key=f"move_time_{i}",
+                    key=task_key(i, "move_time"),
                     placeholder="例: 1.0"
                 )
                 move_hours = parse_hours_maybe(move_time_txt)
@@ -251,101 +312,98 @@ if name != '選択してください':
                 f"工程数{i}",
                 options=list(range(1, 11)),
                 index=0,  # 初期値=1
-                key=f"steps_{i}"
+                key=task_key(i, "steps")
             )
 
-            # 工番：工程数ぶん表示（工番1の入力から連番自動入力）
-            job1_key = f"job_{i}_1"
-            job1_now = st.session_state.get(job1_key, "")
-            auto_jobs = make_job_sequence(job1_now, steps)
-
-            old_auto_jobs = st.session_state.get(f"auto_jobs_{i}")
-            if auto_jobs is not None:
-                for k in range(2, steps + 1):
-                    kkey = f"job_{i}_{k}"
-                    cur = st.session_state.get(kkey, "")
-                    old = None
-                    if isinstance(old_auto_jobs, list) and len(old_auto_jobs) >= k:
-                        old = old_auto_jobs[k - 1]
-                    # 空欄 or 前回の自動入力のままなら更新する（手入力で崩した場合は上書きしない）
-                    if cur == "" or (old is not None and cur == old):
-                        st.session_state[kkey] = auto_jobs[k - 1]
-                st.session_state[f"auto_jobs_{i}"] = auto_jobs
-
-            for k in range(1, steps + 1):
-                job = st.text_input(
-                    f"工番{k}",
-                    key=f"job_{i}_{k}",
-                    placeholder="例: 12A345" if k == 1 else ""
-                )
-                job_numbers.append(job.upper().strip())
-
-            if auto_jobs is None and job1_now:
-                st.info("工番1の末尾が3桁数字ではないため、工番2以降の連番自動入力ができません。")
-
             # 作業時間（合計）
             work_time_txt = st.text_input(
                 f"時間{i}",
-                key=f"work_time_{i}",
+                key=task_key(i, "work_time"),
                 placeholder="例: 4.75"
             )
             work_hours_raw = parse_hours_maybe(work_time_txt)
             if work_time_txt and work_hours_raw == 0.0:
                 st.info(f"時間{i}は数値で入力してください（例: 4.75 / ４．７５）")
 
-            # 同行者（客先トライ：作業番号に関係なく入力OK）
+            work_q = quantize_quarter(work_hours_raw)
+            if work_hours_raw > 0 and abs(work_q - work_hours_raw) > 1e-9:
+                st.info(f"時間{i}は0.25単位で配分するため、{work_hours_raw} → {work_q} に丸めて計算します。")
+            alloc = split_hours_quarter(work_q, steps) if work_q > 0 else [0.0] * steps
+
+            # 工番＋時間：工程数ぶんの行を1つの表で入力（工番1から連番自動入力・時間は0.25単位で配分）
+            # 表に出す値は trial_jobs_{i} に覚えておき、入力のたびに連番と配分を表全体で計算し直す
+            jobs_key = task_key(i, "trial_jobs")
+            saved = st.session_state.get(jobs_key, {"jobs": [], "auto": None})
+            shown_jobs, auto = fill_job_rows(saved["jobs"], steps, saved["auto"])
+            grid = st.data_editor(
+                [
+                    {"工番": jb, "時間": f"{fmt_hours(hh)}時間" if work_q > 0 else ""}
+                    for jb, hh in zip(shown_jobs, alloc)
+                ],
+                key=task_key(i, "trial_grid"),
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    "工番": st.column_config.TextColumn("工番", help="工番1を入れると2行目以降は連番で自動入力されます"),
+                    "時間": st.column_config.TextColumn("時間", disabled=True),
+                },
+            )
+            edited_jobs = [str(row.get("工番") or "").upper().strip() for row in grid]
+            job_numbers, auto = fill_job_rows(edited_jobs, steps, auto)
+            st.session_state[jobs_key] = {"jobs": job_numbers, "auto": auto}
+            if job_numbers != edited_jobs:
+                rerun_task()  # 連番を入れたので表を描き直す
+
+            if auto is None and job_numbers and job_numbers[0]:
+                st.info("工番1の末尾が3桁数字ではないため、工番2以降の連番自動入力ができません。")
+            if not (all(job_numbers) and work_q > 0):
+                st.caption("工程数・工番・時間を入力すると、表に配分結果が表示されます。")
+
+            # 同行者（客先トライ：作業番号に関係なく入力OK）：1つの表に行を追加して名前を選ぶ
             if genre == "客先トライ":
-                companion_sel = st.selectbox(
-                    f"同行者（作業{i}）",
-                    ["同行者なし"] + [str(n) for n in range(1, 11)],
-                    key=f"companion_count_{i}"
+                import pandas as pd  # data_editor が内部で読み込み済み（ここで新たな読み込みは起きない）
+                # 空のリストだと数値列と判定されて名前が入らないので、型なし（object）の列として渡す
+                companions = st.data_editor(
+                    pd.DataFrame({"同行者": pd.Series([], dtype=object)}),
+                    key=task_key(i, "companions_grid"),
+                    num_rows="dynamic",
+                    use_container_width=True,
+                    column_config={
+                        "同行者": st.column_config.SelectboxColumn(
+                            f"同行者（作業{i}）", options=COMPANION_NAMES,
+                        ),
+                    },
                 )
-                if companion_sel != "同行者なし":
-                    companion_count = int(companion_sel)
-                    for j in range(1, companion_count + 1):
-                        cn = st.selectbox(
-                            f"同行者の名前{j}（作業{i}）",
-                            (
-                                "選択してください",
-                                "吉田", "中村", "渡辺", "福田", "苫米地", "矢部", "小野",
-                                "塩入", "トム", "ユン", "ティエン", "チョン", "アイン"
-                            ),
-                            key=f"companion_name_{i}_{j}"
-                        )
-                        companion_names.append(cn)
-
-            # 「工番＋時間」確認表示（時間は0.25単位で配分）
-            st.markdown("#### 工番＋時間（確認）")
-            if steps >= 1 and all(job_numbers) and work_hours_raw > 0:
-                work_q = quantize_quarter(work_hours_raw)
-                if abs(work_q - work_hours_raw) > 1e-9:
-                    st.info(f"時間{i}は0.25単位で配分するため、{work_hours_raw} → {work_q} に丸めて計算します。")
-
-                alloc = split_hours_quarter(work_q, steps)
-                preview_rows = []
-                for jb, hh in zip(job_numbers, alloc):
-                    preview_rows.append({"工番": jb, "時間": f"{fmt_hours(hh)}時間"})
-                st.table(preview_rows)
-            else:
-                st.caption("工程数・工番・時間を入力すると、ここに配分結果が表示されます。")
+                # 名前が空の行は「選択してください」扱い（送信不可）
+                companion_names = [nm or "選択してください" for nm in companions["同行者"].fillna("")]
+                if len(companion_names) > MAX_COMPANIONS:
+                    st.warning(f"同行者は{MAX_COMPANIONS}人までです（作業{i}：{len(companion_names)}人）。"
+                               "行を減らすと送信できます。")
 
         # ==============================
         # 通常フォーム
         # ==============================
-        number = ""
-        time_txt = ""
+        if not batch:
+            number = ""
+            time_txt = ""
         hours = 0.0
 
-        if ready and not is_special:
+        if ready and not is_special and batch:
+            hours = parse_hours_maybe(time_txt)
+            if time_txt and hours == 0.0:
+                st.info(
+                    f"時間{i}は数値で入力してください（1.5 / １．５ / 1,5 / 1.5h などOK）"
+                )
+        elif ready and not is_special:
             number = st.text_input(
                 f"工番を入力{i}",
-                key=f"number_{i}",
+                key=task_key(i, "number"),
                 placeholder="例: 51A111"
             ).upper().strip()
 
             time_txt = st.text_input(
                 f"時間を入力{i}",
-                key=f"time_{i}",
+                key=task_key(i, "time"),
                 placeholder="例: 1.5（１．５ / 1,5 / 1.5h / 1.5時間 もOK）"
             )
             hours = parse_hours_maybe(time_txt)
@@ -353,9 +411,12 @@ if name != '選択してください':
                 st.info(
                     f"時間{i}は数値で入力してください（1.5 / １．５ / 1,5 / 1.5h などOK）"
                 )
-        elif not ready:
+        elif not ready and not batch:
             st.caption("メーカーと作業内容（雑務以外）を選択すると入力欄が表示されます。")
 
+        if not ready or is_special:
+            number = ""  # まとめて入力モードで入力されていても使わない
+
         return {
             "i": i,
             "customer": customer,
@@ -376,28 +437,16 @@ if name != '選択してください':
         }
 
 
-    # 今表示すべきフォーム数ぶん生成
-    inputs = [create_input_fields(i) for i in range(1, st.session_state.form_count + 1)]
-
-    # 追加ボタン（最大10件）
-    if st.session_state.form_count < 10:
-        if st.button("＋作業を追加"):
-            st.session_state.form_count += 1
-            # rerunなし。即座に行を増やして見せたい場合は st.rerun() が必要だけど
-            # 古いStreamlit端末では使えないのでここは我慢。
-
-    # 入力チェック＋合計時間（専用フォームは複数行送信に展開）
-    valid_inputs = []
-    total_time = 0.0
-
-    for inp in inputs:
+    # 入力チェック＋作業ごとの時間（専用フォームは複数行送信に展開）
+    # 送れる作業なら {"合計時間": 時間} を返す。まだ送れない作業は None
+    def task_hours(inp):
         genre_ok = (
             inp["genre"] != "選択してください"
             or inp["customer"] == "雑務"
         )
 
         if inp["customer"] == "選択してください" or not genre_ok:
-            continue
+            return None
 
         # 専用フォーム（社内トライ/パネル/客先トライ）
         if inp["is_special"]:
@@ -407,12 +456,14 @@ if name != '選択してください':
 
             # 必須チェック
             if steps < 1 or not all(job_numbers) or work_q <= 0:
-                continue
+                return None
 
             # 同行者（客先トライ：作業番号に関係なく）：名前が未選択なら送信不可
             if inp["genre"] == "客先トライ" and inp["companion_names"]:
                 if any(nm == "選択してください" for nm in inp["companion_names"]):
-                    continue
+                    return None
+                if len(inp["companion_names"]) > MAX_COMPANIONS:
+                    return None
 
             inp["alloc_hours"] = split_hours_quarter(work_q, steps)
             inp["work_hours_q"] = work_q
@@ -422,215 +473,211 @@ if name != '選択してください':
                 # 移動時間は0でも送れる（0なら0の行が入る）
                 task_total += max(0.0, inp["move_hours"])
             inp["task_total"] = task_total
-
-            total_time += task_total
-            valid_inputs.append(inp)
-            continue
+            return {"合計時間": task_total}
 
         # 通常フォーム
         if inp["number"] != '' and inp["time"] > 0:
             inp["task_total"] = inp["time"]
-            total_time += inp["time"]
-            valid_inputs.append(inp)
+            return {"合計時間": inp["time"]}
+        return None
 
-    if total_time > 0:
-        st.markdown(f"### ✅ 合計時間: {total_time:.2f} 時間")
+
+    # 今表示すべきフォーム数ぶん生成
+    # 作業ごとに st.fragment。入力した作業だけ再実行される（他の作業の工番・同行者欄は描き直さない）
+    valid_inputs, totals = task_blocks(st.session_state.form_count, create_input_fields, task_hours)
+    total_time = totals.get("合計時間", 0.0)
+
+    # 追加ボタン（最大10件）
+    if st.session_state.form_count < 10:
+        if st.button("＋作業を追加"):
+            st.session_state.form_count += 1
+            # rerunなし。即座に行を増やして見せたい場合は st.rerun() が必要だけど
+            # 古いStreamlit端末では使えないのでここは我慢。
+
+    # 合計時間（作業を入力するたびに差分で更新）
+    show_totals()
 
     # 送信ボタン（送信中ロック中は押せない）
     if valid_inputs and not st.session_state.is_sending:
         if st.button("送信"):
-            st.session_state.is_sending = True  # 二重押し防止
-
-            # === ① Googleシートへの書き込みだけ try/exceptで扱う ===
-            send_ok = False
-            error_msg = ""
-
-            try:
-                # シート確保（準備で失敗してた場合もここで再try）
-                sheet = get_sheet_cached()
-
-                # 送信日時（この送信処理全体で共通 / JST固定）
-                now_dt = datetime.now(JST)
-                sent_dt_text = f"{now_dt.month}月{now_dt.day}日{now_dt.hour}時{now_dt.minute}分"
-
-                def make_sent_header_row(person_name: str) -> list[str]:
-                    # 1列目=送信日時 / 2列目=名前 / 3列目=実際の送信日時
-                    # 既存の列数に合わせて4〜7列目は空欄
-                    return ["送信日時", person_name, sent_dt_text, "", "", "", ""]
-
-                rows_main: list[list[str]] = []
-
-                # 本人分（作業追加も含めて全部）
-                for inp in valid_inputs:
-                    cust_cell = inp["new_customer"] if inp["customer"] == "その他メーカー" else inp["customer"]
-
-                    if inp["is_special"]:
-                        # 客先トライは先頭に「移動」行を追加
-                        if inp["genre"] == "客先トライ":
-                            rows_main.append([
-                                str(day),
-                                name,
-                                "雑務",
-                                "",
-                                "移動",
-                                fmt_hours(max(0.0, inp["move_hours"])),
-                                ""
-                            ])
-
-                        for jb, hh in zip(inp["job_numbers"][:inp["steps"]], inp["alloc_hours"]):
-                            rows_main.append([
-                                str(day),
-                                name,
-                                cust_cell,
-                                inp["genre"],
-                                jb,
-                                fmt_hours(hh),
-                                ""
-                            ])
-                    else:
-                        rows_main.append([
-                            str(day),
-                            name,
-                            cust_cell,
-                            "" if inp["customer"] == "雑務" else inp["genre"],
-                            inp["number"],
-                            fmt_hours(inp["time"]),
-                            ""
-                        ])
-
-                # 「合計」表示は本人分の最後の行だけに付ける
-                if rows_main:
-                    rows_main[-1][6] = f"合計 {total_time:.2f} 時間"
-
-                # 本人ブロックの先頭に「送信日時」行を追加
-                if rows_main:
-                    rows_main = [make_sent_header_row(name)] + rows_main
-
-                # 同行者分（同行者が入力された「客先トライ」作業ごとに複製して送信）
-                rows_companions: list[list[str]] = []
-
-                for src in valid_inputs:
-                    if not (src.get("genre") == "客先トライ" and src.get("companion_names")):
-                        continue
-
-                    cust_cell_src = src["new_customer"] if src["customer"] == "その他メーカー" else src["customer"]
-
-                    # 同行者の合計は「その作業の客先トライ分だけ」（他作業は含めない）
-                    comp_total = float(src.get("task_total", 0.0))
-                    comp_total_text = f"合計 {comp_total:.2f} 時間"
-
-                    for comp_name in src["companion_names"]:
-                        # 同行者ブロックの先頭に「送信日時」行を追加
-                        rows_companions.append(make_sent_header_row(comp_name))
-
-                        # 「移動」行
-                        rows_companions.append([
-                            str(day),
-                            comp_name,
-                            "雑務",
-                            "",
-                            "移動",
-                            fmt_hours(max(0.0, src["move_hours"])),
-                            ""
-                        ])
-
-                        # 工番配分行（最後の工番行の位置を覚える）
-                        last_job_row_idx = None
-                        for jb, hh in zip(src["job_numbers"][:src["steps"]], src["alloc_hours"]):
-                            rows_companions.append([
-                                str(day),
-                                comp_name,
-                                cust_cell_src,
-                                "客先トライ",
-                                jb,
-                                fmt_hours(hh),
-                                ""
-                            ])
-                            last_job_row_idx = len(rows_companions) - 1
-
-                        # 同行者ごとの「合計」は“工番配分の最後の行”に固定
-                        if last_job_row_idx is not None:
-                            rows_companions[last_job_row_idx][6] = comp_total_text
-
-                rows_to_append = rows_main + rows_companions
-
-                sheet.append_rows(
-                    rows_to_append,
-                    value_input_option="USER_ENTERED"
-                )
-
-                send_ok = True
+            # 処理時間の内訳を残す（hokusei_trace）。裏のスレッドの書き込みとは送信IDでつながる
+            trace_id = new_trace_id()
+            with trace(trace_id), span("submit", app="siage"):
+                st.session_state.is_sending = True  # 二重押し防止
 
-            except Exception as e:
+                # === ① アウトボックスへの書き込みだけ try/exceptで扱う ===
+                #     （Googleシートへは裏のスレッドが書く。通信待ちでボタンが固まらない）
                 send_ok = False
-                error_msg = str(e)
-
-            # === ② UIへのメッセージ表示（ここは絶対に落とさない） ===
-            if send_ok:
-                st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
-                st.session_state.just_sent = True
-            else:
-                st.error(f"送信に失敗しました: {error_msg}")
-
-            # === ③ 後片付け（フォーム初期化）は別枠でやる
-            #     ここで失敗してもユーザーには赤いエラーを出さない
-            try:
-                # フォームを1件に戻す／ロック解除
-                st.session_state.form_count = 1
-                st.session_state.is_sending = False
-
-                # 各入力欄を初期値に戻す
-                for i in range(1, 11):
-                    # セレクト系は「選択してください」に戻す
-                    cust_key = f"customer_{i}"
-                    genre_key = f"genre_{i}"
-                    if cust_key in st.session_state:
-                        st.session_state[cust_key] = '選択してください'
-                    if genre_key in st.session_state:
-                        st.session_state[genre_key] = '選択してください'
-
-                    # 専用フォーム系（工程数・工番群・時間など）
-                    steps_key = f"steps_{i}"
-                    if steps_key in st.session_state:
-                        st.session_state[steps_key] = 1
-
-                    for text_key in (
-                        f"new_customer_{i}",
-                        f"number_{i}",
-                        f"time_{i}",
-                        f"work_time_{i}",
-                        f"move_time_{i}",
-                    ):
-                        if text_key in st.session_state:
-                            st.session_state[text_key] = ""
-
-                    # 工番群（最大50までリセット）
-                    for k in range(1, 51):
-                        jk = f"job_{i}_{k}"
-                        if jk in st.session_state:
-                            st.session_state[jk] = ""
-
-                    # 自動入力キャッシュ
-                    ak = f"auto_jobs_{i}"
-                    if ak in st.session_state:
-                        del st.session_state[ak]
-
-                # 同行者（作業1〜10）
-                for i in range(1, 11):
-                    ck = f"companion_count_{i}"
-                    if ck in st.session_state:
-                        st.session_state[ck] = "同行者なし"
-                    for j in range(1, 11):
-                        nk = f"companion_name_{i}_{j}"
-                        if nk in st.session_state:
-                            st.session_state[nk] = "選択してください"
-
-            except Exception:
-                # ここは握りつぶす。送信自体はもう終わってるので
-                st.session_state.is_sending = False
-                pass
+                already_sent = False
+                error_msg = ""
+
+                try:
+                    with span("submit.build_rows") as sp:
+                        # 送信日時（この送信処理全体で共通 / JST固定）
+                        now_dt = datetime.now(JST)
+                        sent_dt_text = f"{now_dt.month}月{now_dt.day}日{now_dt.hour}時{now_dt.minute}分"
+
+                        def make_sent_header_row(person_name: str) -> list[str]:
+                            # 1列目=送信日時 / 2列目=名前 / 3列目=実際の送信日時
+                            # 既存の列数に合わせて4〜7列目は空欄
+                            return ["送信日時", person_name, sent_dt_text, "", "", "", ""]
+
+                        rows_main: list[list[str]] = []
+
+                        # 本人分（作業追加も含めて全部）
+                        for inp in valid_inputs:
+                            cust_cell = inp["new_customer"] if inp["customer"] == "その他メーカー" else inp["customer"]
+
+                            if inp["is_special"]:
+                                # 客先トライは先頭に「移動」行を追加
+                                if inp["genre"] == "客先トライ":
+                                    rows_main.append([
+                                        str(day),
+                                        name,
+                                        "雑務",
+                                        "",
+                                        "移動",
+                                        fmt_hours(max(0.0, inp["move_hours"])),
+                                        ""
+                                    ])
+
+                                for jb, hh in zip(inp["job_numbers"][:inp["steps"]], inp["alloc_hours"]):
+                                    rows_main.append([
+                                        str(day),
+                                        name,
+                                        cust_cell,
+                                        inp["genre"],
+                                        jb,
+                                        fmt_hours(hh),
+                                        ""
+                                    ])
+                            else:
+                                rows_main.append([
+                                    str(day),
+                                    name,
+                                    cust_cell,
+                                    "" if inp["customer"] == "雑務" else inp["genre"],
+                                    inp["number"],
+                                    fmt_hours(inp["time"]),
+                                    ""
+                                ])
+
+                        # 「合計」表示は本人分の最後の行だけに付ける
+                        if rows_main:
+                            rows_main[-1][6] = f"合計 {total_time:.2f} 時間"
+
+                        # 本人ブロックの先頭に「送信日時」行を追加
+                        if rows_main:
+                            rows_main = [make_sent_header_row(name)] + rows_main
+
+                        # 同行者分（同行者が入力された「客先トライ」作業ごとに複製して送信）
+                        rows_companions: list[list[str]] = []
+
+                        for src in valid_inputs:
+                            if not (src.get("genre") == "客先トライ" and src.get("companion_names")):
+                                continue
+
+                            cust_cell_src = src["new_customer"] if src["customer"] == "その他メーカー" else src["customer"]
+
+                            # 同行者の合計は「その作業の客先トライ分だけ」（他作業は含めない）
+                            comp_total = float(src.get("task_total", 0.0))
+                            comp_total_text = f"合計 {comp_total:.2f} 時間"
+
+                            for comp_name in src["companion_names"]:
+                                # 同行者ブロックの先頭に「送信日時」行を追加
+                                rows_companions.append(make_sent_header_row(comp_name))
+
+                                # 「移動」行
+                                rows_companions.append([
+                                    str(day),
+                                    comp_name,
+                                    "雑務",
+                                    "",
+                                    "移動",
+                                    fmt_hours(max(0.0, src["move_hours"])),
+                                    ""
+                                ])
+
+                                # 工番配分行（最後の工番行の位置を覚える）
+                                last_job_row_idx = None
+                                for jb, hh in zip(src["job_numbers"][:src["steps"]], src["alloc_hours"]):
+                                    rows_companions.append([
+                                        str(day),
+                                        comp_name,
+                                        cust_cell_src,
+                                        "客先トライ",
+                                        jb,
+                                        fmt_hours(hh),
+                                        ""
+                                    ])
+                                    last_job_row_idx = len(rows_companions) - 1
+
+                                # 同行者ごとの「合計」は“工番配分の最後の行”に固定
+                                if last_job_row_idx is not None:
+                                    rows_companions[last_job_row_idx][6] = comp_total_text
+
+                        rows_to_append = rows_main + rows_companions
+                        sp["rows"] = len(rows_to_append)
+
+                    # 送信ID：内容から作る。送信日時の行は送るたびに変わるので除く
+                    # （再送・二重押し・別の端末からの同じ送信は1回分しか記録しない）
+                    sid = submission_id(
+                        GOOGLE_SHEET_ID, SHEET_NAME, str(day), name,
+                        [r for r in rows_to_append if r[0] != "送信日時"],
+                    )
+                    add_trace_id(sid)
+                    remember_trace(trace_id, sid)
+
+                    def send(sid, rows=rows_to_append):
+                        st.session_state.outbox_ids = [outbox.enqueue(
+                            GOOGLE_SHEET_ID, SHEET_NAME, "append",
+                            {"rows": rows, "value_input_option": "USER_ENTERED"},
+                            submission_id=sid,
+                            summary=True,  # 日別集計タブにも足す（同行者の分も名前ごとに）
+                        )]
+
+                    with span("submit.enqueue"):
+                        already_sent = outbox.seen(sid) is not None
+                        if not already_sent:
+                            send(sid)
+
+                    send_ok = True
+
+                except Exception as e:
+                    send_ok = False
+                    error_msg = describe_error(e)
+
+                # === ② UIへのメッセージ表示（ここは絶対に落とさない） ===
+                if send_ok and already_sent:
+                    st.info("同じ内容はすでに送信済みです（二重には記録されません）。")
+                    repeat_button(lambda rid=outbox.repeat_id(sid): send(rid))
+                elif send_ok:
+                    st.success("作業内容を送信しました。お疲れ様でした！ 🎉")
+                    st.session_state.just_sent = True
+                else:
+                    st.error(f"送信に失敗しました: {error_msg}")
+
+                # === ③ 後片付け（フォーム初期化）は別枠でやる
+                #     ここで失敗してもユーザーには赤いエラーを出さない
+                try:
+                    with span("submit.cleanup"):
+                        # フォームを1件に戻す／ロック解除
+                        st.session_state.form_count = 1
+                        st.session_state.is_sending = False
+
+                        # 各入力欄を初期値に戻す
+                        # （このセッションで実際に作った入力欄のキーだけ消す。作っていないキーは探さない）
+                        reset_tasks()
+
+                except Exception:
+                    # ここは握りつぶす。送信自体はもう終わってるので
+                    st.session_state.is_sending = False
+                    pass
 
 
     # 送信中ロックが残ってしまった場合の保険
     if st.session_state.is_sending:
         st.info("送信処理中です…数秒待ってください。")
+
+# 直前の送信の処理時間の内訳（URLに ?admin=<admin_token> を付けたときだけ出る）
+trace_panel()
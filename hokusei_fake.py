@@ -0,0 +1,600 @@
+# hokusei_fake.py
+# Googleシートの代わりに使うローカルのシート（ベンチマーク・負荷試験用）
+# - 日報アプリ・アウトボックスが使う gspread の範囲だけを真似る
+# - Googleには一切接続しない（認証もしない）
+# - データはメモリか SQLite ファイルに持つ（SQLite なら複数プロセスで同じシートを共有できる）
+# - 遅延・429・タイムアウトをわざと起こせる（本番と同じ再試行・遮断の処理を通る）
+#
+# secrets の例（[google_cloud] に足す。サービスアカウントの項目はダミーでよい）:
+#   sheets_backend = "local"
+#   local_store = "local-sheets.sqlite3"   # 省略時はメモリ（プロセスが終わると消える）
+#   local_latency_ms = 300                 # 1回の呼び出しにかかる時間
+#   local_jitter_ms = 200                  # 遅延のばらつき（0〜この値を足す）
+#   local_429_rate = 0.05                  # 429 を返す割合
+#   local_quota_per_min = 60               # 1分あたりこの回数を超えたら 429（読み書き別枠、0なら制限なし）
+#   local_timeout_rate = 0.02              # タイムアウトさせる割合
+#   local_timeout_sec = 10                 # タイムアウトまでの時間
+#   local_timeout_applied = 0.5            # タイムアウトした書き込みのうち、実は書けていた割合
+#   local_seed = 1                         # 乱数の種（同じ失敗の並びを再現する）
+#   [google_cloud.local_tabs]              # タブが2つ以上あるスプレッドシート（書かなければ「シート1」だけ）
+#   "<スプレッドシートID>" = ["シート1", "自動運転"]
+
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+DEFAULT_TABS = ("シート1",)
+GRID_ROWS = 1000  # 新しいタブの行数（Google と同じ）
+_SHEETS_EPOCH = date(1899, 12, 30)
+_A1_RE = re.compile(r"^(?:'?(?P<title>[^'!]+)'?!)?(?P<c1>[A-Z]+)(?P<r1>\d*)(?::(?P<c2>[A-Z]+)(?P<r2>\d*))?$")
+
+
+def _col_number(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - ord("A") + 1)
+    return n
+
+
+def _col_letters(n: int) -> str:
+    out = ""
+    while n:
+        n, r = divmod(n - 1, 26)
+        out = chr(ord("A") + r) + out
+    return out
+
+
+def _display(value) -> str:
+    """セルの表示値（get_all_values と同じく文字列で持つ）"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _from_cell_data(cell: dict) -> str:
+    """batchUpdate の CellData を表示値に戻す（to_cell の逆）"""
+    v = cell.get("userEnteredValue") or {}
+    if "numberValue" in v:
+        fmt = ((cell.get("userEnteredFormat") or {}).get("numberFormat") or {}).get("type")
+        if fmt == "DATE":
+            return (_SHEETS_EPOCH + timedelta(days=int(v["numberValue"]))).isoformat()
+        return _display(v["numberValue"])
+    for k in ("stringValue", "formulaValue"):
+        if k in v:
+            return v[k]
+    if "boolValue" in v:
+        return _display(v["boolValue"])
+    return ""
+
+
+########################################
+# 保存先（メモリ / SQLite）
+########################################
+
+class MemoryStore:
+    """セルをメモリに持つ（プロセスの中だけで共有）"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tabs: dict[str, list[str]] = {}               # スプレッドシートID → タブ名（並び順が sheetId）
+        self._rows: dict[tuple, list[list[str]]] = {}       # (スプレッドシートID, sheetId) → 行
+        self._versions: dict[str, int] = {}                 # スプレッドシートID → 版（Drive の version の代わり）
+
+    def tabs(self, spreadsheet_id: str, default=DEFAULT_TABS) -> list[str]:
+        with self._lock:
+            return list(self._tabs.setdefault(spreadsheet_id, list(default)))
+
+    def add_tab(self, spreadsheet_id: str, title: str) -> int:
+        with self._lock:
+            tabs = self._tabs.setdefault(spreadsheet_id, [])
+            tabs.append(title)
+            self._bump(spreadsheet_id)
+            return len(tabs) - 1
+
+    def version(self, spreadsheet_id: str) -> int:
+        with self._lock:
+            return self._versions.get(spreadsheet_id, 1)
+
+    def _bump(self, spreadsheet_id: str):
+        self._versions[spreadsheet_id] = self._versions.get(spreadsheet_id, 1) + 1
+
+    @contextmanager
+    def transaction(self):
+        with self._lock:
+            yield self
+
+    def rows(self, spreadsheet_id: str, sheet_id: int) -> list[list[str]]:
+        rows = self._rows.get((spreadsheet_id, sheet_id), [])
+        return [list(r) for r in rows[:self.last_row(spreadsheet_id, sheet_id)]]
+
+    def last_row(self, spreadsheet_id: str, sheet_id: int) -> int:
+        rows = self._rows.get((spreadsheet_id, sheet_id), [])
+        n = len(rows)
+        while n and not any(c != "" for c in rows[n - 1]):
+            n -= 1
+        return n
+
+    def set_cells(self, spreadsheet_id: str, sheet_id: int, cells):
+        self._bump(spreadsheet_id)
+        rows = self._rows.setdefault((spreadsheet_id, sheet_id), [])
+        for row, col, value in cells:
+            while len(rows) < row:
+                rows.append([])
+            while len(rows[row - 1]) < col:
+                rows[row - 1].append("")
+            rows[row - 1][col - 1] = value
+
+
+_STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tabs (
+    spreadsheet_id TEXT    NOT NULL,
+    sheet_id       INTEGER NOT NULL,
+    title          TEXT    NOT NULL,
+    PRIMARY KEY (spreadsheet_id, sheet_id)
+);
+CREATE TABLE IF NOT EXISTS cells (
+    spreadsheet_id TEXT    NOT NULL,
+    sheet_id       INTEGER NOT NULL,
+    row            INTEGER NOT NULL,
+    col            INTEGER NOT NULL,
+    value          TEXT    NOT NULL,   -- 空のセルは行を持たない
+    PRIMARY KEY (spreadsheet_id, sheet_id, row, col)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS versions (
+    spreadsheet_id TEXT    PRIMARY KEY,
+    version        INTEGER NOT NULL    -- 書くたびに増える（Drive の version の代わり）
+);
+"""
+
+
+class SqliteStore:
+    """セルを SQLite ファイルに持つ（複数プロセスのアプリ・負荷試験ツールで同じシートを見る）
+
+    追記は BEGIN IMMEDIATE の中で「最終行を調べて書く」ので、同時に追記しても行が重ならない。
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._local = threading.local()
+        db = self._db()
+        db.executescript(_STORE_SCHEMA)
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def tabs(self, spreadsheet_id: str, default=DEFAULT_TABS) -> list[str]:
+        with self.transaction():
+            found = [t for (t,) in self._db().execute(
+                "SELECT title FROM tabs WHERE spreadsheet_id = ? ORDER BY sheet_id", (spreadsheet_id,))]
+            if not found:
+                for title in default:
+                    self.add_tab(spreadsheet_id, title)
+                found = list(default)
+        return found
+
+    def add_tab(self, spreadsheet_id: str, title: str) -> int:
+        with self.transaction():
+            db = self._db()
+            (n,) = db.execute("SELECT COUNT(*) FROM tabs WHERE spreadsheet_id = ?", (spreadsheet_id,)).fetchone()
+            db.execute("INSERT INTO tabs VALUES (?, ?, ?)", (spreadsheet_id, n, title))
+            self._bump(spreadsheet_id)
+        return n
+
+    def version(self, spreadsheet_id: str) -> int:
+        row = self._db().execute("SELECT version FROM versions WHERE spreadsheet_id = ?", (spreadsheet_id,)).fetchone()
+        return row[0] if row else 1
+
+    def _bump(self, spreadsheet_id: str):
+        self._db().execute(
+            "INSERT INTO versions VALUES (?, 2) ON CONFLICT (spreadsheet_id) DO UPDATE SET version = version + 1",
+            (spreadsheet_id,))
+
+    @contextmanager
+    def transaction(self):
+        db = self._db()
+        if db.in_transaction:
+            yield self  # 入れ子（tabs の中の add_tab など）は外側のトランザクションに入れる
+            return
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def rows(self, spreadsheet_id: str, sheet_id: int) -> list[list[str]]:
+        out: list[list[str]] = []
+        for row, col, value in self._db().execute(
+                "SELECT row, col, value FROM cells WHERE spreadsheet_id = ? AND sheet_id = ? ORDER BY row, col",
+                (spreadsheet_id, sheet_id)):
+            while len(out) < row:
+                out.append([])
+            cells = out[row - 1]
+            cells.extend([""] * (col - len(cells)))
+            cells[col - 1] = value
+        return out
+
+    def last_row(self, spreadsheet_id: str, sheet_id: int) -> int:
+        (n,) = self._db().execute(
+            "SELECT MAX(row) FROM cells WHERE spreadsheet_id = ? AND sheet_id = ?",
+            (spreadsheet_id, sheet_id)).fetchone()
+        return n or 0
+
+    def set_cells(self, spreadsheet_id: str, sheet_id: int, cells):
+        db = self._db()
+        self._bump(spreadsheet_id)
+        for row, col, value in cells:
+            if value == "":
+                db.execute("DELETE FROM cells WHERE spreadsheet_id = ? AND sheet_id = ? AND row = ? AND col = ?",
+                           (spreadsheet_id, sheet_id, row, col))
+            else:
+                db.execute("INSERT OR REPLACE INTO cells VALUES (?, ?, ?, ?, ?)",
+                           (spreadsheet_id, sheet_id, row, col, value))
+
+
+_stores: dict = {}
+_stores_lock = threading.Lock()
+
+def open_store(path: str | None = None):
+    """保存先をプロセスで1つだけ開く（None / ":memory:" ならメモリ）"""
+    key = str(path or ":memory:")
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = MemoryStore() if key == ":memory:" else SqliteStore(key)
+        return store
+
+
+########################################
+# わざと起こす遅延・429・タイムアウト
+########################################
+
+class _FakeResponse:
+    """gspread.exceptions.APIError に渡す応答（requests.Response の使う所だけ）"""
+
+    def __init__(self, code: int, status: str, message: str, retry_after: int | None = None):
+        self.status_code = code
+        self.text = message
+        self.headers = {"Retry-After": str(retry_after)} if retry_after else {}
+        self._error = {"code": code, "status": status, "message": message}
+
+    def json(self):
+        return {"error": self._error}
+
+
+def grid_error(row: int, row_count: int):
+    """シートの行数より下に values.update したときの 400（gspread.exceptions.APIError）"""
+    from gspread.exceptions import APIError
+    return APIError(_FakeResponse(
+        400, "INVALID_ARGUMENT",
+        f"Range exceeds grid limits. Max rows: {row_count}, requested row: {row}"))
+
+
+def quota_error():
+    """Google が返すのと同じ形の 429（gspread.exceptions.APIError）"""
+    from gspread.exceptions import APIError
+    return APIError(_FakeResponse(
+        429, "RESOURCE_EXHAUSTED",
+        "Quota exceeded for quota metric 'Write requests' (local fault injection)"))
+
+
+class Faults:
+    """呼び出しごとに遅延を入れ、決めた割合で 429・タイムアウトを起こす"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, rate_429: float = 0,
+                 quota_per_min: int = 0, timeout_rate: float = 0, timeout_sec: float = 10,
+                 timeout_applied: float = 0.5, seed=None):
+        self.latency_sec = latency_ms / 1000.0
+        self.jitter_sec = jitter_ms / 1000.0
+        self.rate_429 = rate_429
+        self.quota_per_min = quota_per_min
+        self.timeout_rate = timeout_rate
+        self.timeout_sec = timeout_sec
+        self.timeout_applied = timeout_applied
+        self._random = random.Random(seed)
+        self._calls = {True: deque(), False: deque()}  # 読み/書き → 直近1分の呼び出し時刻
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "429": 0, "timeout": 0, "timeout_applied": 0}
+
+    def _roll(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def _over_quota(self, is_read: bool) -> bool:
+        if not self.quota_per_min:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            calls = self._calls[is_read]
+            while calls and now - calls[0] > 60:
+                calls.popleft()
+            if len(calls) >= self.quota_per_min:
+                return True
+            calls.append(now)
+            return False
+
+    def apply(self, call, is_read: bool):
+        with self._lock:
+            self.counts["calls"] += 1
+            delay = self.latency_sec + self._random.uniform(0, self.jitter_sec)
+        if self._over_quota(is_read) or self._roll() < self.rate_429:
+            time.sleep(delay)
+            with self._lock:
+                self.counts["429"] += 1
+            raise quota_error()
+        if self._roll() < self.timeout_rate:
+            time.sleep(self.timeout_sec)
+            # 書き込みは Google 側で処理されたのに応答だけ届かないことがある（再送すると二重になる）
+            if not is_read and self._roll() < self.timeout_applied:
+                call()
+                with self._lock:
+                    self.counts["timeout_applied"] += 1
+            with self._lock:
+                self.counts["timeout"] += 1
+            raise TimeoutError("local sheets: timed out (fault injection)")
+        time.sleep(delay)
+        return call()
+
+
+########################################
+# gspread の代わり
+########################################
+
+class FakeAuth:
+    """prewarm がトークンの期限を見るための偽の認証情報（期限切れにならない）"""
+
+    def __init__(self):
+        self.expiry = datetime.utcnow() + timedelta(days=3650)
+
+    def refresh(self, request):
+        pass
+
+
+class FakeHTTPClient:
+    def __init__(self):
+        self.auth = FakeAuth()
+
+
+class FakeWorksheet:
+    def __init__(self, spreadsheet: "FakeSpreadsheet", sheet_id: int, title: str):
+        self.spreadsheet = spreadsheet
+        self.id = sheet_id
+        self.title = title
+
+    # --- 内部 ---
+
+    def _call(self, fn, is_read: bool, op: str, rows: int = 0):
+        return self.spreadsheet.client._call(fn, is_read, op, self.spreadsheet.id, rows)
+
+    def _append(self, store, values: list[list[str]]) -> str:
+        """store のトランザクションの中で呼ぶ"""
+        sid = self.spreadsheet.id
+        start = store.last_row(sid, self.id) + 1
+        store.set_cells(sid, self.id, [
+            (start + r, c + 1, v) for r, row in enumerate(values) for c, v in enumerate(row)])
+        width = max((len(r) for r in values), default=1) or 1
+        return f"'{self.title}'!A{start}:{_col_letters(width)}{start + len(values) - 1}"
+
+    def _rows(self) -> list[list[str]]:
+        store = self.spreadsheet.store
+        with store.transaction():
+            return store.rows(self.spreadsheet.id, self.id)
+
+    def _set_cells(self, cells: list[tuple]):
+        """values.update / batchUpdate：グリッドの外に書こうとしたら 400（append と違って行は増えない）"""
+        store = self.spreadsheet.store
+        with store.transaction():
+            row_count = self.row_count
+            last = max((r for r, _, _ in cells), default=0)
+            if last > row_count:
+                raise grid_error(last, row_count)
+            store.set_cells(self.spreadsheet.id, self.id, cells)
+
+    @property
+    def row_count(self) -> int:
+        """グリッドの行数（add_rows で増やした分か、append で書かれた最後の行まで）"""
+        grid = self.spreadsheet.client._grid.get((self.spreadsheet.id, self.id), GRID_ROWS)
+        return max(grid, self.spreadsheet.store.last_row(self.spreadsheet.id, self.id))
+
+    # --- gspread.Worksheet と同じ名前の操作 ---
+
+    def append_rows(self, values, value_input_option="RAW", table_range=None, **kwargs):
+        rows = [[_display(v) for v in row] for row in values]
+
+        def call():
+            store = self.spreadsheet.store
+            with store.transaction():
+                updated = self._append(store, rows)
+            return {"updates": {"updatedRange": updated, "updatedRows": len(rows)}}
+        return self._call(call, is_read=False, op="values.append", rows=len(rows))
+
+    def append_row(self, values, value_input_option="RAW", **kwargs):
+        return self.append_rows([values], value_input_option=value_input_option)
+
+    @staticmethod
+    def _cells(values, range_name) -> list[tuple]:
+        m = _A1_RE.match(range_name or "A1")
+        if not m:
+            raise ValueError(f"unsupported range: {range_name}")
+        row0 = int(m.group("r1") or 1)
+        col0 = _col_number(m.group("c1"))
+        return [(row0 + r, col0 + c, _display(v)) for r, row in enumerate(values or []) for c, v in enumerate(row)]
+
+    def update(self, values=None, range_name=None, value_input_option="RAW", **kwargs):
+        cells = self._cells(values, range_name)
+
+        def call():
+            self._set_cells(cells)
+            return {"updatedRange": f"'{self.title}'!{range_name}"}
+        return self._call(call, is_read=False, op="values.update", rows=len(values or []))
+
+    def batch_update(self, data: list[dict], value_input_option="RAW", **kwargs):
+        """複数の範囲を1回で書く（data は {"range": A1, "values": 行} のリスト）"""
+        cells = [c for d in data for c in self._cells(d["values"], d["range"])]
+
+        def call():
+            self._set_cells(cells)
+            return {"totalUpdatedRows": sum(len(d["values"]) for d in data)}
+        return self._call(call, is_read=False, op="values.batchUpdate", rows=sum(len(d["values"]) for d in data))
+
+    def add_rows(self, rows: int):
+        def call():
+            self.spreadsheet.client._grid[(self.spreadsheet.id, self.id)] = self.row_count + rows
+        return self._call(call, is_read=False, op="batchUpdate")
+
+    def update_cell(self, row: int, col: int, value):
+        return self.update([[value]], range_name=f"{_col_letters(col)}{row}")
+
+    def col_values(self, col: int, **kwargs) -> list[str]:
+        def call():
+            values = [r[col - 1] if len(r) >= col else "" for r in self._rows()]
+            while values and values[-1] == "":
+                values.pop()
+            return values
+        return self._call(call, is_read=True, op="values.get")
+
+    def get_all_values(self, **kwargs) -> list[list[str]]:
+        def call():
+            rows = self._rows()
+            width = max((len(r) for r in rows), default=0)
+            return [r + [""] * (width - len(r)) for r in rows]
+        return self._call(call, is_read=True, op="values.get")
+
+    def get(self, range_name=None, **kwargs) -> list[list[str]]:
+        """A1形式の範囲の値（"H5:H" のような終わりなしの範囲も可）"""
+        m = _A1_RE.match(range_name or "")
+        if not m:
+            raise ValueError(f"unsupported range: {range_name}")
+        c1 = _col_number(m.group("c1"))
+        c2 = _col_number(m.group("c2") or m.group("c1"))
+        r1 = int(m.group("r1") or 1)
+
+        def call():
+            rows = self._rows()
+            r2 = int(m.group("r2") or len(rows))
+            out = []
+            for r in range(r1, min(r2, len(rows)) + 1):
+                cells = rows[r - 1]
+                out.append([cells[c - 1] if len(cells) >= c else "" for c in range(c1, c2 + 1)])
+            while out and not any(out[-1]):
+                out.pop()
+            return out
+        return self._call(call, is_read=True, op="values.get")
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeClient", spreadsheet_id: str, tabs=DEFAULT_TABS):
+        self.client = client
+        self.store = client.store
+        self.id = spreadsheet_id
+        self._default_tabs = tuple(tabs)
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> FakeWorksheet:
+        return self.client._call(
+            lambda: FakeWorksheet(self, self.store.add_tab(self.id, title), title), False, "batchUpdate", self.id)
+
+    def worksheets(self, **kwargs) -> list[FakeWorksheet]:
+        return self.client._call(lambda: [
+            FakeWorksheet(self, i, title)
+            for i, title in enumerate(self.store.tabs(self.id, self._default_tabs))], True, "get", self.id)
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        for ws in self.worksheets():
+            if ws.title == title:
+                return ws
+        raise KeyError(f"worksheet not found: {title}")
+
+    @property
+    def sheet1(self) -> FakeWorksheet:
+        return self.worksheets()[0]
+
+    def batch_update(self, body: dict) -> dict:
+        """appendCells だけ対応。全部のリクエストを1つのトランザクションで適用する（途中で止まらない）"""
+        for req in body.get("requests", []):
+            if "appendCells" not in req:
+                raise ValueError(f"unsupported request: {list(req)}")  # 本物の API では 400 になる
+
+        def call():
+            replies = []
+            with self.store.transaction():
+                by_id = {i: FakeWorksheet(self, i, t)
+                         for i, t in enumerate(self.store.tabs(self.id, self._default_tabs))}
+                for req in body["requests"]:
+                    ac = req["appendCells"]
+                    rows = [[_from_cell_data(c) for c in r.get("values", [])] for r in ac.get("rows", [])]
+                    by_id[ac["sheetId"]]._append(self.store, rows)
+                    replies.append({})
+            return {"spreadsheetId": self.id, "replies": replies}
+        rows = sum(len(req["appendCells"].get("rows", [])) for req in body["requests"])
+        return self.client._call(call, False, "batchUpdate", self.id, rows)
+
+
+class FakeClient:
+    """gspread.Client の代わり（open_by_key だけ）
+
+    guarded=True なら呼び出しを hokusei_sheets.guarded_call に通す
+    （本番の GuardedHTTPClient と同じ流量制限・再試行・遮断が効く）。
+    """
+
+    def __init__(self, tabs: dict | None = None, store=None, faults: Faults | None = None,
+                 guarded: bool = False):
+        # tabs: {spreadsheet_id: [タブ名, ...]}。書いていないスプレッドシートは DEFAULT_TABS
+        self.http_client = FakeHTTPClient()
+        self.store = store if store is not None else MemoryStore()
+        self.faults = faults
+        self.guarded = guarded
+        self._tabs = dict(tabs or {})
+        self._grid: dict = {}  # (スプレッドシート, タブ) → add_rows で増やしたあとの行数
+
+    def _call(self, fn, is_read: bool, op: str, spreadsheet_id: str, rows: int = 0):
+        """op は Sheets API の操作名（数値のラベルを本番とそろえる）"""
+        call = fn if self.faults is None else (lambda: self.faults.apply(fn, is_read))
+        if not self.guarded:
+            return call()
+        from hokusei_sheets import guarded_call, read_bucket, write_bucket
+        return guarded_call(call, is_read, read_bucket if is_read else write_bucket,
+                            op=op, spreadsheet=spreadsheet_id, rows=rows)
+
+    def drive_version(self, spreadsheet_id: str) -> str:
+        """Drive の files.get(fields=version) の代わり（hokusei_sheets.drive_version から呼ばれる）"""
+        return self._call(lambda: str(self.store.version(spreadsheet_id)), True, "drive.files", spreadsheet_id)
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        sh = FakeSpreadsheet(self, key, self._tabs.get(key, DEFAULT_TABS))
+        sh.worksheets()  # 本番と同じくメタデータを1回取りに行く（タブもここで作られる）
+        return sh
+
+
+def local_client(info: dict) -> FakeClient:
+    """secrets の local_* の設定からローカルのシートのクライアントを作る（get_client から呼ばれる）"""
+    return FakeClient(
+        tabs={k: list(v) for k, v in dict(info.get("local_tabs") or {}).items()},
+        store=open_store(info.get("local_store")),
+        faults=Faults(
+            latency_ms=float(info.get("local_latency_ms", 0)),
+            jitter_ms=float(info.get("local_jitter_ms", 0)),
+            rate_429=float(info.get("local_429_rate", 0)),
+            quota_per_min=int(info.get("local_quota_per_min", 0)),
+            timeout_rate=float(info.get("local_timeout_rate", 0)),
+            timeout_sec=float(info.get("local_timeout_sec", 10)),
+            timeout_applied=float(info.get("local_timeout_applied", 0.5)),
+            seed=info.get("local_seed"),
+        ),
+        guarded=True,
+    )
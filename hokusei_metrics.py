@@ -0,0 +1,445 @@
+# hokusei_metrics.py
+# 日報アプリ共通：動作状況の数値（Prometheus のテキスト形式）
+# - Googleシートの呼び出し（操作・スプレッドシート・時間・行数・エラー・429）
+# - 画面の再実行にかかった時間（全体 / 作業ブロックだけ）
+# - 送信してからシートに書けるまでの時間、アウトボックスの未反映件数
+# - Streamlit のサーバー（Tornado）に /_hokusei/metrics を足して公開する
+# - 同じく /_hokusei/health：正常か・アウトボックスの件数と経過秒を JSON で返す（アプリのスクリプトもGoogleも呼ばない）
+# - 経路はサーバーが立ち上がるときに足す（hokusei_server.py で起動する。streamlit run では出ないのでログで知らせる）
+#
+# 数値はプロセスの中だけで持つ（再起動で0に戻る。Prometheus 側は counter のリセットとして扱う）。
+# 計測で画面や書き込みを止めないよう、ここでの失敗はすべて握りつぶす。
+
+import logging
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+_log = logging.getLogger(__name__)
+
+METRICS_PATH = "_hokusei/metrics"
+HEALTH_PATH = "_hokusei/health"
+HEALTH_STALE_SEC = 600  # 一番古い未反映がこの秒数を超えたら不調（503）にする
+TESTED_STREAMLIT = ("1.37.",)  # 経路を足す仕組み（Server._create_app を包む）を確かめた Streamlit の版
+
+# 秒のヒストグラムの区切り（Sheets API は普段0.3〜1秒、混雑時は数十秒）
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+########################################
+# 数値の種類
+########################################
+
+def _label_text(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(n, "")) for n in self.labels)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """増えるだけの回数"""
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, k)} {_number(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    """時間などの分布（区切りごとの累積件数・合計・件数）"""
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = SECONDS_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._values: dict[tuple, list] = {}  # ラベル → [区切りごとの件数..., 合計, 件数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    v[i] += 1
+                    break
+            v[-2] += value
+            v[-1] += 1
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        out = []
+        for key, v in items:
+            total = 0
+            for i, upper in enumerate(self.buckets):
+                total += v[i]
+                le = 'le="' + _number(upper) + '"'
+                out.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {total}")
+            out.append(f"{self.name}_sum{_label_text(self.labels, key)} {_number(v[-2])}")
+            out.append(f"{self.name}_count{_label_text(self.labels, key)} {v[-1]}")
+        return out
+
+
+class Gauge(_Metric):
+    """今の値（読み出すときに関数を呼んで求める）"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self._funcs: dict[tuple, object] = {}
+
+    def track(self, func, **labels):
+        """読み出すたびに func() の値を出す（同じラベルなら上書き）"""
+        with self._lock:
+            self._funcs[self._key(labels)] = func
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            items = sorted(self._funcs.items(), key=lambda kv: kv[0])
+        out = []
+        for key, func in items:
+            try:
+                out.append(f"{self.name}{_label_text(self.labels, key)} {_number(func())}")
+            except Exception:
+                pass  # 読めない値は出さない
+        return out
+
+
+_registry: list[_Metric] = []
+
+
+def render() -> str:
+    """全部の数値を Prometheus のテキスト形式で返す"""
+    return "\n".join(line for m in list(_registry) for line in m.render()) + "\n"
+
+
+########################################
+# 数値の一覧
+########################################
+
+SHEETS_REQUESTS = Counter(
+    "hokusei_sheets_requests_total",
+    "Googleシートへの呼び出し回数（再試行は1回ずつ数える）。outcome: ok / quota / auth / server_error / "
+    "client_error / timeout / breaker_open / error",
+    ("op", "spreadsheet", "outcome"),
+)
+SHEETS_SECONDS = Histogram(
+    "hokusei_sheets_request_seconds",
+    "Googleシートへの1回の呼び出しにかかった時間（秒）",
+    ("op", "spreadsheet"),
+)
+SHEETS_ROWS = Counter(
+    "hokusei_sheets_rows_total",
+    "Googleシートに書いた行数（書けた呼び出しだけ）",
+    ("op", "spreadsheet"),
+)
+RERUN_SECONDS = Histogram(
+    "hokusei_rerun_seconds",
+    "画面の再実行にかかった時間（秒）。scope: full（全体）/ fragment（作業ブロックだけ）",
+    ("app", "scope", "result"),
+)
+SUBMIT_ACK_SECONDS = Histogram(
+    "hokusei_submit_ack_seconds",
+    "送信ボタンでアウトボックスに入ってからシートに書けるまでの時間（秒）",
+    ("outbox",),
+)
+OUTBOX_FAILURES = Counter(
+    "hokusei_outbox_failures_total",
+    "アウトボックスの書き込み失敗（再送待ち・dead になった回数）",
+    ("outbox", "status"),
+)
+OUTBOX_DEPTH = Gauge(
+    "hokusei_outbox_pending",
+    "アウトボックスのシート未反映の件数",
+    ("outbox",),
+)
+SESSION_STATE_BYTES = Gauge(
+    "hokusei_session_state_bytes",
+    "セッションの状態（st.session_state）のおおよそのバイト数。最近のセッションの stat: max / p50 / sum",
+    ("stat",),
+)
+SESSION_STATE_SESSIONS = Gauge(
+    "hokusei_session_state_sessions",
+    "状態のバイト数を記録している最近のセッション数",
+)
+
+
+########################################
+# 再実行の時間
+########################################
+
+_STOP_RESULTS = {
+    "SCRIPT_STOPPED_WITH_SUCCESS": "ok",
+    "FRAGMENT_STOPPED_WITH_SUCCESS": "ok",
+    "SCRIPT_STOPPED_WITH_COMPILE_ERROR": "compile_error",
+    "SCRIPT_STOPPED_FOR_RERUN": "interrupted",
+}
+
+_APP_KEY = "_metrics_app"               # セッションに覚えるアプリ名（作業ブロックの計測用）
+_runners = weakref.WeakKeyDictionary()  # ScriptRunner → [アプリ名, 開始時刻, scope]
+_runners_lock = threading.Lock()
+
+
+@contextmanager
+def fragment_timer():
+    """作業ブロックだけの再実行の時間を測る（hokusei_tasks から使う）
+
+    作業ブロックだけの再実行ではスクリプトの先頭（instrument_app）を通らないので、ここで測る。
+    """
+    t0 = time.perf_counter()
+    result = "ok"
+    try:
+        yield
+    except BaseException:
+        result = "rerun"  # st.rerun() で全体の再実行に切り替えた
+        raise
+    finally:
+        app = _app_of_session()
+        if app:
+            RERUN_SECONDS.observe(time.perf_counter() - t0, app=app, scope="fragment", result=result)
+
+
+def _app_of_session() -> str | None:
+    try:
+        import streamlit as st
+        return st.session_state.get(_APP_KEY)
+    except Exception:
+        return None
+
+
+def _on_script_event(runner, event=None, fragment_ids_this_run=None, **kwargs):
+    name = getattr(event, "name", "")
+    with _runners_lock:
+        state = _runners.get(runner)
+    if state is None:
+        return
+    if name == "SCRIPT_STARTED":
+        state[1] = time.perf_counter()
+        state[2] = "fragment" if fragment_ids_this_run else "full"
+    elif name in _STOP_RESULTS and state[1] is not None:
+        RERUN_SECONDS.observe(time.perf_counter() - state[1], app=state[0], scope=state[2],
+                              result=_STOP_RESULTS[name])
+        state[1] = None
+
+
+def _track_reruns(app: str):
+    """このセッションの ScriptRunner の開始・終了の知らせを受けて時間を測る
+
+    ScriptRunner は全体の再実行ごとに作り直されるので、毎回スクリプトの先頭でつなぐ。
+    """
+    import streamlit as st
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    st.session_state[_APP_KEY] = app
+    ctx = get_script_run_ctx()
+    if ctx is None or not Runtime.exists():
+        return
+    info = Runtime.instance()._session_mgr.get_active_session_info(ctx.session_id)
+    runner = getattr(info.session, "_scriptrunner", None) if info else None
+    if runner is None:
+        return
+    with _runners_lock:
+        if runner in _runners:
+            return
+        # この回は開始の知らせがもう過ぎているので、今（スクリプトの先頭）を開始とする
+        _runners[runner] = [app, time.perf_counter(), "full"]
+    runner.on_event.connect(_on_script_event, weak=False)
+
+
+########################################
+# 公開（Tornado に経路を足す）
+########################################
+
+_routes_mounted = False
+_routes_warned = False
+
+
+def mount_routes(app):
+    """Tornado アプリに /_hokusei/metrics と /_hokusei/health を足す（server.baseUrlPath も考える）
+
+    Streamlit の静的ファイルの経路（何にでも一致する）より前に入るよう add_handlers を使う。
+    """
+    global _routes_mounted
+    from streamlit import config
+    from streamlit.web.server.server_util import make_url_path_regex
+
+    base = config.get_option("server.baseUrlPath")
+    app.add_handlers(r".*", [
+        (make_url_path_regex(base, METRICS_PATH), _metrics_handler()),
+        (make_url_path_regex(base, HEALTH_PATH), _health_handler()),
+    ])
+    _routes_mounted = True
+
+
+def install_routes() -> bool:
+    """Streamlit のサーバーが Tornado アプリを作るときに mount_routes するようにする（起動前に1回呼ぶ）
+
+    Streamlit には経路を足す仕組みがないので、アプリを作る内部のメソッド（Server._create_app）を包む。
+    内部のメソッドなので、なくなっていたらログに出して何もしない（アプリはそのまま動く）。
+    確かめていない版でも試すが、ログに出しておく。足せるようにしたら True。
+    """
+    import streamlit
+
+    try:
+        from streamlit.web.server.server import Server
+        create_app = Server._create_app
+    except (ImportError, AttributeError):
+        _log.warning("metrics: Streamlit %s cannot mount /%s and /%s (Server._create_app not found)",
+                     streamlit.__version__, METRICS_PATH, HEALTH_PATH)
+        return False
+    if getattr(create_app, "_hokusei_routes", False):
+        return True
+    if not streamlit.__version__.startswith(TESTED_STREAMLIT):
+        _log.warning("metrics: mounting /%s and /%s on untested Streamlit %s",
+                     METRICS_PATH, HEALTH_PATH, streamlit.__version__)
+
+    def _create_app(self):
+        app = create_app(self)
+        try:
+            mount_routes(app)
+        except Exception:
+            _log.warning("metrics: could not mount /%s and /%s", METRICS_PATH, HEALTH_PATH, exc_info=True)
+        return app
+
+    _create_app._hokusei_routes = True
+    Server._create_app = _create_app
+    return True
+
+
+def _warn_if_unmounted():
+    """streamlit run で起動されて経路がないときは、最初の画面表示で1回だけログに出す"""
+    global _routes_warned
+    if _routes_mounted or _routes_warned:
+        return
+    _routes_warned = True
+    _log.warning("metrics: /%s and /%s are not served; start the app with "
+                 "`python hokusei_server.py <app>.py` (streamlit run only has /_stcore/health)",
+                 METRICS_PATH, HEALTH_PATH)
+
+
+def _metrics_handler():
+    import tornado.web
+
+    class MetricsHandler(tornado.web.RequestHandler):
+        def get(self):
+            self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.set_header("Cache-Control", "no-cache")
+            self.write(render())
+
+    return MetricsHandler
+
+
+_PROBLEM_OF_KIND = {"auth": "auth_failed", "quota": "throttled", "breaker_open": "breaker_open"}
+
+
+def health() -> tuple[bool, dict]:
+    """(正常か, 内訳)。内訳は状態・問題の種類・アウトボックスごとの件数と経過秒だけ
+
+    メモリとローカルのSQLiteを見るだけなので、監視から何回叩かれてもAPIの回数を使わない。
+    認証なしで公開するので、サービスアカウント名やエラーの文面は出さない（問題は種類だけ）。
+    問題: breaker_open / throttled / auth_failed / connection_<種類> / connecting /
+    outbox_dead:<名前> / outbox_stale:<名前> / outbox_stopped:<名前>
+    """
+    from hokusei_outbox import outbox_health
+    from hokusei_sheets import connection_health
+
+    conn = connection_health()
+    problems = []
+    if conn["breaker_open"]:
+        problems.append("breaker_open")
+    if conn["throttled"]:
+        problems.append("throttled")
+    kinds = [c["error_kind"] for c in conn["connections"].values()]
+    outboxes = {}
+    for name, ob in outbox_health().items():
+        if ob["error_kind"]:
+            kinds.append(ob["error_kind"])
+        if ob["dead"]:
+            problems.append(f"outbox_dead:{name}")
+        if (ob["oldest_pending_sec"] or 0) > HEALTH_STALE_SEC:
+            problems.append(f"outbox_stale:{name}")
+        if not ob["flusher_alive"]:
+            problems.append(f"outbox_stopped:{name}")
+        outboxes[name] = {k: ob[k] for k in ("pending", "dead", "oldest_pending_sec", "last_write_sec_ago")}
+    # 接続の失敗は種類ごとに出す（鍵・権限 / 混雑 / 遮断中 / タイムアウトなど）
+    for kind in kinds:
+        code = _PROBLEM_OF_KIND.get(kind, f"connection_{kind}") if kind else None
+        if code and code not in problems:
+            problems.append(code)
+    if any(not c["ready"] and not c["error_kind"] for c in conn["connections"].values()):
+        problems.append("connecting")
+    body = {"status": "degraded" if problems else "ok", "problems": problems, "outboxes": outboxes}
+    return not problems, body
+
+
+def _health_handler():
+    import json
+
+    import tornado.web
+
+    class HealthHandler(tornado.web.RequestHandler):
+        def get(self):
+            ok, body = health()
+            self.set_status(200 if ok else 503)
+            self.set_header("Content-Type", "application/json; charset=utf-8")
+            self.set_header("Cache-Control", "no-cache")
+            self.write(json.dumps(body, ensure_ascii=False))
+
+    return HealthHandler
+
+
+def instrument_app(app: str):
+    """各アプリの先頭で呼ぶ：再実行の時間を測る
+
+    /_hokusei/metrics と /_hokusei/health はここでは足さない（サーバーの起動時に install_routes で足す）。
+    """
+    try:
+        _warn_if_unmounted()
+        _track_reruns(app)
+    except Exception:
+        _log.debug("metrics: instrumentation failed", exc_info=True)
@@ -0,0 +1,759 @@
+# hokusei_outbox.py
+# 送信アウトボックス（SQLite WAL）
+# - 送信ボタンではローカルのSQLiteに書くだけ（数ミリ秒で戻る）
+# - 裏のスレッドがGoogleシートへ書き込み、失敗したら間隔をあけて再送
+# - シートに書けたことを確認するまで行は消さない（Google障害中も取りこぼさない）
+# - 送信ごとに送信IDを付け、再送・二重押し・別の端末からの同じ送信を弾く
+# - summary=True の送信は「日別集計」タブの合計も足す（hokusei_summary）
+
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import hokusei_metrics as metrics
+from hokusei_trace import span, trace
+from hokusei_sheets import (
+    RowSlots, append_cells_request, ensure_rows, error_kind, forget_spreadsheet, is_timeout_error, open_spreadsheet,
+    sheet_cache, updated_row_range,
+)
+from hokusei_summary import (
+    SUMMARY_HEADER, SUMMARY_TAB, SummaryTable, note_submitted, summary_deltas, write_summary,
+)
+
+OUTBOX_DIR = Path(os.environ.get("HOKUSEI_OUTBOX_DIR", Path(__file__).resolve().parent / ".outbox"))
+
+RETRY_BASE_SEC = 2.0       # 再送間隔の初期値（失敗ごとに倍）
+RETRY_MAX_SEC = 300.0      # 再送間隔の上限
+GIVE_UP_ATTEMPTS = 5       # 4xx(429以外)がこの回数続いたら「dead」にして止める（行は残す）
+KEEP_DONE_SEC = 7 * 24 * 3600  # 書き込み済みの行を残しておく期間
+COALESCE_WINDOW_SEC = 2.0  # この間に来た送信は全セッション分まとめて1回で書く
+MAX_BATCH_ROWS = 500       # 1回の append にまとめる行数の上限
+RECENT_IDS = 5000          # 二重送信チェック用に覚えておく送信IDの数
+ID_COLUMN = "H"            # 送信IDを書く列（日報の7列の右。非表示にしてよい）
+ID_COLUMN_WIDTH = 7        # 送信IDの前にそろえる列数
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id             INTEGER PRIMARY KEY AUTOINCREMENT,
+    spreadsheet_id TEXT    NOT NULL,
+    worksheet      TEXT,               -- NULLなら sheet1
+    op             TEXT    NOT NULL,   -- append / append_multi / update / fill_blank / summary
+    payload        TEXT    NOT NULL,   -- JSON
+    status         TEXT    NOT NULL DEFAULT 'pending',  -- pending / done / dead
+    attempts       INTEGER NOT NULL DEFAULT 0,
+    next_try_at    REAL    NOT NULL DEFAULT 0,
+    last_error     TEXT,
+    result         TEXT,               -- JSON（書き込んだ行範囲など）
+    created_at     REAL    NOT NULL,
+    done_at        REAL,
+    submission_id  TEXT,               -- 送信ID（同じ送信は1回しか入らない）
+    uncertain      INTEGER NOT NULL DEFAULT 0, -- 前回の失敗が「書けたかどうか不明」だった
+    target_row     INTEGER             -- fill_blank で書こうとした行（書けたか分かるまで残す）
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_try_at);
+"""
+
+# 以前のアウトボックスファイルに足りない列
+_MIGRATIONS = {
+    "submission_id": "ALTER TABLE outbox ADD COLUMN submission_id TEXT",
+    "uncertain": "ALTER TABLE outbox ADD COLUMN uncertain INTEGER NOT NULL DEFAULT 0",
+    "target_row": "ALTER TABLE outbox ADD COLUMN target_row INTEGER",
+}
+
+_outboxes: dict = {}  # 名前 → このプロセスの Outbox
+_outboxes_lock = threading.Lock()
+_watched: set = set()  # ヘルスチェックで数えるアウトボックスの名前（開いていなくても数える）
+
+def outbox_path(app: str) -> Path:
+    """アプリごとのアウトボックスファイル"""
+    return OUTBOX_DIR / f"{app}.sqlite3"
+
+def open_outbox(app: str, client_factory) -> "Outbox":
+    """アプリのアウトボックスを開いてフラッシャを起動する（プロセスで1つ。2回目からは同じものを返す）
+
+    hokusei_server.py がサーバーの起動時に開くので、画面を開く前から前回の残りを書き始める。
+    """
+    with _outboxes_lock:
+        ob = _outboxes.get(app)
+        if ob is None:
+            ob = Outbox(outbox_path(app), client_factory)
+    return ob.start()
+
+def watch_outbox(app: str):
+    """このプロセスのヘルスチェックで数えるアウトボックスにする（開けなかったときも件数は出す）"""
+    _watched.add(app)
+
+def _counts(db: sqlite3.Connection) -> tuple[int, int, float | None]:
+    """(未反映の件数, dead の件数, 一番古い未反映の作成時刻)"""
+    row = db.execute(
+        "SELECT SUM(status = 'pending'), SUM(status = 'dead'), MIN(CASE WHEN status = 'pending'"
+        " THEN created_at END) FROM outbox WHERE status != 'done'"
+    ).fetchone()
+    return row[0] or 0, row[1] or 0, row[2]
+
+def _file_counts(path: Path) -> tuple[int, int, float | None]:
+    """アウトボックスのファイルを読み取り専用で開いて数える（まだファイルがなければ0件）"""
+    if not path.exists():
+        return 0, 0, None
+    db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return _counts(db)
+    except sqlite3.OperationalError:
+        return 0, 0, None  # 表がまだない
+    finally:
+        db.close()
+
+def outbox_health() -> dict:
+    """このプロセスのアウトボックスの状態（ヘルスチェック用。SQLiteを数えるだけでシートには触らない）
+
+    開いていないアウトボックスもファイルから数えるので、フラッシャが動いていなくても残りが分かる。
+    """
+    out = {}
+    for name in sorted(_watched | set(_outboxes)):
+        ob = _outboxes.get(name)
+        if ob is not None:
+            out[name] = ob.health()
+            continue
+        pending, dead, oldest = _file_counts(outbox_path(name))
+        out[name] = {
+            "pending": pending,
+            "dead": dead,
+            "oldest_pending_sec": round(time.time() - oldest) if oldest else None,
+            "last_write_sec_ago": None,
+            "last_error": None,
+            "error_kind": None,
+            "flusher_alive": False,
+        }
+    return out
+
+def _error_code(e: Exception) -> int | None:
+    """gspread.exceptions.APIError ならHTTPステータス、それ以外は None"""
+    code = getattr(e, "code", None)
+    return code if isinstance(code, int) else None
+
+def is_permanent_error(e: Exception) -> bool:
+    """再送しても直らないエラー（429/408以外の4xx）か"""
+    code = _error_code(e)
+    return code is not None and 400 <= code < 500 and code not in (408, 429)
+
+def is_ambiguous_error(e: Exception) -> bool:
+    """Google側では書けているかもしれないエラー（タイムアウト・5xx）か"""
+    if is_timeout_error(e):
+        return True
+    code = _error_code(e)
+    return code is not None and code >= 500
+
+def submission_id(*parts) -> str:
+    """送信内容（スプレッドシート・日付・名前・行）から送信IDを作る
+
+    再送・二重押し・再読み込みしての送り直し・別の端末からの同じ送信は同じIDになる。
+    同じ作業を本当に2回したときは、画面で確かめてから Outbox.repeat_id で別のIDにする。
+    送信日時のように送るたびに変わる値は parts に入れないこと。
+    """
+    raw = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+def _tag_rows(rows: list[list], sid: str) -> list[list]:
+    """各行の ID_COLUMN に送信IDを入れる"""
+    return [list(r) + [""] * (ID_COLUMN_WIDTH - len(r)) + [sid] for r in rows]
+
+def _same_row(got: list[list], values: list) -> bool:
+    """ws.get で読んだ1行が values と同じか（右端の空セルは返ってこないのでそろえて比べる）"""
+    cells = list(got[0]) if got else []
+    cells += [""] * (len(values) - len(cells))
+    return [str(c).strip() for c in cells] == [str(v).strip() for v in values]
+
+def _row_count(payload: dict) -> int:
+    if "deltas" in payload:
+        return len(payload["deltas"])
+    if "sheets" in payload:
+        return sum(len(rows) for rows in payload["sheets"].values())
+    return len(payload["rows"])
+
+def _chunks(items: list, max_rows: int) -> list[list]:
+    """送信単位を崩さずに、行数が max_rows 以下になるように分ける"""
+    out, cur, n = [], [], 0
+    for item in items:
+        k = _row_count(item[1])
+        if cur and n + k > max_rows:
+            out.append(cur)
+            cur, n = [], 0
+        cur.append(item)
+        n += k
+    if cur:
+        out.append(cur)
+    return out
+
+
+class Outbox:
+    """送信待ちの行をためて、裏のスレッドでシートへ流す
+
+    st.cache_resource でプロセスに1つだけ作り、全セッションで共有する。
+    """
+
+    def __init__(self, path: Path, client_factory, poll_sec: float = 1.0):
+        # client_factory: 引数なしで gspread.Client を返す関数（フラッシャ側で遅延実行）
+        self.path = Path(path)
+        self.name = self.path.stem  # 数値のラベル（cad / siage など）
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._client_factory = client_factory
+        self._client = None
+        self._worksheets: dict = {}
+        self._slots: dict = {}
+        self._poll_sec = poll_sec
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=FULL")  # コミット＝ディスクに書けた、にする
+        self._db.executescript(_SCHEMA)
+        cols = {r["name"] for r in self._db.execute("PRAGMA table_info(outbox)")}
+        for col, ddl in _MIGRATIONS.items():
+            if col not in cols:
+                self._db.execute(ddl)
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS outbox_sid ON outbox (submission_id)")
+        self.summary = SummaryTable(self._db, self._lock)  # 日別集計の合計（同じファイル）
+
+        # 最近の送信ID → アウトボックスID（シートを読み直さずに二重送信を判定する）
+        self._recent: OrderedDict[str, int] = OrderedDict()
+        for r in self._db.execute(
+            "SELECT id, submission_id FROM outbox WHERE submission_id IS NOT NULL AND status != 'dead'"
+            " ORDER BY id DESC LIMIT ?",
+            (RECENT_IDS,),
+        ).fetchall()[::-1]:
+            self._recent[r["submission_id"]] = r["id"]
+        self._tail_rows: dict = {}  # (スプレッドシート, ワークシート) → 最後に書いた行
+        self._suspect_from: dict = {}  # アウトボックスID → 書けたか不明になった時点の最終行
+        self.last_done_at = self._db.execute(
+            "SELECT MAX(done_at) FROM outbox WHERE status = 'done'").fetchone()[0]
+        self.last_error: str | None = None  # 最後の書き込み失敗（書けたら消す）
+        self.last_error_kind: str | None = None  # その種類（hokusei_sheets.error_kind）
+        metrics.OUTBOX_DEPTH.track(self.depth, outbox=self.name)
+        _outboxes[self.name] = self
+
+    ########################################
+    # 送信側（ボタンのハンドラから呼ぶ）
+    ########################################
+
+    def enqueue(self, spreadsheet_id: str, worksheet: str | None, op: str, payload: dict,
+                submission_id: str | None = None, summary: bool = False) -> int:
+        """1件ためる。戻り値はアウトボックスID
+
+        submission_id が最近の送信と同じなら、ためずに前回のアウトボックスIDを返す。
+        summary=True なら日別集計タブに足す分も同じトランザクションでためる
+        （日報の行とは別に書く。戻り値は日報の行のアウトボックスID）。
+        送信済みの索引（hokusei_summary.SubmittedIndex）にもこの時点で足す。
+        """
+        items = [(spreadsheet_id, worksheet, op, payload, submission_id)]
+        if summary:
+            deltas = summary_deltas(payload)
+            if deltas:
+                sid = f"{submission_id}:summary" if submission_id else None
+                items.append((spreadsheet_id, SUMMARY_TAB, "summary", {"deltas": deltas}, sid))
+        entry_id = self.enqueue_many(items)[0]
+        if summary:
+            note_submitted(spreadsheet_id, worksheet, payload, submission_id)
+        return entry_id
+
+    def enqueue_many(self, items: list[tuple]) -> list[int]:
+        """複数件を1トランザクションでためる（全部入るか、全部入らないか）
+
+        items は (spreadsheet_id, worksheet, op, payload[, submission_id]) のタプル。
+        """
+        now = time.time()
+        ids = []
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for spreadsheet_id, worksheet, op, payload, *rest in items:
+                    sid = rest[0] if rest else None
+                    if sid is not None and sid in self._recent:
+                        ids.append(self._recent[sid])  # 二重送信：ためない
+                        continue
+                    if sid is not None:
+                        # dead になった送信は送り直せるように、前の行の送信IDをずらして残す
+                        self._db.execute(
+                            "UPDATE outbox SET submission_id = submission_id || ':dead:' || id"
+                            " WHERE submission_id = ? AND status = 'dead'",
+                            (sid,),
+                        )
+                    cur = self._db.execute(
+                        "INSERT INTO outbox (spreadsheet_id, worksheet, op, payload, created_at, submission_id)"
+                        " VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (submission_id) DO NOTHING",
+                        (spreadsheet_id, worksheet, op, json.dumps(payload, ensure_ascii=False), now, sid),
+                    )
+                    if cur.rowcount == 0:
+                        # 最近の送信IDからは外れたが、まだファイルに残っている送信：ためない
+                        (entry_id,) = self._db.execute(
+                            "SELECT id FROM outbox WHERE submission_id = ?", (sid,)).fetchone()
+                        ids.append(entry_id)
+                        continue
+                    ids.append(cur.lastrowid)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            for item, entry_id in zip(items, ids):
+                sid = item[4] if len(item) > 4 else None
+                if sid is not None:
+                    self._remember(sid, entry_id)
+        self._wake.set()
+        return ids
+
+    def _remember(self, sid: str, entry_id: int):
+        self._recent[sid] = entry_id
+        self._recent.move_to_end(sid)
+        while len(self._recent) > RECENT_IDS:
+            self._recent.popitem(last=False)
+
+    def seen(self, sid: str) -> int | None:
+        """同じ送信IDで送られていれば、そのアウトボックスIDを返す（シートは読まない）
+
+        dead になった送信は送られていないものとする（送り直せる）。
+        """
+        with self._lock:
+            entry_id = self._recent.get(sid)
+            if entry_id is not None:
+                return entry_id
+            row = self._db.execute(
+                "SELECT id FROM outbox WHERE submission_id = ? AND status != 'dead'", (sid,)).fetchone()
+            return row["id"] if row else None
+
+    def repeat_id(self, sid: str) -> str:
+        """sid と同じ内容をわざともう一度送るときの送信ID
+
+        まだ使っていない一番小さい番号を付ける（確認ボタンを二度押ししても同じIDなので1回しか入らない）。
+        """
+        n = 1
+        while self.seen(submission_id(sid, "repeat", n)) is not None:
+            n += 1
+        return submission_id(sid, "repeat", n)
+
+    def depth(self) -> int:
+        """シート未反映の件数"""
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def health(self) -> dict:
+        """未反映・dead の件数、一番古い未反映の経過秒、最後に書けてからの秒数"""
+        now = time.time()
+        with self._lock:
+            pending, dead, oldest = _counts(self._db)
+        return {
+            "pending": pending,
+            "dead": dead,
+            "oldest_pending_sec": round(now - oldest) if oldest else None,
+            "last_write_sec_ago": round(now - self.last_done_at) if self.last_done_at else None,
+            "last_error": self.last_error,
+            "error_kind": self.last_error_kind,
+            "flusher_alive": self._thread is not None and self._thread.is_alive(),
+        }
+
+    def entry(self, entry_id: int) -> dict | None:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+        return dict(row) if row else None
+
+    def describe(self, entry_ids: list[int]) -> str | None:
+        """画面に出す一言（全部反映済み / 反映待ち / 止まっている）"""
+        entries = [e for e in (self.entry(i) for i in entry_ids) if e]
+        if not entries:
+            return None
+        if any(e["status"] == "dead" for e in entries):
+            return "シートへの書き込みに失敗した作業があります。管理者に連絡してください。"
+        if any(e["status"] == "pending" for e in entries):
+            return "シートへの書き込み待ちです（通信が回復しだい自動で書き込みます）。"
+        rows = [json.loads(e["result"]) for e in entries if e["result"]]
+        rows = [r for r in rows if r]
+        if rows:
+            return f"{min(r[0] for r in rows)}〜{max(r[1] for r in rows)}行目に記録しました。"
+        return "シートに記録しました。"
+
+    ########################################
+    # フラッシャ（裏のスレッド）
+    ########################################
+
+    def start(self) -> "Outbox":
+        """裏のスレッドを起動（何度呼んでも1本だけ）"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="hokusei-outbox", daemon=True)
+                self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._poll_sec)
+            self._wake.clear()
+            try:
+                self.flush_once()
+            except Exception:
+                # スレッドを止めない（次の周回でやり直す）
+                pass
+
+    def _due(self) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_try_at <= ? ORDER BY id",
+                (time.time(),),
+            ).fetchall()
+
+    def flush_once(self) -> int:
+        """期限の来た行をシートへ書く。書けた件数を返す
+
+        append は (スプレッドシート, ワークシート) ごとに全セッション分をまとめて
+        1回の append_rows で送る（終業時に送信が集中しても書き込み回数が増えない）。
+        append_multi（複数ワークシートへの追記）はスプレッドシートごとにまとめて
+        1回の batchUpdate で送る。summary（日別集計）もスプレッドシートごとにまとめて
+        1回の values.batchUpdate で送る。
+        """
+        now = time.time()
+        done = 0
+        groups: dict[tuple, list] = {}
+        for row in self._due():
+            if row["op"] not in ("append", "append_multi", "summary"):
+                done += self._flush_single(row)
+                continue
+            payload = json.loads(row["payload"])
+            if row["uncertain"] and row["submission_id"] and row["op"] != "summary":
+                # （summary は合計の値を上書きするだけなので、そのまま送り直してよい）
+                # 前回「タイムアウトしたが実は書けていた」かもしれない → 送信IDを探してから再送
+                try:
+                    written = self._already_written(row, payload)
+                except Exception as e:
+                    self._mark_failed(row, e)
+                    continue
+                if written:
+                    self._mark_done(row, None)
+                    done += 1
+                    continue
+            key = (row["op"], row["spreadsheet_id"], row["worksheet"], payload.get("value_input_option", "RAW"))
+            groups.setdefault(key, []).append((row, payload))
+
+        for key, items in groups.items():
+            # 一番古い送信から COALESCE_WINDOW_SEC たつまでは他のセッションの分を待つ
+            # （再送分は待たない）
+            oldest = items[0][0]
+            if oldest["attempts"] == 0 and now - oldest["created_at"] < COALESCE_WINDOW_SEC:
+                continue
+            flush = {"append": self._flush_appends, "append_multi": self._flush_multi,
+                     "summary": self._flush_summary}[key[0]]
+            for chunk in _chunks(items, MAX_BATCH_ROWS):
+                done += flush(key[1:], chunk)
+        self._purge()
+        return done
+
+    def _flush_single(self, row: sqlite3.Row) -> int:
+        try:
+            with trace(row["submission_id"]), span(
+                    "outbox.write", op=row["op"], submissions=1, attempt=row["attempts"],
+                    queued_ms=round((time.time() - row["created_at"]) * 1000)):
+                result = self._apply(row)
+        except Exception as e:
+            self._mark_failed(row, e)
+            return 0
+        self._mark_done(row, result)
+        return 1
+
+    def _flush_appends(self, key: tuple, items: list) -> int:
+        """まとめた append を1回で送り、書けた行範囲を送信ごとに割り振る"""
+        if len(items) == 1:
+            return self._flush_single(items[0][0])
+
+        spreadsheet_id, title, value_input_option = key
+        rows = [r for row, payload in items for r in self._rows(row, payload["rows"])]
+        try:
+            with trace(*(row["submission_id"] for row, _ in items)), span(
+                    "outbox.write", op="append", submissions=len(items), attempt=items[0][0]["attempts"],
+                    queued_ms=round((time.time() - items[0][0]["created_at"]) * 1000)):
+                ws = self._worksheet(spreadsheet_id, title)
+                with span("append_rows", rows=len(rows)):
+                    res = ws.append_rows(rows, value_input_option=value_input_option, table_range="A1")
+        except Exception as e:
+            if is_permanent_error(e):
+                # どれか1件が原因かもしれないので、1件ずつ送り直して巻き添えを防ぐ
+                return sum(self._flush_single(row) for row, _ in items)
+            for row, _ in items:
+                self._mark_failed(row, e)
+            return 0
+
+        written = self._note_tail(spreadsheet_id, title, updated_row_range(res))
+        start = written[0] if written else None
+        for row, payload in items:
+            n = len(payload["rows"])
+            self._mark_done(row, (start, start + n - 1) if start is not None else None)
+            if start is not None:
+                start += n
+        return len(items)
+
+    def _flush_multi(self, key: tuple, items: list) -> int:
+        """まとめた append_multi を1回の batchUpdate で送る（全部書けるか、全部書けないか）"""
+        if len(items) == 1:
+            return self._flush_single(items[0][0])
+
+        spreadsheet_id, _, value_input_option = key
+        try:
+            with trace(*(row["submission_id"] for row, _ in items)), span(
+                    "outbox.write", op="append_multi", submissions=len(items), attempt=items[0][0]["attempts"],
+                    queued_ms=round((time.time() - items[0][0]["created_at"]) * 1000)):
+                self._append_multi(spreadsheet_id, items, value_input_option)
+        except Exception as e:
+            if is_permanent_error(e):
+                return sum(self._flush_single(row) for row, _ in items)
+            for row, _ in items:
+                self._mark_failed(row, e)
+            return 0
+        for row, _ in items:
+            self._mark_done(row, None)
+        return len(items)
+
+    def _flush_summary(self, key: tuple, items: list) -> int:
+        """まとめた summary を足して、変わった集計行を1回で書く"""
+        if len(items) == 1:
+            return self._flush_single(items[0][0])
+
+        spreadsheet_id = key[0]
+        try:
+            with trace(*(row["submission_id"] for row, _ in items)), span(
+                    "outbox.write", op="summary", submissions=len(items), attempt=items[0][0]["attempts"],
+                    queued_ms=round((time.time() - items[0][0]["created_at"]) * 1000)):
+                written = self._write_summary(spreadsheet_id, items)
+        except Exception as e:
+            if is_permanent_error(e):
+                return sum(self._flush_single(row) for row, _ in items)
+            for row, _ in items:
+                self._mark_failed(row, e)
+            return 0
+        for row, _ in items:
+            self._mark_done(row, written)
+        return len(items)
+
+    def _set_target(self, row: sqlite3.Row, target: int | None):
+        """fill_blank で書く行を先に残す（書けたか不明で落ちても、次は同じ行を確かめられる）"""
+        with self._lock:
+            self._db.execute("UPDATE outbox SET target_row = ? WHERE id = ?", (target, row["id"]))
+
+    def _mark_done(self, row: sqlite3.Row, result):
+        self._suspect_from.pop(row["id"], None)
+        now = time.time()
+        self.last_done_at = now
+        self.last_error = None
+        self.last_error_kind = None
+        sheet_cache.invalidate(row["spreadsheet_id"])  # 読み込みキャッシュは次に使うとき版を確かめ直す
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = 'done', done_at = ?, result = ?, last_error = NULL WHERE id = ?",
+                (now, json.dumps(result), row["id"]),
+            )
+        metrics.SUBMIT_ACK_SECONDS.observe(now - row["created_at"], outbox=self.name)
+
+    def _mark_failed(self, row: sqlite3.Row, e: Exception):
+        attempts = row["attempts"] + 1
+        if is_permanent_error(e) and attempts >= GIVE_UP_ATTEMPTS:
+            status = "dead"
+        else:
+            status = "pending"
+        delay = min(RETRY_MAX_SEC, RETRY_BASE_SEC * (2 ** (attempts - 1)))
+        delay *= random.uniform(0.5, 1.0)  # 全員が同時に再送しないようにばらす
+        # シート名変更・権限変更などに備えて、次は開き直してから再送
+        if self._client is not None:
+            forget_spreadsheet(self._client, row["spreadsheet_id"])
+        for key in [k for k in self._worksheets if k[0] == row["spreadsheet_id"]]:
+            del self._worksheets[key]
+        uncertain = 1 if (row["uncertain"] or is_ambiguous_error(e)) else 0
+        if uncertain and not row["uncertain"] and row["op"] == "append":
+            # 書けていたとしたら、この時点で分かっている最終行より後ろにあるはず
+            self._suspect_from[row["id"]] = self._tail_rows.get((row["spreadsheet_id"], row["worksheet"]))
+        if status == "dead" and row["submission_id"]:
+            with self._lock:
+                self._recent.pop(row["submission_id"], None)  # 送り直せるように
+        metrics.OUTBOX_FAILURES.inc(outbox=self.name, status=status)
+        self.last_error = f"{type(e).__name__}: {e}"[:300]
+        self.last_error_kind = error_kind(e)
+        with self._lock:
+            self._db.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, next_try_at = ?, last_error = ?, uncertain = ?"
+                " WHERE id = ?",
+                (status, attempts, time.time() + delay, f"{type(e).__name__}: {e}"[:500], uncertain, row["id"]),
+            )
+
+    def _purge(self):
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM outbox WHERE status = 'done' AND done_at < ?",
+                (time.time() - KEEP_DONE_SEC,),
+            )
+        self.summary.purge(time.time() - KEEP_DONE_SEC)
+
+    ########################################
+    # シート操作
+    ########################################
+
+    def _worksheet(self, spreadsheet_id: str, title: str | None):
+        """開いたシートは覚えておく（open_by_key / worksheet は毎回メタデータを取りに行くため）
+
+        初めて開くときに worksheets() を1回だけ呼び、全タブをまとめて覚える
+        （タブごとに worksheet(title) でメタデータを取りに行かない）。
+        """
+        key = (spreadsheet_id, title)
+        ws = self._worksheets.get(key)
+        if ws is not None:
+            return ws
+        if self._client is None:
+            self._client = self._client_factory()
+        sh = open_spreadsheet(self._client, spreadsheet_id)
+        tabs = sh.worksheets()
+        for tab in tabs:
+            self._worksheets[(spreadsheet_id, tab.title)] = tab
+        if tabs:
+            self._worksheets[(spreadsheet_id, None)] = tabs[0]  # sheet1
+        ws = self._worksheets.get(key)
+        if ws is None:
+            raise KeyError(f"worksheet not found: {title}")
+        return ws
+
+    def _append_multi(self, spreadsheet_id: str, items: list, value_input_option: str):
+        """複数ワークシートへの追記を1回の batchUpdate にする
+
+        batchUpdate は中のリクエストが1つでも失敗すると全体が適用されないので、
+        「シート1には書けたが自動運転には書けなかった」という半端な状態にならない。
+        items は (アウトボックスの行, payload) のリスト。
+        """
+        requests = []
+        for row, payload in items:
+            for title, rows in payload["sheets"].items():
+                if rows:
+                    ws = self._worksheet(spreadsheet_id, title)
+                    requests.append(append_cells_request(ws.id, self._rows(row, rows), value_input_option))
+        if requests:
+            open_spreadsheet(self._client, spreadsheet_id).batch_update({"requests": requests})
+
+    def _summary_worksheet(self, spreadsheet_id: str):
+        """日別集計タブ（なければ作る。見出しは write_summary が書く）"""
+        try:
+            return self._worksheet(spreadsheet_id, SUMMARY_TAB)
+        except KeyError:
+            pass
+        sh = open_spreadsheet(self._client, spreadsheet_id)
+        ws = sh.add_worksheet(SUMMARY_TAB, rows=1000, cols=len(SUMMARY_HEADER))
+        self._worksheets[(spreadsheet_id, SUMMARY_TAB)] = ws
+        return ws
+
+    def _write_summary(self, spreadsheet_id: str, items: list):
+        """まとめた summary を日別集計タブに書く。items は (アウトボックスの行, payload) のリスト"""
+        return write_summary(self._summary_worksheet(spreadsheet_id), self.summary, spreadsheet_id,
+                             [(row["submission_id"], payload["deltas"]) for row, payload in items])
+
+    ########################################
+    # 送信ID
+    ########################################
+
+    @staticmethod
+    def _rows(row: sqlite3.Row, rows: list[list]) -> list[list]:
+        """送信IDがあれば ID_COLUMN 列に入れた行にする"""
+        return _tag_rows(rows, row["submission_id"]) if row["submission_id"] else rows
+
+    def _note_tail(self, spreadsheet_id: str, title: str | None, written):
+        if written:
+            key = (spreadsheet_id, title)
+            self._tail_rows[key] = max(self._tail_rows.get(key, 0), written[1])
+        return written
+
+    def _already_written(self, row: sqlite3.Row, payload: dict) -> bool:
+        """送信IDがシートの ID_COLUMN 列にもうあるか
+
+        書けたかどうか不明になったあとの再送前だけ呼ぶ。
+        その時点の最終行が分かっていればそこから下だけ読む（分からなければID列だけ読む）。
+        """
+        sid = row["submission_id"]
+        if "sheets" in payload:
+            # batchUpdate は全部書けるか全部書けないかなので、どれか1つのタブを見れば足りる
+            titles = [t for t, rows in payload["sheets"].items() if rows][:1]
+        else:
+            titles = [row["worksheet"]]
+        for title in titles:
+            ws = self._worksheet(row["spreadsheet_id"], title)
+            start = self._suspect_from.get(row["id"])
+            if start:
+                values = [c for r in ws.get(f"{ID_COLUMN}{start}:{ID_COLUMN}") for c in r]
+            else:
+                values = ws.col_values(ord(ID_COLUMN) - ord("A") + 1)
+            if sid in values:
+                return True
+        return False
+
+    def _apply(self, row: sqlite3.Row):
+        payload = json.loads(row["payload"])
+        op = row["op"]
+
+        if op == "append_multi":
+            self._append_multi(row["spreadsheet_id"], [(row, payload)], payload.get("value_input_option", "RAW"))
+            return None
+
+        if op == "summary":
+            return self._write_summary(row["spreadsheet_id"], [(row, payload)])
+
+        ws = self._worksheet(row["spreadsheet_id"], row["worksheet"])
+
+        if op == "append":
+            with span("append_rows", rows=len(payload["rows"])):
+                res = ws.append_rows(
+                    self._rows(row, payload["rows"]),
+                    value_input_option=payload.get("value_input_option", "RAW"),
+                    table_range="A1",
+                )
+            return self._note_tail(row["spreadsheet_id"], row["worksheet"], updated_row_range(res))
+
+        if op == "update":
+            ws.update(payload["values"], range_name=payload["range"],
+                      value_input_option=payload.get("value_input_option", "RAW"))
+            r = int("".join(ch for ch in payload["range"].split(":")[0] if ch.isdigit()))
+            return (r, r + len(payload["values"]) - 1)
+
+        if op == "fill_blank":
+            # 指定列の start_row 行目以降で空いている行に書く（なければ最後に追加）
+            # 空き行は RowSlots が覚えているので、毎回列全体を読んで探さない
+            slots_key = (row["spreadsheet_id"], row["worksheet"], int(payload["column"]), int(payload["start_row"]))
+            slots = self._slots.get(slots_key)
+            if slots is None:
+                slots = self._slots[slots_key] = RowSlots(int(payload["column"]), int(payload["start_row"]))
+            values = payload["values"]
+            target = row["target_row"]
+            if target:
+                # 前回は書けたかどうか不明 → その行を読み直し、書けていれば送り直さない
+                got = ws.get(f"{payload['first_col']}{target}:{payload['last_col']}{target}")
+                if _same_row(got, values):
+                    slots.done(target)
+                    return (target, target)
+                if _same_row(got, [""] * len(values)):
+                    slots.claim(target)  # 書けていなかった：同じ行に書き直す
+                else:
+                    slots.done(target)   # その間に別の内容で埋まった：別の空き行を探す
+                    target = None
+            if not target:
+                target = slots.allocate(ws)
+                self._set_target(row, target)
+            a1 = f"{payload['first_col']}{target}:{payload['last_col']}{target}"
+            try:
+                ensure_rows(ws, target)  # 空きがなく最後に足すとき、シートの行数を超えていたら増やす
+                ws.update([values], range_name=a1,
+                          value_input_option=payload.get("value_input_option", "RAW"))
+            except Exception as e:
+                if not is_ambiguous_error(e):
+                    # 書けていないのが確かなときだけ行を空きに戻す（不明なら予約したまま次に読み直す）
+                    slots.release(target)
+                    self._set_target(row, None)
+                raise
+            slots.done(target)
+            return (target, target)
+
+        raise ValueError(f"unknown outbox op: {op}")
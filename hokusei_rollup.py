@@ -0,0 +1,163 @@
+# hokusei_rollup.py
+# 工番ごとの時間の集計（仕上げ・機械・CAD・設計の4課まとめて）
+# - hokusei_sync の控え（ローカルのSQLite）から課ごとにスレッドで並べて読む
+# - 時間は仕上げの parse_hours_maybe と同じ規則で読む（全角・「1.5h」「1.5時間」もOK、読めなければ0）
+# - 仕上げの「送信日時」行は集計しない。客先トライの「移動」行（雑務 / 移動）は工番の時間に入れない
+# - 集計は pandas の groupby だけ（行ごとの Python のループなし）。10万行でも数十ミリ秒
+#
+# 使い方: python tools/rollup_jobs.py --job 51A111 / prepare(load()) → job_hours・rollup
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import pandas as pd
+
+from hokusei_sync import SOURCES, SYNC_DB, load_frame, sync_version
+
+# ワークシート → 課（機械は通常作業と自動運転の2つのタブ）
+DEPARTMENTS = {
+    "siage": "仕上げ",
+    "kikai": "機械",
+    "kikai_auto": "機械",
+    "cad": "CAD",
+    "sekkei": "設計",
+}
+
+MISC_CUSTOMER = "雑務"  # 工番に関わらない仕事（工番欄には作業の内容が入る）
+MOVE_JOB = "移動"       # 仕上げの客先トライの移動時間（雑務 / 移動 の行）
+
+ROLLUP_KEYS = ("job", "customer", "genre", "department", "month")
+LOAD_COLUMNS = ("source", "kind", "day", "name", "customer", "genre", "job", "hours_text")
+
+
+########################################
+# 読み込み
+########################################
+
+def load(sources: list[str] | None = None, start: date | str | None = None, end: date | str | None = None,
+         db_path: Path | str = SYNC_DB, workers: int = 4) -> pd.DataFrame:
+    """控えから作業の行を読む（ワークシートごとにスレッドで並べる。シートには触らない）"""
+    sources = [s for s in SOURCES if not sources or s in sources]
+
+    def read(source: str) -> pd.DataFrame:
+        return load_frame(start, end, [source], kinds=("work",), db_path=db_path, columns=LOAD_COLUMNS)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sources)))) as pool:
+        frames = list(pool.map(read, sources))
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return load_frame(start, end, ["-"], db_path=db_path, columns=LOAD_COLUMNS)  # 列だけそろった空の表
+    return pd.concat(frames, ignore_index=True)
+
+
+########################################
+# そろえる（ベクトル化）
+########################################
+
+def _by_unique(series: pd.Series, func) -> pd.Series:
+    """値の種類ごとに1回だけ func を通す（時間・工番は種類が少ないので、10万行でも数百回で済む）"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    converted = func(pd.Series(uniques, dtype=object))
+    return pd.Series(converted.to_numpy()[codes], index=series.index)
+
+
+def _parse_hours(s: pd.Series) -> pd.Series:
+    """parse_hours_maybe と同じ：1.5, １．５, 1.5h, 1.5時間 → 1.5 / 読めなければ 0.0"""
+    s = s.fillna("").astype(str).str.normalize("NFKC")
+    s = s.str.replace(r"[，、．]", ".", regex=True)
+    s = s.str.replace(r"(時間|h|ｈ)", "", regex=True, case=False)
+    return s.str.extract(r"(\d+(?:\.\d+)?)", expand=False).astype(float).fillna(0.0)
+
+
+def parse_hours(series: pd.Series) -> pd.Series:
+    return _by_unique(series, _parse_hours).astype(float)
+
+
+def normalize_job(series: pd.Series) -> pd.Series:
+    """工番を全角→半角・大文字・前後の空白なしにそろえる（51ａ111 → 51A111）"""
+    return _by_unique(series, lambda s: s.fillna("").astype(str).str.normalize("NFKC").str.strip().str.upper())
+
+
+def prepare(rows: pd.DataFrame) -> pd.DataFrame:
+    """load() の行を集計用の表にする
+
+    列: department / month / day / name / customer / genre / job / hours / category
+    category は 工番（工番の作業）・雑務（工番欄は作業の内容）・移動（客先トライの移動）。
+    """
+    if "kind" in rows and not (rows["kind"] == "work").all():
+        rows = rows[rows["kind"] == "work"]
+    customer = rows["customer"].fillna("")  # 控えに入れるときに前後の空白は落としてある
+    job = normalize_job(rows["job"])
+    misc = customer == MISC_CUSTOMER
+    category = pd.Series("工番", index=rows.index)
+    category[misc] = "雑務"
+    category[misc & (job == MOVE_JOB)] = "移動"
+    out = pd.DataFrame({
+        "department": rows["source"].map(DEPARTMENTS),
+        "month": rows["day"].str.slice(0, 7),
+        "day": rows["day"],
+        "name": rows["name"],
+        "customer": customer,
+        "genre": rows["genre"].fillna(""),
+        "job": job,
+        "hours": parse_hours(rows["hours_text"]),
+        "category": category,
+    })
+    # 文字列の列は category 型にする（groupby・絞り込みが速い）
+    for col in ("department", "month", "name", "customer", "genre", "job", "category"):
+        out[col] = out[col].astype("category")
+    return out.reset_index(drop=True)
+
+
+_frames: dict = {}
+_frames_lock = threading.Lock()
+
+
+def cached_frame(db_path: Path | str = SYNC_DB) -> pd.DataFrame:
+    """prepare(load()) をプロセスで覚えておく（同期で控えが変わったら読み直す）
+
+    読み込みとそろえるのに10万行で1秒ほどかかるので、画面などで何度も集計するときはこれを使う。
+    """
+    key = str(db_path)
+    version = sync_version(db_path)
+    with _frames_lock:
+        hit = _frames.get(key)
+        if hit is not None and hit[0] == version:
+            return hit[1]
+    frame = prepare(load(db_path=db_path))
+    with _frames_lock:
+        _frames[key] = (version, frame)
+    return frame
+
+
+########################################
+# 集計
+########################################
+
+def rollup(frame: pd.DataFrame, by=ROLLUP_KEYS, include_misc: bool = False) -> pd.DataFrame:
+    """by の組み合わせごとの合計時間と行数（時間の多い順）。既定では工番の作業だけ"""
+    if not include_misc:
+        frame = frame[frame["category"] == "工番"]
+    by = list(by)
+    out = (
+        frame.groupby(by, observed=True, sort=False)["hours"]
+        .agg(hours="sum", rows="size")
+        .reset_index()
+        .sort_values(["hours"] + by, ascending=[False] + [True] * len(by), ignore_index=True)
+    )
+    return out
+
+
+def job_hours(frame: pd.DataFrame, job: str) -> float:
+    """その工番に4課あわせて何時間かかったか"""
+    target = normalize_job(pd.Series([job])).iloc[0]
+    mask = (frame["job"] == target) & (frame["category"] == "工番")
+    return float(frame["hours"].to_numpy()[mask.to_numpy()].sum())
+
+
+def job_breakdown(frame: pd.DataFrame, job: str, by=("department", "genre", "month")) -> pd.DataFrame:
+    """その工番の時間の内訳（課・作業内容・月ごと）"""
+    target = normalize_job(pd.Series([job])).iloc[0]
+    return rollup(frame[frame["job"] == target], by=by)
@@ -0,0 +1,69 @@
+# hokusei_server.py
+# 日報アプリの起動（streamlit run の代わり）
+# - Streamlit のサーバーが Tornado アプリを作るときに /_hokusei/metrics と /_hokusei/health を足す
+#   （起動した時点から監視できる。誰かが画面を開くまで待たない）
+# - このアプリのアウトボックスを起動時に開き、前回から残っている送信をすぐ書き始める
+#   （ヘルスチェックの件数もファイルから数えるので、再起動直後の残りも見える）
+#
+# 使い方（リポジトリ直下で）:
+#   python hokusei_server.py hokusei-siage-nippo.py                     # streamlit run と同じ
+#   python hokusei_server.py hokusei-cad-nippo.py --server.port 8502    # streamlit run のオプションもそのまま
+#
+# streamlit run（Streamlit Community Cloud もこちら）で起動したときはこの2つの経路はなく、
+# 最初に画面を開いたときにログへ警告を出す（死活監視は Streamlit の /_stcore/health を使う）。
+# 経路は Streamlit の内部（Server._create_app）を包んで足すので、Streamlit の版を上げたら
+# /_hokusei/health が返るか確かめること（足せないときはログに出し、アプリはそのまま起動する）。
+
+import logging
+import re
+import sys
+from pathlib import Path
+
+from hokusei_metrics import install_routes
+
+_log = logging.getLogger(__name__)
+
+_APP_RE = re.compile(r"^hokusei-([a-z]+)-")  # hokusei-cad-nippo.py → cad（アウトボックスの名前）
+
+
+def _service_account_info() -> dict:
+    import streamlit as st
+
+    info = dict(st.secrets["google_cloud"])
+    if "private_key" in info and "\\n" in info["private_key"]:
+        info["private_key"] = info["private_key"].replace("\\n", "\n")
+    return info
+
+
+def start_outbox(script: str):
+    """アプリのアウトボックスを開いてフラッシャを起動する（画面を開いたときも同じものを使う）"""
+    from hokusei_outbox import open_outbox, watch_outbox
+    from hokusei_sheets import get_client
+
+    m = _APP_RE.match(Path(script).name)
+    if not m:
+        return
+    app = m.group(1)
+    watch_outbox(app)  # 開けなくても、残りの件数はヘルスチェックに出る
+    try:
+        info = _service_account_info()
+    except Exception:
+        _log.warning("outbox %s: secrets [google_cloud] not found; not flushing until the app is opened", app,
+                     exc_info=True)
+        return
+    open_outbox(app, lambda: get_client(info))
+
+
+def main():
+    from streamlit.web import cli
+
+    args = sys.argv[1:]
+    install_routes()
+    script = next((a for a in args if a.endswith(".py")), None)
+    if script:
+        start_outbox(script)
+    cli.main(["run", *args], prog_name="streamlit")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,688 @@
+# hokusei_sheets.py
+# 各日報アプリ共通の Googleシート接続・書き込みヘルパ
+
+from __future__ import annotations
+
+import heapq
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime
+from typing import TYPE_CHECKING
+
+import hokusei_metrics as metrics
+from hokusei_trace import span
+
+# gspread / google-auth / requests は読み込みだけで0.3秒ほどかかるので、
+# 実際に接続する時（裏のスレッド）まで import しない。画面の初回表示を待たせないため。
+if TYPE_CHECKING:
+    import gspread
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.readonly",
+]
+
+########################################
+# 流量制限・再試行・遮断（全アプリ共通）
+########################################
+
+# Sheets API の上限は「ユーザー(=サービスアカウント)ごとに 読み60回/分・書き60回/分」。
+# 少し余裕を持たせてプロセス全体でこれを超えないように待たせる。
+READS_PER_MIN = 55
+WRITES_PER_MIN = 55
+BURST = 10                 # 一度に続けて出してよい回数
+
+MAX_RETRIES = 5            # 429/5xx/タイムアウトの再試行回数
+BACKOFF_BASE_SEC = 1.0     # 再試行の待ち時間の初期値（毎回倍、上限まで）
+BACKOFF_MAX_SEC = 32.0
+
+BREAKER_THRESHOLD = 3      # タイムアウトがこの回数続いたら…
+BREAKER_COOLDOWN_SEC = 30  # …この秒数はGoogleに問い合わせずに即失敗させる
+THROTTLED_SEC = 60         # 429 / 上限超えを受けてからこの秒数は「混雑中」とする
+
+
+class SheetsUnavailable(Exception):
+    """タイムアウトが続いていて、しばらくGoogleシートに接続しない状態"""
+
+
+class TokenBucket:
+    """per_min 回/分 のペースで補充されるトークンバケツ（スレッドセーフ）"""
+
+    def __init__(self, per_min: float, burst: int):
+        self.rate = per_min / 60.0
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """トークンが1つ取れるまで待つ"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """タイムアウトが続いたら一定時間は即失敗させる（画面やスレッドを10秒ずつ固めない）"""
+
+    def __init__(self, threshold: int, cooldown_sec: float):
+        self.threshold = threshold
+        self.cooldown_sec = cooldown_sec
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.cooldown_sec:
+                raise SheetsUnavailable("Googleシートへの接続がタイムアウトし続けているため、しばらく待ってから再試行します")
+            # 冷却時間が過ぎたら1回だけ試させる（失敗したらまた開く）
+            self.opened_at = None
+            self.failures = self.threshold - 1
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def timeout(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+read_bucket = TokenBucket(READS_PER_MIN, BURST)
+write_bucket = TokenBucket(WRITES_PER_MIN, BURST)
+breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN_SEC)
+
+def is_timeout_error(e: BaseException) -> bool:
+    """タイムアウト・接続エラーか（requests がまだ読み込まれていなければ requests の例外ではあり得ない）"""
+    if isinstance(e, TimeoutError):
+        return True
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(
+        e, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+def _is_api_error(e: BaseException) -> bool:
+    exceptions = sys.modules.get("gspread.exceptions")
+    return exceptions is not None and isinstance(e, exceptions.APIError)
+
+def _backoff(attempt: int, retry_after: str | None = None) -> float:
+    """指数バックオフ＋ジッタ（Retry-After があればそれ以上待つ）"""
+    wait = random.uniform(0, min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** attempt)))
+    if retry_after and retry_after.isdigit():
+        wait = max(wait, float(retry_after))
+    return wait
+
+def _is_quota_error(e) -> bool:
+    if e.code == 429:
+        return True
+    # Drive API は上限超えを 403 usageLimits で返す
+    errors = e.error.get("errors") or []
+    return e.code == 403 and bool(errors) and errors[0].get("domain") == "usageLimits"
+
+
+def _is_auth_error(e: BaseException) -> bool:
+    """鍵・権限の問題か（トークンが取れない / 401 / 上限超え以外の 403）"""
+    exceptions = sys.modules.get("google.auth.exceptions")
+    if exceptions is not None and isinstance(e, exceptions.RefreshError):
+        return True
+    return _is_api_error(e) and (e.code == 401 or (e.code == 403 and not _is_quota_error(e)))
+
+def error_kind(e: Exception) -> str:
+    """エラーの種類（数値のラベル・ヘルスチェック用）
+
+    breaker_open / quota / auth / server_error / client_error / timeout / error のどれか。
+    """
+    if isinstance(e, SheetsUnavailable):
+        return "breaker_open"
+    if _is_auth_error(e):
+        return "auth"
+    if _is_api_error(e):
+        if _is_quota_error(e):
+            return "quota"
+        return "server_error" if e.code >= 500 else "client_error"
+    return "timeout" if is_timeout_error(e) else "error"
+
+throttled_at: float | None = None  # 最後に 429 / 上限超えを受けた時刻
+
+def guarded_call(call, is_read: bool, bucket: TokenBucket | None = None,
+                 op: str = "", spreadsheet: str = "", rows: int = 0):
+    """call() を流量制限・再試行・遮断に通して呼ぶ（GuardedHTTPClient とローカルのシートで共通）
+
+    - bucket があれば 1分あたりの回数を抑える（書き込みと読み込みで別枠）
+    - 429 / 上限超えは待ってから再試行（書き込みでも安全：Google側で処理されていない）
+    - 5xx / タイムアウトは読み込みだけ再試行（書き込みは二重になり得るので呼び出し側に任せる）
+    - タイムアウトが続いたら CircuitBreaker で一定時間は即失敗
+    - 1回ごとの結果・時間・行数を hokusei_metrics に記録する（op / spreadsheet / rows はそのラベル）
+    - 1回ごとに hokusei_trace の区間も残す（流量制限の順番待ちの時間は wait_ms に入れる）
+    - 429 / 上限超えを受けた時刻を throttled_at に残す（ヘルスチェックの「混雑中」）
+    """
+    global throttled_at
+    attempt = 0
+    while True:
+        t0 = time.perf_counter()
+        try:
+            breaker.check()
+            if bucket is not None:
+                bucket.acquire()
+            waited = time.perf_counter() - t0
+            t0 = time.perf_counter()  # 順番待ちの時間は呼び出しの時間に入れない
+            with span("sheets." + (op or "call"), attempt=attempt, rows=rows, wait_ms=round(waited * 1000, 1)):
+                result = call()
+        except Exception as e:
+            kind = error_kind(e)
+            metrics.SHEETS_REQUESTS.inc(op=op, spreadsheet=spreadsheet, outcome=kind)
+            metrics.SHEETS_SECONDS.observe(time.perf_counter() - t0, op=op, spreadsheet=spreadsheet)
+            if kind == "quota":
+                throttled_at = time.time()
+            if _is_api_error(e):
+                breaker.success()  # 応答は返ってきている
+                retryable = _is_quota_error(e) or (is_read and e.code >= 500)
+                if not retryable or attempt >= MAX_RETRIES:
+                    raise
+                time.sleep(_backoff(attempt, e.response.headers.get("Retry-After")))
+                attempt += 1
+                continue
+            if not is_timeout_error(e):
+                raise
+            breaker.timeout()
+            if not is_read or attempt >= MAX_RETRIES:
+                raise
+            time.sleep(_backoff(attempt))
+            attempt += 1
+            continue
+        metrics.SHEETS_REQUESTS.inc(op=op, spreadsheet=spreadsheet, outcome="ok")
+        metrics.SHEETS_SECONDS.observe(time.perf_counter() - t0, op=op, spreadsheet=spreadsheet)
+        if rows:
+            metrics.SHEETS_ROWS.inc(rows, op=op, spreadsheet=spreadsheet)
+        breaker.success()
+        return result
+
+_ENDPOINT_RE = re.compile(
+    r"/(?P<api>spreadsheets|files)/(?P<id>[^/:?]+)(?P<values>/values(?:/[^:?]*)?)?(?::(?P<verb>\w+))?")
+
+def describe_request(method: str, endpoint: str, body) -> tuple[str, str, int]:
+    """Google API の呼び出しを (操作名, スプレッドシートID, 書く行数) にする（数値のラベル用）"""
+    m = _ENDPOINT_RE.search(endpoint.split("?", 1)[0])
+    if not m:
+        return method.lower(), "", 0
+    if m.group("api") == "files":
+        op = "drive.files"
+    elif m.group("values"):
+        op = "values." + (m.group("verb") or {"GET": "get", "PUT": "update"}.get(method.upper(), method.lower()))
+    else:
+        op = m.group("verb") or method.lower()
+    rows = 0
+    if isinstance(body, dict):
+        if isinstance(body.get("values"), list):
+            rows = len(body["values"])
+        for req in body.get("requests") or []:
+            rows += len((req.get("appendCells") or {}).get("rows") or [])
+    return op, m.group("id"), rows
+
+_guarded_class = None
+
+def _guarded_http_client():
+    """GuardedHTTPClient を作って返す（gspread の import を初回接続まで遅らせるため関数の中で定義）"""
+    global _guarded_class
+    if _guarded_class is not None:
+        return _guarded_class
+
+    from gspread.http_client import HTTPClient
+
+    class GuardedHTTPClient(HTTPClient):
+        """gspread の通信をすべて guarded_call に通す（Sheets API だけトークンバケツで回数を抑える）"""
+
+        def request(self, method: str, endpoint: str, *args, **kwargs):
+            is_read = method.lower() == "get"
+            bucket = None
+            if "sheets.googleapis.com" in endpoint:
+                bucket = read_bucket if is_read else write_bucket
+            op, spreadsheet, rows = describe_request(method, endpoint, kwargs.get("json"))
+
+            def send():
+                if not self.auth.valid:
+                    # トークン切れ：取り直し（Googleの認証サーバーとの通信）を別の区間として測る
+                    with span("auth.refresh_token"):
+                        _refresh_credentials(self.auth)
+                return HTTPClient.request(self, method, endpoint, *args, **kwargs)
+
+            return guarded_call(send, is_read, bucket, op=op, spreadsheet=spreadsheet, rows=rows)
+
+    _guarded_class = GuardedHTTPClient
+    return _guarded_class
+
+def __getattr__(name: str):
+    # 以前どおり hokusei_sheets.GuardedHTTPClient でも参照できるように
+    if name == "GuardedHTTPClient":
+        return _guarded_http_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def describe_error(e: Exception) -> str:
+    """画面に出すエラーの説明（生の例外文字列より分かりやすく）"""
+    if isinstance(e, SheetsUnavailable):
+        return "Googleシートに接続できない状態が続いています。しばらくしてからもう一度お試しください。"
+    if _is_api_error(e) and _is_quota_error(e):
+        return "Googleシートへのアクセスが混み合っています。少し待ってからもう一度お試しください。"
+    if _is_api_error(e) and e.code >= 500:
+        return "Googleシート側で一時的なエラーが起きています。しばらくしてからもう一度お試しください。"
+    if is_timeout_error(e):
+        return "Googleシートへの接続がタイムアウトしました。通信状態を確認してください。"
+    return str(e)
+
+########################################
+# 接続
+########################################
+
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+def sheets_backend(info: dict) -> str:
+    """"google"（本番）か "local"（負荷試験用のローカルのシート）
+
+    secrets の [google_cloud] に sheets_backend = "local" と書くか、
+    環境変数 HOKUSEI_SHEETS_BACKEND=local で切り替える（環境変数が優先）。
+    """
+    return (os.environ.get("HOKUSEI_SHEETS_BACKEND") or info.get("sheets_backend") or "google").lower()
+
+def get_client(info: dict, scopes: list[str] = SCOPES) -> gspread.Client:
+    """サービスアカウントごとに gspread クライアントを1つだけ作る。
+
+    st.cache_resource と違って裏のスレッド（アウトボックス）からも共有できる。
+    authorize 自体は通信しない（トークン取得は最初のAPI呼び出し時）。
+    secrets で sheets_backend = "local" なら Google の代わりにローカルのシート（hokusei_fake）を返す。
+    """
+    key = (info.get("client_email"), tuple(scopes))
+    with _clients_lock:
+        gc = _clients.get(key)
+        if gc is None and sheets_backend(info) == "local":
+            from hokusei_fake import local_client
+
+            gc = _clients[key] = local_client(info)
+        elif gc is None:
+            with span("auth.build_client"):  # 鍵の読み込みだけ（通信はしない）
+                import gspread
+                from google.oauth2.service_account import Credentials
+
+                creds = Credentials.from_service_account_info(info, scopes=scopes)
+                gc = gspread.authorize(creds, http_client=_guarded_http_client())
+            _clients[key] = gc
+        return gc
+
+def set_client(client_email: str, gc, scopes: list[str] = SCOPES):
+    """get_client が返すクライアントを差し替える（ベンチマークで偽のシートを使う時など）"""
+    with _clients_lock:
+        _clients[(client_email, tuple(scopes))] = gc
+
+_spreadsheets: dict = {}
+_spreadsheets_lock = threading.Lock()
+
+def open_spreadsheet(gc: gspread.Client, spreadsheet_id: str) -> gspread.Spreadsheet:
+    """open_by_key の結果をプロセスで共有する（事前接続・アウトボックス・画面で同じものを使う）"""
+    key = (id(gc), spreadsheet_id)
+    with _spreadsheets_lock:
+        sh = _spreadsheets.get(key)
+    if sh is None:
+        with span("sheets.open_by_key", spreadsheet=spreadsheet_id):
+            sh = gc.open_by_key(spreadsheet_id)
+        with _spreadsheets_lock:
+            sh = _spreadsheets.setdefault(key, sh)
+    return sh
+
+def forget_spreadsheet(gc: gspread.Client, spreadsheet_id: str):
+    """次回は開き直す（シート名変更・権限変更のあとなど）"""
+    with _spreadsheets_lock:
+        _spreadsheets.pop((id(gc), spreadsheet_id), None)
+
+########################################
+# 事前接続（コールドスタート対策）
+########################################
+
+TOKEN_REFRESH_MARGIN_SEC = 300  # 期限切れのこの秒数前にトークンを取り直す
+PREWARM_RETRY_SEC = 30          # 事前接続に失敗したときの再試行間隔
+
+_warmers: dict = {}
+_warmers_lock = threading.Lock()
+connection_state: dict = {}     # 事前接続の状態（ヘルスチェックなどで見る）
+
+def _refresh_credentials(creds):
+    from google.auth.transport.requests import Request
+    creds.refresh(Request())
+
+def _refresh_token(gc: gspread.Client):
+    with span("auth.refresh_token"):
+        _refresh_credentials(gc.http_client.auth)
+
+def _token_seconds_left(gc: gspread.Client) -> float | None:
+    expiry = getattr(gc.http_client.auth, "expiry", None)
+    if expiry is None:
+        return None
+    # google-auth の expiry はタイムゾーンなしのUTC
+    return (expiry - datetime.utcnow()).total_seconds()
+
+def _warm_loop(info: dict, scopes: list[str], spreadsheet_ids: list[str]):
+    state = connection_state.setdefault(info.get("client_email"), {})
+    while True:
+        try:
+            gc = get_client(info, scopes)
+            left = _token_seconds_left(gc)
+            if left is None or left < TOKEN_REFRESH_MARGIN_SEC:
+                _refresh_token(gc)
+                state["token_refreshed_at"] = time.time()
+            for spreadsheet_id in spreadsheet_ids:
+                open_spreadsheet(gc, spreadsheet_id)
+            left = _token_seconds_left(gc)
+            state.update(ready=True, last_error=None, error_kind=None, token_seconds_left=left, warmed_at=time.time(),
+                         token_expires_at=time.time() + left if left is not None else None)
+            left = _token_seconds_left(gc) or PREWARM_RETRY_SEC
+            time.sleep(max(PREWARM_RETRY_SEC, left - TOKEN_REFRESH_MARGIN_SEC))
+        except Exception as e:
+            state.update(last_error=f"{type(e).__name__}: {e}"[:300], error_kind=error_kind(e))
+            time.sleep(PREWARM_RETRY_SEC)
+
+def connection_health() -> dict:
+    """事前接続と遮断の状態（ヘルスチェック用。Googleには問い合わせない）"""
+    now = time.time()
+    connections = {}
+    for email, state in list(connection_state.items()):
+        expires = state.get("token_expires_at")
+        connections[email] = {
+            "ready": bool(state.get("ready")),
+            "last_error": state.get("last_error"),
+            "error_kind": state.get("error_kind"),
+            "token_seconds_left": round(expires - now) if expires else None,
+            "warmed_sec_ago": round(now - state["warmed_at"]) if state.get("warmed_at") else None,
+        }
+    return {
+        "connections": connections,
+        "breaker_open": breaker.opened_at is not None,
+        "throttled": throttled_at is not None and now - throttled_at < THROTTLED_SEC,
+    }
+
+def prewarm(info: dict, spreadsheet_ids: list[str], scopes: list[str] = SCOPES):
+    """認証・トークン取得・open_by_key を裏のスレッドで先に済ませておく
+
+    プロセスで最初に呼ばれたときにスレッドを1本起動し、以降は何もしない（すぐ戻る）。
+    スレッドはトークンの期限が切れる前に取り直し続けるので、
+    利用者の操作で認証の待ち時間が発生しない。
+    """
+    key = (info.get("client_email"), tuple(scopes), tuple(spreadsheet_ids))
+    with _warmers_lock:
+        t = _warmers.get(key)
+        if t is not None and t.is_alive():
+            return
+        t = threading.Thread(
+            target=_warm_loop, args=(info, scopes, list(spreadsheet_ids)),
+            name="hokusei-prewarm", daemon=True,
+        )
+        _warmers[key] = t
+        t.start()
+
+########################################
+# 読み込みキャッシュ（Drive の版で確かめる）
+########################################
+
+CACHE_REVALIDATE_SEC = 15  # 版を確かめてからこの秒数は、確かめずにそのまま使う
+
+class SheetCache:
+    """スプレッドシートの中身をプロセスで1つだけ持つ（何人が見ても、何ページで使っても同じ控え）
+
+    使う前に Drive の files.get（version / modifiedTime だけ）で変わったかを確かめ、
+    変わっていたときだけ読み直す。版の確認は Sheets の読み込み回数を使わない。
+    同じスプレッドシートを同時に読み直すのは1スレッドだけ（他は待って同じ結果を使う）。
+    版が変わるとタブをまるごと読み直すので、あまり書かれない表（マスタなど）を読むページ向け。
+    毎日追記される日報のシートには使わない（追記分だけ読む hokusei_sync / SubmittedIndex を使う）。
+    今のところアプリからは呼んでいない。
+    """
+
+    def __init__(self, revalidate_sec: float = CACHE_REVALIDATE_SEC):
+        self.revalidate_sec = revalidate_sec
+        self._entries: dict = {}  # スプレッドシートID → {"version", "checked_at", "tabs": {タブ名: 行}}
+        self._locks: dict = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.downloads = 0
+
+    def _entry_lock(self, spreadsheet_id: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(spreadsheet_id, threading.Lock())
+
+    def values(self, gc: gspread.Client, spreadsheet_id: str, worksheet: str | None = None) -> list[list[str]]:
+        """ワークシートの全部の値（get_all_values と同じ形）。worksheet が None なら先頭のタブ"""
+        with self._entry_lock(spreadsheet_id):
+            entry = self._entries.setdefault(spreadsheet_id, {"version": None, "checked_at": 0.0, "tabs": {}})
+            if time.monotonic() - entry["checked_at"] >= self.revalidate_sec:
+                # 読む前に版を取る（読んでいる間に書かれたら、次の確認で版が変わって読み直す）
+                version = drive_version(gc, spreadsheet_id)
+                entry["checked_at"] = time.monotonic()
+                if version != entry["version"]:
+                    entry.update(version=version, tabs={})
+            rows = entry["tabs"].get(worksheet)
+            if rows is not None:
+                self.hits += 1
+                return rows
+            sh = open_spreadsheet(gc, spreadsheet_id)
+            ws = sh.sheet1 if worksheet is None else sh.worksheet(worksheet)
+            with span("sheets.cache_download", spreadsheet=spreadsheet_id, worksheet=worksheet or ""):
+                rows = ws.get_all_values()
+            entry["tabs"][worksheet] = rows
+            self.downloads += 1
+            return rows
+
+    def invalidate(self, spreadsheet_id: str):
+        """次は版を確かめ直す（このプロセスから書いた直後など）"""
+        with self._lock:
+            entry = self._entries.get(spreadsheet_id)
+            if entry is not None:
+                entry["checked_at"] = 0.0
+
+def drive_version(gc: gspread.Client, spreadsheet_id: str) -> str:
+    """スプレッドシートの版（Drive の version と modifiedTime。中身が変わるたびに変わる）"""
+    if hasattr(gc, "drive_version"):
+        return gc.drive_version(spreadsheet_id)  # ローカルのシート（hokusei_fake）
+    from gspread.urls import DRIVE_FILES_API_V3_URL
+
+    r = gc.http_client.request(
+        "get", f"{DRIVE_FILES_API_V3_URL}/{spreadsheet_id}",
+        params={"fields": "version,modifiedTime", "supportsAllDrives": True},
+    )
+    meta = r.json()
+    return f"{meta.get('version')}:{meta.get('modifiedTime')}"
+
+sheet_cache = SheetCache()
+
+def cached_values(gc: gspread.Client, spreadsheet_id: str, worksheet: str | None = None) -> list[list[str]]:
+    """プロセスで共有する読み込みキャッシュから値を返す（変わっていなければダウンロードしない）
+
+    返した行は全員で共有しているので書き換えないこと。
+    """
+    return sheet_cache.values(gc, spreadsheet_id, worksheet)
+
+########################################
+# 追記（append）
+########################################
+
+_RANGE_RE = re.compile(r"!?\$?([A-Z]+)\$?(\d+)(?::\$?([A-Z]+)\$?(\d+))?$")
+
+def updated_row_range(response: dict) -> tuple[int, int] | None:
+    """values.append のレスポンスから書き込まれた行範囲(1オリジン)を返す"""
+    updated = ((response or {}).get("updates") or {}).get("updatedRange") or ""
+    a1 = updated.rsplit("!", 1)[-1]
+    m = _RANGE_RE.search(a1)
+    if not m:
+        return None
+    start = int(m.group(2))
+    end = int(m.group(4)) if m.group(4) else start
+    return start, end
+
+GROW_ROWS = 1000  # 行が足りないときにまとめて増やす行数
+
+def ensure_rows(ws: gspread.Worksheet, last_row: int, extra: int = GROW_ROWS):
+    """last_row 行目まで書けるようにシートの行を増やす
+
+    values.update / values.batchUpdate は append と違ってグリッドを広げない
+    （シートの行数より下に書くと 400）。row_count は開いたときのメタデータなので API は呼ばない。
+    """
+    if last_row > ws.row_count:
+        ws.add_rows(last_row - ws.row_count + extra)
+
+def with_total(rows: list[list], total_text: str, width: int = 7) -> list[list]:
+    """全行を width 列にそろえ、最後の行の width 列目に合計を入れる"""
+    out = [list(r) + [""] * (width - len(r)) for r in rows]
+    if out:
+        out[-1][width - 1] = total_text
+    return out
+
+########################################
+# 複数ワークシートへの一括追記（batchUpdate / appendCells）
+########################################
+
+_DATE_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+_NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+_SHEETS_EPOCH = date(1899, 12, 30)  # スプレッドシートの日付シリアル値の起点
+
+def to_cell(value, value_input_option: str = "RAW") -> dict:
+    """1セル分の CellData を作る
+
+    USER_ENTERED のときは values.append と同じように見えるよう、
+    日付文字列(YYYY-MM-DD)は日付、数字だけの文字列は数値として書く。
+    """
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {"userEnteredValue": {"boolValue": value}}
+    if isinstance(value, (int, float)):
+        return {"userEnteredValue": {"numberValue": value}}
+    text = str(value)
+    if value_input_option == "USER_ENTERED":
+        m = _DATE_RE.match(text)
+        if m:
+            serial = (date(int(m.group(1)), int(m.group(2)), int(m.group(3))) - _SHEETS_EPOCH).days
+            return {
+                "userEnteredValue": {"numberValue": serial},
+                "userEnteredFormat": {"numberFormat": {"type": "DATE", "pattern": "yyyy-mm-dd"}},
+            }
+        if _NUMBER_RE.match(text):
+            return {"userEnteredValue": {"numberValue": float(text)}}
+        if text.startswith("="):
+            return {"userEnteredValue": {"formulaValue": text}}
+    return {"userEnteredValue": {"stringValue": text}}
+
+def append_cells_request(sheet_id: int, rows: list[list], value_input_option: str = "RAW") -> dict:
+    """batchUpdate 用の appendCells リクエスト（そのワークシートの最終行の後ろに追加）"""
+    return {
+        "appendCells": {
+            "sheetId": sheet_id,
+            "rows": [{"values": [to_cell(v, value_input_option) for v in r]} for r in rows],
+            "fields": "userEnteredValue,userEnteredFormat.numberFormat",
+        }
+    }
+
+########################################
+# 空き行の割り当て（メモ共有シート）
+########################################
+
+class RowSlots:
+    """指定列が空の行を、空いている順（上から）に1行ずつ割り当てる
+
+    - 列の読み込みは初回と refresh_sec ごとの1回だけ（送信のたびに列全体を読まない）
+    - 控えの空き行は手で書き込まれたかもしれないので、割り当てる前にその1セルだけ読んで空か確かめる
+    - 空き行は小さい順のヒープで覚えておくので、探すのに行数ぶんの走査はいらない
+    - 割り当て中の行はロックで管理し、同時に送った人に同じ行は渡さない
+    - シート側で消された行（取り消し）も、次の読み直しで再利用の対象に戻る
+    """
+
+    def __init__(self, column: int, start_row: int, refresh_sec: float = 600.0):
+        self.column = column
+        self.start_row = start_row
+        self.refresh_sec = refresh_sec
+        self._free: list[int] = []      # 空き行（ヒープ）
+        self._next_row = start_row      # これ以降は全部空き
+        self._reserved: set[int] = set()  # 割り当て済みで書き込み中の行
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _load(self, ws):
+        values = ws.col_values(self.column)
+        free = [
+            i + 1 for i in range(self.start_row - 1, len(values))
+            if str(values[i]).strip() == "" and (i + 1) not in self._reserved
+        ]
+        heapq.heapify(free)
+        self._free = free
+        self._next_row = max(len(values) + 1, self.start_row)
+        while self._next_row in self._reserved:
+            self._next_row += 1
+        self._loaded_at = time.monotonic()
+
+    def _is_blank(self, ws, row: int) -> bool:
+        from gspread.utils import rowcol_to_a1
+
+        values = ws.get(rowcol_to_a1(row, self.column))
+        return not values or not values[0] or str(values[0][0]).strip() == ""
+
+    def allocate(self, ws) -> int:
+        """空き行を1つ予約して返す。書き込みが終わったら done / 失敗したら release
+
+        列の控えは最大 refresh_sec 古いので、控えの空き行（ヒープ）から出した行だけ1セル読んで確かめ、
+        手で埋められていたら飛ばす。控えの最終行より後ろは空に決まっているので読まない。
+        1セルの読み込みはロックの外で行う（先に予約しておき、埋まっていたら予約を外す）。
+        """
+        while True:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_sec:
+                    self._load(ws)
+                from_heap = bool(self._free)
+                if from_heap:
+                    row = heapq.heappop(self._free)
+                else:
+                    while self._next_row in self._reserved:  # claim で予約した行（書けたか確かめ中）
+                        self._next_row += 1
+                    row = self._next_row
+                    self._next_row += 1
+                self._reserved.add(row)
+            if not from_heap:
+                return row
+            try:
+                blank = self._is_blank(ws, row)
+            except Exception:
+                self.release(row)
+                raise
+            if blank:
+                return row
+            self.done(row)  # 手で埋められていた：空きから外して次を探す
+
+    def claim(self, row: int):
+        """決まった行を予約する（書けたか不明だった行に書き直すとき。空きの控えからも外す）"""
+        with self._lock:
+            self._reserved.add(row)
+            if row in self._free:
+                self._free.remove(row)
+                heapq.heapify(self._free)
+
+    def done(self, row: int):
+        """書き込めた行は予約を外す（もう空きではない）"""
+        with self._lock:
+            self._reserved.discard(row)
+
+    def release(self, row: int):
+        """書き込めなかった行は空きに戻す"""
+        with self._lock:
+            self._reserved.discard(row)
+            heapq.heappush(self._free, row)
@@ -0,0 +1,363 @@
+# hokusei_summary.py
+# 日別集計タブ（日付・名前ごとの数値の合計）をアウトボックスの書き込みのたびに足し込む
+# - 送信ボタンでは日報の行と一緒に「この送信で足す時間」（summary）をアウトボックスにためる
+# - 裏のスレッドがローカルのSQLite（アウトボックスと同じファイル）で合計を足し、
+#   その合計を「日別集計」タブの決まった行に書く（足し算はローカル、シートには結果を書くだけ）
+# - 同じ送信を2回足さない（送信IDで覚える）。シートへの書き込みは何度やり直しても同じ値になる
+#
+# 列: 日付 / 名前 / 通常時間 / 自動運転時間 / 移動時間 / 件数（送信の回数。作業の行数ではない）
+# 日別集計タブはこのアプリのサーバー（1プロセス）だけが書く前提。
+#
+# 送信済みの索引（SubmittedIndex）：送信ボタンの前に「この日はもう送信済み」と知らせる
+# - (日付, 名前) → 送信済みの作業の件数・合計時間をメモリに持つ（確認は辞書を引くだけ）
+# - このプロセスからの送信はアウトボックスにためた時点で足す（シートに書けるのを待たない）
+# - ほかの端末・手入力の行は裏のスレッドが前回の続きから読み足す（版が同じなら読まない）
+
+import re
+import threading
+import time
+import unicodedata
+from datetime import date, timedelta
+
+from hokusei_sheets import drive_version, ensure_rows, open_spreadsheet
+from hokusei_sync import read_since, row_hash, to_day
+from hokusei_trace import span
+
+SUMMARY_TAB = "日別集計"
+SUMMARY_HEADER = ["日付", "名前", "通常時間", "自動運転時間", "移動時間", "件数"]
+AUTO_TAB = "自動運転"     # 機械課：自動運転の行を書くタブ
+AUTO_GENRE = "自動運転"
+MISC_CUSTOMER = "雑務"
+MOVE_JOB = "移動"          # 仕上げの客先トライの移動時間（雑務 / 移動 の行）
+SENT_HEADER = "送信日時"   # 仕上げの送信ごとの見出し行（集計しない）
+
+# アウトボックスのSQLiteに作る（SummaryTable を作るときに作る）
+SUMMARY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summary (
+    spreadsheet_id TEXT    NOT NULL,
+    day            TEXT    NOT NULL,
+    name           TEXT    NOT NULL,
+    row_no         INTEGER NOT NULL,   -- 日別集計タブの行
+    normal         REAL    NOT NULL DEFAULT 0,
+    auto           REAL    NOT NULL DEFAULT 0,
+    move           REAL    NOT NULL DEFAULT 0,
+    entries        INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (spreadsheet_id, day, name)
+);
+CREATE TABLE IF NOT EXISTS summary_applied (
+    submission_id  TEXT PRIMARY KEY,     -- もう足した送信
+    applied_at     REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS summary_loaded (
+    spreadsheet_id TEXT PRIMARY KEY      -- 既存の日別集計タブを読み込み済み
+);
+"""
+
+
+########################################
+# 送信側：足す時間を求める
+########################################
+
+def _hours(value) -> float:
+    """仕上げの parse_hours_maybe と同じ（1.5 / １．５ / 1.5h / 1.5時間 → 1.5、読めなければ 0）"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    s = unicodedata.normalize("NFKC", str(value or ""))
+    s = s.replace("，", ".").replace("、", ".").replace("．", ".")
+    s = re.sub(r"(時間|h|ｈ)", "", s, flags=re.IGNORECASE)
+    m = re.search(r"(\d+(?:\.\d+)?)", s)
+    return float(m.group(1)) if m else 0.0
+
+
+def _summary_day(value) -> str:
+    """集計の日付のキー（YYYY-MM-DD。シートから読んだ表示の日付も同じキーにする）"""
+    return to_day(value) or str(value).strip()
+
+
+def summary_deltas(payload: dict) -> list[list]:
+    """日報の payload（rows または sheets）から [日付, 名前, 通常, 自動運転, 移動, 件数] を作る
+
+    件数は (日付, 名前) ごとに1（1回の送信で何作業あっても1件）。
+    """
+    sheets = payload["sheets"] if "sheets" in payload else {None: payload["rows"]}
+    totals: dict[tuple, list] = {}
+    for title, rows in sheets.items():
+        for r in rows:
+            cells = ["" if c is None else c for c in list(r) + [""] * (6 - len(r))]
+            if not str(cells[0]).strip() or str(cells[0]).strip() == SENT_HEADER:
+                continue
+            t = totals.setdefault((_summary_day(cells[0]), str(cells[1]).strip()), [0.0, 0.0, 0.0, 1])
+            hours = _hours(cells[5])
+            if title == AUTO_TAB or str(cells[3]).strip() == AUTO_GENRE:
+                t[1] += hours
+            elif str(cells[2]).strip() == MISC_CUSTOMER and str(cells[4]).strip() == MOVE_JOB:
+                t[2] += hours
+            else:
+                t[0] += hours
+    return [[day, name, *t] for (day, name), t in totals.items()]
+
+
+########################################
+# フラッシャ側：足してシートに書く
+########################################
+
+class SummaryTable:
+    """日別集計の合計（アウトボックスのSQLiteに置く。db と lock はアウトボックスと共有）"""
+
+    def __init__(self, db, lock):
+        self._db = db
+        self._lock = lock
+        with self._lock:
+            db.executescript(SUMMARY_SCHEMA)
+
+    def loaded(self, spreadsheet_id: str) -> bool:
+        with self._lock:
+            return self._db.execute(
+                "SELECT 1 FROM summary_loaded WHERE spreadsheet_id = ?", (spreadsheet_id,)).fetchone() is not None
+
+    def load(self, spreadsheet_id: str, values: list[list]):
+        """日別集計タブの中身（見出しつき）を取り込む。初めてのときだけ"""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for row_no, r in enumerate(values[1:], start=2):
+                    r = list(r) + [""] * (len(SUMMARY_HEADER) - len(r))
+                    if not r[0] and not r[1]:
+                        continue
+                    # 日付は表示の形（2025/10/15 など）で返ってくるので、足すときと同じキーにそろえる
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (spreadsheet_id, _summary_day(r[0]), str(r[1]).strip(), row_no,
+                         _hours(r[2]), _hours(r[3]), _hours(r[4]),
+                         int(_hours(r[5]))),
+                    )
+                self._db.execute("INSERT INTO summary_loaded VALUES (?)", (spreadsheet_id,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _add(self, spreadsheet_id: str, submission_id: str | None, deltas: list[list]):
+        """足す（同じ送信IDはもう足してあれば足さない＝前回シートに書けなかった分を書き直すだけ）"""
+        db = self._db
+        if submission_id and db.execute(
+                "INSERT OR IGNORE INTO summary_applied VALUES (?, ?)", (submission_id, time.time())).rowcount == 0:
+            return
+        for day, name, normal, auto, move, entries in deltas:
+            cur = db.execute(
+                "UPDATE summary SET normal = normal + ?, auto = auto + ?, move = move + ?, entries = entries + ?"
+                " WHERE spreadsheet_id = ? AND day = ? AND name = ?",
+                (normal, auto, move, entries, spreadsheet_id, day, name),
+            )
+            if cur.rowcount == 0:
+                (last,) = db.execute(
+                    "SELECT COALESCE(MAX(row_no), 1) FROM summary WHERE spreadsheet_id = ?", (spreadsheet_id,)
+                ).fetchone()
+                db.execute(
+                    "INSERT INTO summary VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (spreadsheet_id, day, name, last + 1, normal, auto, move, entries),
+                )
+
+    def add(self, spreadsheet_id: str, items: list[tuple]) -> list:
+        """(送信ID, deltas) をまとめて足し、変わった (日付, 名前) の今の合計の行を返す"""
+        keys = sorted({(d[0], d[1]) for _, deltas in items for d in deltas})
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for submission_id, deltas in items:
+                    self._add(spreadsheet_id, submission_id, deltas)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            current = [
+                self._db.execute(
+                    "SELECT row_no, day, name, normal, auto, move, entries FROM summary"
+                    " WHERE spreadsheet_id = ? AND day = ? AND name = ?",
+                    (spreadsheet_id, day, name),
+                ).fetchone()
+                for day, name in keys
+            ]
+        return [r for r in current if r is not None]
+
+    def purge(self, before: float):
+        """書き込み済みの行と一緒に、足した送信IDの控えも消す"""
+        with self._lock:
+            self._db.execute("DELETE FROM summary_applied WHERE applied_at < ?", (before,))
+
+
+def write_summary(ws, table: SummaryTable, spreadsheet_id: str, items: list[tuple]) -> tuple[int, int] | None:
+    """summary をまとめて足し、変わった行だけを1回の values.batchUpdate で書く
+
+    ws は日別集計タブ、items は (送信ID, deltas) のリスト。戻り値は書いた行の範囲。
+    """
+    if not table.loaded(spreadsheet_id):
+        # 初めてのとき：タブにある合計を読み込んで続きから足す（アウトボックスを作り直した場合など）
+        values = ws.get_all_values()
+        if not values:
+            ws.update([SUMMARY_HEADER], range_name="A1")
+        table.load(spreadsheet_id, values)
+
+    current = table.add(spreadsheet_id, items)
+    if not current:
+        return None
+    rows = [r["row_no"] for r in current]
+    ensure_rows(ws, max(rows))  # 新しい (日付, 名前) がタブの行数を超えたら先に行を増やす
+    data = [
+        {"range": f"A{r['row_no']}:F{r['row_no']}",
+         "values": [[r["day"], r["name"], r["normal"], r["auto"], r["move"], r["entries"]]]}
+        for r in current
+    ]
+    with span("summary.write", rows=len(data)):
+        ws.batch_update(data, value_input_option="USER_ENTERED")
+    return (min(rows), max(rows))
+
+
+########################################
+# 送信済みの索引（二重送信の注意）
+########################################
+
+SUBMITTED_REFRESH_SEC = 30  # シートを読み足す間隔（版が変わっていなければ読まない）
+SUBMITTED_KEEP_DAYS = 62    # これより前の日付の行は索引に入れない
+ID_INDEX = 7                # H列：アウトボックスが書く送信ID
+
+_indexes: dict = {}  # スプレッドシートID → このプロセスの SubmittedIndex
+_indexes_lock = threading.Lock()
+
+
+class SubmittedIndex:
+    """(日付, 名前) → 送信済みの作業の件数・合計時間（プロセスで1つ、全セッションで共有）
+
+    送信ごと（送信ID × タブ）に覚えるので、自分の送信をあとでシートから読み直しても二重に数えない。
+    送信IDのない行（手入力など）は行ごとに覚える。
+    """
+
+    def __init__(self, spreadsheet_id: str, worksheets: list[str | None], client_factory,
+                 refresh_sec: float = SUBMITTED_REFRESH_SEC):
+        # worksheets: 日報を書くタブ（None なら先頭のタブ）。アプリが enqueue に渡すのと同じ名前
+        self.spreadsheet_id = spreadsheet_id
+        self.worksheets = list(worksheets)
+        self.refresh_sec = refresh_sec
+        self._client_factory = client_factory
+        self._client = None
+        self._entries: dict = {}  # (日付, 名前) → {(送信ID または #行番号, タブ): (時間, 件数)}
+        self._marks: dict = {}    # タブ → (最後に読んだ行, その行のハッシュ)
+        self._version = None
+        self._refreshed_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = threading.Lock()
+        self.ready = False  # シートを一度読み終えた
+        self.last_error: str | None = None
+
+    @staticmethod
+    def _group(rows: list[list], first_row: int, title: str | None, sid: str | None = None) -> dict:
+        """行を (日付, 名前) → {(送信ID, タブ): (時間, 件数)} にまとめる"""
+        cutoff = (date.today() - timedelta(days=SUBMITTED_KEEP_DAYS)).isoformat()
+        out: dict = {}
+        for i, r in enumerate(rows):
+            cells = list(r) + [""] * (ID_INDEX + 1 - len(r))
+            if str(cells[0]).strip() == SENT_HEADER:
+                continue
+            day = to_day(cells[0])
+            if day is None or day < cutoff:
+                continue
+            key = (sid or str(cells[ID_INDEX]).strip() or f"#{first_row + i}", title)
+            parts = out.setdefault((day, str(cells[1]).strip()), {})
+            hours, n = parts.get(key, (0.0, 0))
+            parts[key] = (hours + _hours(cells[5]), n + 1)
+        return out
+
+    def _merge(self, grouped: dict):
+        for key, parts in grouped.items():
+            self._entries.setdefault(key, {}).update(parts)
+
+    def lookup(self, day, name: str) -> tuple[float, int] | None:
+        """その日・その人の送信済みの (合計時間, 件数)。なければ None（シートは読まない）"""
+        self._kick()
+        with self._lock:
+            parts = self._entries.get((to_day(str(day)), str(name).strip()))
+            if not parts:
+                return None
+            return sum(h for h, _ in parts.values()), sum(n for _, n in parts.values())
+
+    def note(self, worksheet: str | None, rows: list[list], sid: str | None):
+        """このプロセスからの送信を足す（アウトボックスにためたとき）"""
+        if sid is None:
+            return  # 送信IDがないと、あとでシートから読んだ行と見分けられない
+        grouped = self._group(rows, 0, worksheet, sid)
+        with self._lock:
+            self._merge(grouped)
+
+    def _kick(self):
+        """前回から refresh_sec たっていれば裏のスレッドで読み足す（待たない）"""
+        if time.monotonic() - self._refreshed_at < self.refresh_sec:
+            return
+        if not self._refreshing.acquire(blocking=False):
+            return
+        self._refreshed_at = time.monotonic()
+        threading.Thread(target=self._refresh_in_background, name="hokusei-submitted", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"[:300]
+        finally:
+            self._refreshing.release()
+
+    def refresh(self):
+        """スプレッドシートの版が変わっていたら、各タブを前回の続きから読み足す"""
+        if self._client is None:
+            self._client = self._client_factory()
+        version = drive_version(self._client, self.spreadsheet_id)  # 読む前に取る（読んでいる間の書き込みは次回）
+        if version == self._version:
+            return
+        sh = open_spreadsheet(self._client, self.spreadsheet_id)
+        for title in self.worksheets:
+            ws = sh.sheet1 if title is None else sh.worksheet(title)
+            with span("submitted.refresh", worksheet=title or "") as sp:
+                values, first, reset = read_since(ws, *self._marks.get(title, (0, None)))
+                sp.update(rows=len(values), reset=reset)
+            grouped = self._group(values, first, title)
+            with self._lock:
+                if reset:
+                    # 行の削除・並べ替えがあった：このタブの分を読み直した内容に入れ替える
+                    for parts in self._entries.values():
+                        for key in [k for k in parts if k[1] == title]:
+                            del parts[key]
+                self._merge(grouped)
+                if values:
+                    self._marks[title] = (first + len(values) - 1, row_hash(values[-1]))
+        self._version = version
+        self.ready = True
+
+
+def submitted_index(spreadsheet_id: str, worksheets: list[str | None], client_factory) -> SubmittedIndex:
+    """スプレッドシートの送信済みの索引（プロセスで1つ。初めて呼ばれたときに裏で読み始める）"""
+    with _indexes_lock:
+        index = _indexes.get(spreadsheet_id)
+        if index is None:
+            index = _indexes[spreadsheet_id] = SubmittedIndex(spreadsheet_id, worksheets, client_factory)
+    index._kick()
+    return index
+
+
+def note_submitted(spreadsheet_id: str, worksheet: str | None, payload: dict, sid: str | None):
+    """アウトボックスにためた日報の行を索引に足す（索引がなければ何もしない）"""
+    index = _indexes.get(spreadsheet_id)
+    if index is None:
+        return
+    sheets = payload["sheets"] if "sheets" in payload else {worksheet: payload["rows"]}
+    for title, rows in sheets.items():
+        index.note(title, rows, sid)
+
+
+def submitted_message(index: SubmittedIndex, day, name: str) -> str | None:
+    """送信前に出す注意（まだ何も送っていなければ None）"""
+    found = index.lookup(day, name)
+    if found is None:
+        return None
+    hours, n = found
+    return (f"{day} の {name} さんの日報はすでに送信されています（{n} 件・合計 {hours:.2f} 時間）。"
+            "同じ作業を二重に送信しないようご注意ください。")
@@ -0,0 +1,313 @@
+# hokusei_sync.py
+# 日報シートの差分同期（集計・月報用のローカルの控え）
+# - ワークシートごとに「どの行まで取り込んだか」（行の水位）を覚え、次回はその次の行からだけ読む
+# - スプレッドシートの版（Drive）が前回と同じなら、そのスプレッドシートは読みに行かない
+# - 取り込んだ行は日付・名前・メーカー・作業内容・工番・時間にそろえてローカルのSQLiteに入れる
+# - 月報はSQLiteから読むだけなので、何年分たまっても数秒・API数回で作れる
+#
+# 日報は追記しかしない前提。最後に取り込んだ行が変わっていたら（行の削除・挿入・手直し）、
+# そのワークシートだけ最初から取り込み直す。
+#
+# 使い方: python tools/sync_nippo.py（同期） / load_frame()（集計側で DataFrame として読む）
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+from hokusei_sheets import drive_version, get_client, open_spreadsheet
+from hokusei_trace import span
+
+SYNC_DB = Path(os.environ.get("HOKUSEI_SYNC_DB", Path(__file__).resolve().parent / ".sync" / "nippo.sqlite3"))
+
+WIDTH = 8              # A〜H列（H列はアウトボックスが書く送信ID）
+
+# 同期するワークシート：名前 → (スプレッドシートID, ワークシート名 / Noneなら先頭のタブ)
+# スプレッドシートIDは各アプリの SPREADSHEET_ID / GOOGLE_SHEET_ID と同じ
+SOURCES = {
+    "siage": ("1MXSg8qP_eT7lVczYpNB66sZGZP2NlWHIGz9jAWKH7Ss", None),
+    "kikai": ("1XdfjbRSYWJhlYNB12okcUeVMXPzBLxsv85sw4dLoOjQ", "シート1"),
+    "kikai_auto": ("1XdfjbRSYWJhlYNB12okcUeVMXPzBLxsv85sw4dLoOjQ", "自動運転"),
+    "cad": ("1OHkocLV4MiYFgim2fARSSQzSrQcW3njvnnnhgkMm-l4", None),
+    "sekkei": ("1ApUfZcqbp_YK6FlNZLQ-3zA5Rd6gME7cNzC76q6YqS0", None),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS watermarks (
+    source         TEXT PRIMARY KEY,
+    spreadsheet_id TEXT NOT NULL,
+    worksheet      TEXT,            -- NULLなら先頭のタブ
+    last_row       INTEGER NOT NULL DEFAULT 0,  -- ここまで取り込んだ（最後の空でない行）
+    tail_hash      TEXT,            -- last_row の行の中身（変わっていたら取り込み直す）
+    synced_at      REAL,
+    drive_version  TEXT             -- 取り込んだときのスプレッドシートの版（同じなら読みに行かない）
+);
+CREATE TABLE IF NOT EXISTS rows (
+    source         TEXT    NOT NULL,
+    row_no         INTEGER NOT NULL,  -- シートの行番号
+    kind           TEXT    NOT NULL,  -- work（作業の行） / sent（仕上げの「送信日時」行） / other
+    day            TEXT,              -- YYYY-MM-DD
+    name           TEXT,
+    customer       TEXT,
+    genre          TEXT,
+    job            TEXT,
+    hours          REAL,
+    hours_text     TEXT,              -- 時間のセルそのまま（集計側で parse_hours_maybe と同じ規則で読む）
+    note           TEXT,              -- 7列目（「合計 8.00 時間」など）
+    submission_id  TEXT,
+    raw            TEXT    NOT NULL,  -- 元の行（JSON）
+    PRIMARY KEY (source, row_no)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS rows_day ON rows (day, source);
+"""
+
+# 以前の控えに足りない列
+_MIGRATIONS = {
+    ("rows", "hours_text"): "ALTER TABLE rows ADD COLUMN hours_text TEXT",
+    ("watermarks", "drive_version"): "ALTER TABLE watermarks ADD COLUMN drive_version TEXT",
+}
+
+
+########################################
+# 行をそろえる
+########################################
+
+def to_day(value) -> str | None:
+    """日付のセルを YYYY-MM-DD に（文字列・スラッシュ区切り・シリアル値）"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        if 20000 < value < 80000:  # 1954〜2119年のシリアル値だけ日付とみなす
+            return (date(1899, 12, 30) + timedelta(days=int(value))).isoformat()
+        return None
+    text = str(value or "").strip().replace("/", "-")
+    parts = text.split(" ")[0].split("-")
+    if len(parts) != 3 or not all(p.isdigit() for p in parts):
+        return None
+    try:
+        return date(int(parts[0]), int(parts[1]), int(parts[2])).isoformat()
+    except ValueError:
+        return None
+
+
+def _to_hours(value) -> float | None:
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+
+def normalize(source: str, row_no: int, cells: list) -> dict | None:
+    """シートの1行を rows テーブルの1行にする（空行は None）"""
+    cells = list(cells[:WIDTH]) + [""] * (WIDTH - len(cells[:WIDTH]))
+    if not any(str(c).strip() for c in cells):
+        return None
+    text = ["" if c is None else str(c).strip() for c in cells]
+    rec = {
+        "source": source, "row_no": row_no, "kind": "other", "day": None,
+        "name": text[1], "customer": text[2], "genre": text[3], "job": text[4],
+        "hours": None, "hours_text": text[5], "note": text[6], "submission_id": text[7] or None,
+        "raw": json.dumps(cells, ensure_ascii=False, default=str),
+    }
+    if text[0] == "送信日時":
+        # 仕上げ課：送信ごとの見出し行（名前 / 実際の送信日時）
+        rec.update(kind="sent", customer="", genre="", job="", note=text[2])
+        return rec
+    rec["day"] = to_day(cells[0])
+    rec["hours"] = _to_hours(cells[5])  # 数字だけのとき。「1.5h」などは hours_text から読む
+    if rec["day"] and text[5]:
+        rec["kind"] = "work"
+    return rec
+
+
+def row_hash(cells: list) -> str:
+    cells = ["" if c is None else str(c) for c in cells[:WIDTH]]
+    while cells and not cells[-1]:
+        cells.pop()
+    return hashlib.sha1(json.dumps(cells, ensure_ascii=False).encode()).hexdigest()
+
+
+########################################
+# 同期
+########################################
+
+def open_db(path: Path | str = SYNC_DB) -> sqlite3.Connection:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(path, isolation_level=None)
+    db.row_factory = sqlite3.Row
+    db.execute("PRAGMA journal_mode=WAL")
+    db.executescript(_SCHEMA)
+    for (table, col), ddl in _MIGRATIONS.items():
+        if col not in {r["name"] for r in db.execute(f"PRAGMA table_info({table})")}:
+            db.execute(ddl)
+    return db
+
+
+def _watermark(db: sqlite3.Connection, source: str) -> tuple[int, str | None]:
+    row = db.execute("SELECT last_row, tail_hash FROM watermarks WHERE source = ?", (source,)).fetchone()
+    return (row["last_row"], row["tail_hash"]) if row else (0, None)
+
+
+def _drive_version(db: sqlite3.Connection, source: str) -> str | None:
+    row = db.execute("SELECT drive_version FROM watermarks WHERE source = ?", (source,)).fetchone()
+    return row["drive_version"] if row else None
+
+
+def _fetch(ws, first_row: int) -> list[list]:
+    """first_row 行目から最後まで（1回の values.get。末尾の空行は返らない）"""
+    with span("sync.fetch", first_row=first_row) as sp:
+        values = ws.get(
+            f"A{first_row}:H",
+            value_render_option="UNFORMATTED_VALUE", date_time_render_option="FORMATTED_STRING",
+        )
+        sp["rows"] = len(values)
+    return [list(r) for r in values]
+
+
+def read_since(ws, last_row: int, tail_hash: str | None) -> tuple[list[list], int, bool]:
+    """水位から先の行を読む。戻り値は (行, 先頭の行番号, 最初から取り込み直すか)"""
+    if last_row:
+        # 最後に取り込んだ行から読む（1行重ねて、変わっていないか確かめる）
+        values = _fetch(ws, last_row)
+        if values and row_hash(values[0]) == tail_hash:
+            return values[1:], last_row + 1, False
+        return _fetch(ws, 1), 1, True
+    return _fetch(ws, 1), 1, False
+
+
+def _store(db: sqlite3.Connection, source: str, spreadsheet_id: str, worksheet: str | None,
+           values: list[list], first: int, reset: bool, version: str | None = None) -> dict:
+    """読んだ行と新しい水位を1トランザクションで書く（version は読む前に取ったスプレッドシートの版）"""
+    last_row, tail_hash = (0, None) if reset else _watermark(db, source)
+    records = [r for r in (normalize(source, first + i, cells) for i, cells in enumerate(values)) if r]
+    if values:
+        last_row, tail_hash = first + len(values) - 1, row_hash(values[-1])
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        if reset:
+            db.execute("DELETE FROM rows WHERE source = ?", (source,))
+        db.executemany(
+            "INSERT OR REPLACE INTO rows (source, row_no, kind, day, name, customer, genre, job, hours,"
+            " hours_text, note, submission_id, raw) VALUES (:source, :row_no, :kind, :day, :name, :customer,"
+            " :genre, :job, :hours, :hours_text, :note, :submission_id, :raw)",
+            records,
+        )
+        db.execute(
+            "INSERT OR REPLACE INTO watermarks (source, spreadsheet_id, worksheet, last_row, tail_hash, synced_at,"
+            " drive_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (source, spreadsheet_id, worksheet, last_row, tail_hash, time.time(), version),
+        )
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+    return {"source": source, "rows": len(records), "last_row": last_row, "reset": reset}
+
+
+def sync_source(db: sqlite3.Connection, ws, source: str, spreadsheet_id: str, worksheet: str | None,
+                full: bool = False) -> dict:
+    """1つのワークシートを水位から先だけ取り込む。戻り値は件数などの内訳"""
+    last_row, tail_hash = (0, None) if full else _watermark(db, source)
+    values, first, reset = read_since(ws, last_row, tail_hash)
+    return _store(db, source, spreadsheet_id, worksheet, values, first, reset or full)
+
+
+def sync_all(info: dict, db_path: Path | str = SYNC_DB, sources: list[str] | None = None,
+             full: bool = False, workers: int = 4) -> list[dict]:
+    """全ワークシートを差分同期する
+
+    読み込みはスプレッドシートごとにスレッドで並べて行う（open_by_key と worksheets() は1回ずつ）。
+    先に Drive でスプレッドシートの版を確かめ、前回と同じならそのスプレッドシートは読まない。
+    SQLiteへの書き込みはこのスレッドでワークシートごとに順に行う。
+    """
+    gc = get_client(info)
+    db = open_db(db_path)
+    try:
+        groups: dict[str, list] = {}
+        for source, (spreadsheet_id, worksheet) in SOURCES.items():
+            if not sources or source in sources:
+                mark = (0, None) if full else _watermark(db, source)
+                seen = None if full else _drive_version(db, source)
+                groups.setdefault(spreadsheet_id, []).append((source, worksheet, mark, seen))
+
+        def read(spreadsheet_id: str) -> tuple[str, list[tuple]]:
+            version = drive_version(gc, spreadsheet_id)
+            if all(seen == version for *_, seen in groups[spreadsheet_id]):
+                return version, []  # 前回から変わっていない
+            tabs = open_spreadsheet(gc, spreadsheet_id).worksheets()
+            out = []
+            for source, worksheet, mark, _ in groups[spreadsheet_id]:
+                found = [ws for ws in tabs if worksheet is None or ws.title == worksheet]
+                if not found:
+                    raise KeyError(f"worksheet not found: {worksheet}")
+                with span("sync.source", source=source):
+                    out.append((source, worksheet, *read_since(found[0], *mark)))
+            return version, out
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(groups)))) as pool:
+            fetched = dict(zip(groups, pool.map(read, groups)))
+        results = []
+        for spreadsheet_id, (version, items) in fetched.items():
+            if not items:
+                results += [{"source": source, "rows": 0, "last_row": mark[0], "reset": False, "unchanged": True}
+                            for source, _, mark, _ in groups[spreadsheet_id]]
+            for source, worksheet, values, first, reset in items:
+                results.append(_store(db, source, spreadsheet_id, worksheet, values, first, reset or full, version))
+    finally:
+        db.close()
+    return results
+
+
+########################################
+# 読み出し（集計側）
+########################################
+
+def sync_version(db_path: Path | str = SYNC_DB) -> tuple:
+    """控えが変わったかどうかの目印（同期するたびに変わる）"""
+    db = open_db(db_path)
+    try:
+        return tuple(db.execute("SELECT MAX(synced_at), SUM(last_row), COUNT(*) FROM watermarks").fetchone())
+    finally:
+        db.close()
+
+
+FRAME_COLUMNS = ("source", "row_no", "kind", "day", "name", "customer", "genre", "job", "hours", "hours_text",
+                 "note", "submission_id")
+
+
+def load_frame(start: date | str | None = None, end: date | str | None = None,
+               sources: list[str] | None = None, kinds: tuple = ("work",),
+               db_path: Path | str = SYNC_DB, columns: tuple = FRAME_COLUMNS):
+    """取り込んだ行を DataFrame で返す（start 以上 end 未満の日付。シートには触らない）
+
+    columns を絞ると速い（10万行で、全部の列なら0.8秒ほど・集計に要る列だけなら0.5秒ほど）。
+    """
+    import pandas as pd
+
+    where, params = [], []
+    if kinds:
+        where.append(f"kind IN ({','.join('?' * len(kinds))})")
+        params += list(kinds)
+    if sources:
+        where.append(f"source IN ({','.join('?' * len(sources))})")
+        params += list(sources)
+    if start is not None:
+        where.append("day >= ?")
+        params.append(str(start))
+    if end is not None:
+        where.append("day < ?")
+        params.append(str(end))
+    select = ["COALESCE(hours_text, hours) AS hours_text" if c == "hours_text" else c for c in columns]
+    sql = ("SELECT " + ", ".join(select) + " FROM rows"
+           + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY source, row_no")
+    db = open_db(db_path)
+    try:
+        return pd.read_sql_query(sql, db, params=params)
+    finally:
+        db.close()
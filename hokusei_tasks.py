@@ -0,0 +1,266 @@
+# hokusei_tasks.py
+# 日報アプリ共通：作業ブロックを1件ずつ st.fragment で再実行する
+# - どれかの作業を入力しても、その作業ブロックだけが再実行される（他の作業の入力欄は描き直さない）
+# - 合計時間は作業ごとの時間をセッションに覚えておき、変わった分だけ足し引きする
+# - 送信ボタンの表示・非表示が変わるときだけ画面全体を再実行する
+# - 「まとめて入力」モードでは作業ごとの入力欄を st.form に入れ、確定ボタンまでサーバーへ送らない
+# - 作業ごとの入力欄のキーはセッションごとに登録しておき、初期化・掃除は登録済みのキーだけ触る
+
+import logging
+import pickle
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from hokusei_metrics import SESSION_STATE_BYTES, SESSION_STATE_SESSIONS, fragment_timer
+
+TOTAL_LABEL = "合計時間"
+BATCH_KEY = "batch_entry"
+
+STATE_SIZE_KEEP_SEC = 24 * 3600  # セッションの状態サイズの記録を残す時間
+STATE_SIZE_MAX_SESSIONS = 500    # 記録するセッション数の上限（古いものから捨てる）
+
+_log = logging.getLogger(__name__)
+
+
+def batch_entry_toggle() -> bool:
+    """「まとめて入力」モードの切り替え（電波の弱い現場向け）"""
+    return st.toggle(
+        "まとめて入力（作業ごとに「確定」を押すまでサーバーへ送らない・電波が弱い時向け）",
+        key=BATCH_KEY,
+    )
+
+
+def is_batch_entry() -> bool:
+    return bool(st.session_state.get(BATCH_KEY, False))
+
+
+@contextmanager
+def task_form(i: int):
+    """まとめて入力モードなら作業 i の入力欄を1つのフォームにまとめる
+
+    フォームの中の入力はスマホ側にたまり、「確定」で1回だけサーバーへ送られる
+    （選ぶたびの再実行・通信がなくなる）。フォームの中では入力に応じて欄を出し入れできないので、
+    呼び出し側は条件付きの欄も常に表示し、確定後に値で判断する。
+    """
+    if not is_batch_entry():
+        yield
+        return
+    with st.form(f"task_form_{i}", border=False):
+        yield
+        st.form_submit_button(f"作業{i}を確定")
+
+
+def _state():
+    ss = st.session_state
+    if "_task_hours" not in ss:
+        ss._task_inputs = {}       # 作業番号 → 入力値
+        ss._task_hours = {}        # 作業番号 → {合計の見出し: 時間}（送れない入力は入れない）
+        ss._task_totals = {}       # 合計の見出し → 合計時間
+        ss._task_keys = {}         # 作業番号 → このセッションで作ったキーの集合
+        ss._task_stale = set()     # 初期化で使わなくなったキー（次の全体の再実行で消す）
+        ss._task_gen = 0           # 初期化の回数（キーの末尾に付けて入力欄を作り直す）
+        ss._task_any_valid = False
+        ss._task_full_run = False
+    return ss
+
+
+########################################
+# キーの登録・初期化・掃除
+########################################
+
+def task_key(i: int, name: str) -> str:
+    """作業 i の入力欄のキーを登録して返す（f"{name}_{i}"、初期化後は末尾に回数が付く）"""
+    ss = _state()
+    key = f"{name}_{i}" if ss._task_gen == 0 else f"{name}_{i}_{ss._task_gen}"
+    ss._task_keys.setdefault(i, set()).add(key)
+    return key
+
+
+def _drop_keys(keys):
+    ss = st.session_state
+    for key in keys:
+        if key in ss:
+            del ss[key]
+
+
+def forget_task(i: int):
+    """作業 i で作ったキーと入力値をすべて消す（表示していない作業に使う）"""
+    ss = _state()
+    _drop_keys(ss._task_keys.pop(i, ()))
+    if i in ss._task_inputs:
+        _record(i, ss._task_inputs.pop(i), None)
+
+
+def repeat_button(send):
+    """同じ内容の送信を弾いたときに出す「もう一度記録する」ボタン
+
+    同じ作業を本当に2回したときだけ使う。押すと send() を呼ぶ（別の送信IDでためる）。
+    押したあとの再実行の前に呼ばれるので、送信ボタンの分岐の中で出してよい。
+    """
+    def _send():
+        send()
+        st.toast("同じ内容をもう一度記録しました。")
+
+    st.button("同じ内容をもう一度記録する（同じ作業を本当に2回したとき）", on_click=_send)
+
+
+def reset_tasks():
+    """送信後の初期化：このセッションで実際に作った入力欄だけを作り直す
+
+    表示中の入力欄のキーは消しても画面側の値が送り返されてくるので、キーの末尾を変えて
+    新しい入力欄にする。使わなくなったキーは次の全体の再実行で消す。
+    """
+    ss = _state()
+    for keys in ss._task_keys.values():
+        ss._task_stale |= keys
+    ss._task_keys = {}
+    ss._task_inputs = {}
+    ss._task_hours = {}
+    ss._task_totals = {}
+    ss._task_gen += 1
+
+
+_state_sizes: dict = {}   # session_id → (記録時刻, キー数, バイト数)
+_state_sizes_lock = threading.Lock()
+
+
+def _value_size(value) -> int:
+    try:
+        return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    except Exception:
+        return sys.getsizeof(value)  # 画面部品など pickle できないもの
+
+
+def record_state_size() -> tuple[int, int]:
+    """このセッションの状態のキー数・おおよそのバイト数を記録して返す"""
+    ss = st.session_state
+    keys = list(ss.keys())
+    size = sum(_value_size(ss[k]) for k in keys if k in ss)
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        now = time.time()
+        with _state_sizes_lock:
+            _state_sizes[ctx.session_id] = (now, len(keys), size)
+            stale = [sid for sid, (t, _, _) in _state_sizes.items() if now - t > STATE_SIZE_KEEP_SEC]
+            for sid in stale:
+                del _state_sizes[sid]
+            while len(_state_sizes) > STATE_SIZE_MAX_SESSIONS:
+                del _state_sizes[min(_state_sizes, key=lambda sid: _state_sizes[sid][0])]
+    _log.debug("session state: %d keys, %d bytes", len(keys), size)
+    return len(keys), size
+
+
+def state_sizes() -> dict:
+    """最近のセッションごとの {session_id: (記録時刻, キー数, バイト数)}"""
+    with _state_sizes_lock:
+        return dict(_state_sizes)
+
+
+def _state_bytes(stat: str) -> int:
+    sizes = sorted(size for _, _, size in state_sizes().values())
+    if not sizes:
+        return 0
+    return {"max": sizes[-1], "p50": sizes[len(sizes) // 2], "sum": sum(sizes)}[stat]
+
+
+# /_hokusei/metrics に出す（セッションごとではなく、まとめた値だけ）
+for _stat in ("max", "p50", "sum"):
+    SESSION_STATE_BYTES.track(lambda stat=_stat: _state_bytes(stat), stat=_stat)
+SESSION_STATE_SESSIONS.track(lambda: len(state_sizes()))
+
+
+def _record(i: int, inp: dict, hours: dict | None):
+    """作業 i の入力値を覚え、合計時間を差分で更新する"""
+    ss = _state()
+    ss._task_inputs[i] = inp
+    totals = ss._task_totals
+    for label, h in ss._task_hours.pop(i, {}).items():
+        totals[label] = round(totals.get(label, 0.0) - h, 6)
+    if hours is not None:
+        ss._task_hours[i] = hours
+        for label, h in hours.items():
+            totals[label] = round(totals.get(label, 0.0) + h, 6)
+
+
+def _draw_totals():
+    ss = _state()
+    box = ss.get("_task_total_box")
+    if box is None:
+        return
+    lines = [
+        f"### ✅ {label}: {ss._task_totals.get(label, 0.0):.2f} 時間"
+        for label in ss.get("_task_total_labels", (TOTAL_LABEL,))
+        if ss._task_totals.get(label, 0.0) > 0
+    ]
+    if lines:
+        box.markdown("\n".join(lines))
+    else:
+        box.empty()
+
+
+@st.fragment
+def _task_block(i: int, render, evaluate):
+    if _state()._task_full_run:
+        _run_task_block(i, render, evaluate)
+        return
+    with fragment_timer():  # 作業ブロックだけの再実行の時間（hokusei_metrics）
+        _run_task_block(i, render, evaluate)
+
+
+def _run_task_block(i: int, render, evaluate):
+    inp = render(i)
+    _record(i, inp, evaluate(inp))
+
+    ss = _state()
+    if ss._task_full_run:
+        return  # 全体の再実行中：合計と送信ボタンは呼び出し側で描く
+    _draw_totals()
+    # 送信ボタンは作業ブロックの外にあるので、出し入れが必要なときだけ全体を再実行
+    if bool(ss._task_hours) != ss._task_any_valid:
+        st.rerun()
+
+
+def rerun_task():
+    """作業ブロックを描き直す（そのブロックだけの再実行中ならそのブロックだけ、全体の再実行中なら全体）"""
+    if _state()._task_full_run:
+        st.rerun()
+    st.rerun(scope="fragment")
+
+
+def task_blocks(count: int, render, evaluate) -> tuple[list[dict], dict]:
+    """作業 1〜count の入力欄を表示する
+
+    render(i) は作業 i の入力欄を描いて入力値の dict を返す。
+    evaluate(inp) は送れる入力なら {合計の見出し: 時間}、まだ送れない入力なら None を返す。
+    戻り値は (送れる入力のリスト, {合計の見出し: 合計時間})。
+    """
+    ss = _state()
+    _drop_keys(ss._task_stale)
+    ss._task_stale = set()
+    ss._task_full_run = True
+    try:
+        for i in range(1, count + 1):
+            _task_block(i, render, evaluate)
+        # 減った作業（送信後に1件に戻した等）のキーと入力値は消す（古いキーをためない）
+        for i in [i for i in set(ss._task_inputs) | set(ss._task_keys) if i > count]:
+            forget_task(i)
+    finally:
+        ss._task_full_run = False
+
+    valid = [ss._task_inputs[i] for i in sorted(ss._task_hours)]
+    ss._task_any_valid = bool(valid)
+    record_state_size()
+    return valid, dict(ss._task_totals)
+
+
+def show_totals(labels: tuple[str, ...] = (TOTAL_LABEL,)):
+    """合計時間の表示欄（作業ブロックだけが再実行されたときもここが書き換わる）"""
+    ss = _state()
+    ss._task_total_box = st.empty()
+    ss._task_total_labels = labels
+    _draw_totals()
@@ -0,0 +1,243 @@
+# hokusei_trace.py
+# 日報アプリ共通：1回の送信の時間の内訳（トレース）
+# - span("名前") で囲んだ区間の時間を JSON Lines で書く（1行＝1区間）
+# - 送信IDをトレースIDにする。画面側（行の組み立て・アウトボックス・後片付け）と
+#   裏のスレッド（認証・open_by_key・append_rows）の区間が同じIDでつながる
+# - 最近の区間はメモリにも持ち、管理者だけに見える「処理時間の内訳」に出す
+# - ファイルへは裏のスレッドがまとめて書く（送信ボタンの処理はキューに入れるだけで、ファイルを待たない）
+#
+# 書き出し先は .outbox/trace.jsonl（環境変数 HOKUSEI_TRACE_FILE で変更、空にするとファイルには書かない）。
+# 計測で送信を止めないよう、ここでの失敗はすべて握りつぶす。
+
+import atexit
+import contextvars
+import hmac
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get(
+    "HOKUSEI_TRACE_FILE", str(Path(__file__).resolve().parent / ".outbox" / "trace.jsonl")
+)
+TRACE_MAX_BYTES = 20 * 1024 * 1024  # これを超えたら trace.jsonl.1 に回して書き直す
+RECENT_SPANS = 5000                 # 画面に出すためメモリに残す区間の数
+WRITE_QUEUE_MAX = 10000             # 書き出し待ちの区間の上限（ファイルが詰まったら、超えた分は書かずに捨てる）
+
+_trace_ids: contextvars.ContextVar[tuple] = contextvars.ContextVar("hokusei_trace_ids", default=())
+_parent: contextvars.ContextVar[str | None] = contextvars.ContextVar("hokusei_trace_parent", default=None)
+
+_recent: deque = deque(maxlen=RECENT_SPANS)
+_queue: queue.Queue = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+_write_lock = threading.Lock()
+_file = None
+dropped = 0  # 書き出し待ちがあふれて捨てた区間の数
+
+
+########################################
+# 区間を測る
+########################################
+
+def new_trace_id() -> str:
+    return secrets.token_hex(8)
+
+
+@contextmanager
+def trace(*ids: str):
+    """この中の区間にトレースIDを付ける（裏のスレッドでは、まとめて書く送信IDを全部渡す）"""
+    token = _trace_ids.set(tuple(i for i in ids if i))
+    try:
+        yield
+    finally:
+        _trace_ids.reset(token)
+
+
+def add_trace_id(trace_id: str):
+    """途中で分かったID（送信ID）を、このあとの区間にも付ける"""
+    if trace_id and trace_id not in _trace_ids.get():
+        _trace_ids.set(_trace_ids.get() + (trace_id,))
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """区間の時間を測って記録する。yield した dict に書くと属性として残る"""
+    span_id = secrets.token_hex(4)
+    parent = _parent.get()
+    token = _parent.set(span_id)
+    started = time.time()
+    t0 = time.perf_counter()
+    error = None
+    try:
+        yield attrs
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _parent.reset(token)
+        try:
+            _record({
+                "ts": round(started, 3),
+                "trace": list(_trace_ids.get()),
+                "span": name,
+                "id": span_id,
+                "parent": parent,
+                "ms": round((time.perf_counter() - t0) * 1000, 2),
+                "thread": threading.current_thread().name,
+                "error": error,
+                **attrs,
+            })
+        except Exception:
+            _log.debug("trace: record failed", exc_info=True)
+
+
+def _record(rec: dict):
+    """メモリに残し、ファイルへは書き出し待ちのキューに入れるだけ（呼んだスレッドはファイルを待たない）"""
+    global dropped
+    _recent.append(rec)
+    if not TRACE_FILE:
+        return
+    _start_writer()
+    try:
+        _queue.put_nowait(rec)
+    except queue.Full:
+        dropped += 1
+
+
+########################################
+# ファイルへの書き出し（裏のスレッド）
+########################################
+
+def _start_writer():
+    """書き出しのスレッドを起動（1本だけ）"""
+    global _writer
+    if _writer is not None and _writer.is_alive():
+        return
+    with _writer_lock:
+        if _writer is None or not _writer.is_alive():
+            _writer = threading.Thread(target=_write_loop, name="hokusei-trace", daemon=True)
+            _writer.start()
+
+
+def _write_loop():
+    while True:
+        batch = [_queue.get()]
+        batch += _drain()
+        try:
+            _write(batch)
+        except Exception:
+            # スレッドを止めない（その分の区間はメモリにだけ残る）
+            _log.debug("trace: write failed", exc_info=True)
+
+
+def _drain() -> list[dict]:
+    out = []
+    while True:
+        try:
+            out.append(_queue.get_nowait())
+        except queue.Empty:
+            return out
+
+
+def _write(batch: list[dict]):
+    """区間をまとめて1回で書く（大きくなったら trace.jsonl.1 に回す）"""
+    global _file
+    text = "".join(json.dumps(rec, ensure_ascii=False, default=str) + "\n" for rec in batch)
+    with _write_lock:
+        if _file is None:
+            path = Path(TRACE_FILE)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _file = open(path, "a", encoding="utf-8")
+        if _file.tell() > TRACE_MAX_BYTES:
+            _file.close()
+            os.replace(TRACE_FILE, TRACE_FILE + ".1")
+            _file = open(TRACE_FILE, "a", encoding="utf-8")
+        _file.write(text)
+        _file.flush()
+
+
+def flush():
+    """書き出し待ちの区間を今すぐ書く（終了時に呼ばれる）"""
+    batch = _drain()
+    if batch and TRACE_FILE:
+        try:
+            _write(batch)
+        except Exception:
+            _log.debug("trace: write failed", exc_info=True)
+
+
+atexit.register(flush)
+
+
+def spans_for(ids) -> list[dict]:
+    """指定したトレースIDの区間（メモリに残っている分だけ・終わった順）"""
+    ids = set(ids)
+    return [r for r in list(_recent) if ids.intersection(r["trace"])]
+
+
+########################################
+# 画面（管理者だけ）
+########################################
+
+_LAST_KEY = "_trace_last"
+
+
+def remember_trace(*ids: str):
+    """このセッションの直前の送信のトレースIDを覚える（内訳の表示用）"""
+    import streamlit as st
+
+    st.session_state[_LAST_KEY] = [i for i in ids if i]
+
+
+def is_admin() -> bool:
+    """URL に ?admin=<secrets の admin_token> が付いていれば管理者（admin_token がなければ誰も管理者でない）"""
+    import streamlit as st
+
+    try:
+        expected = st.secrets.get("admin_token")
+    except Exception:
+        return False
+    given = st.query_params.get("admin")
+    return bool(expected and given) and hmac.compare_digest(str(given), str(expected))
+
+
+def trace_panel():
+    """直前の送信の処理時間の内訳（管理者だけに出す）"""
+    import streamlit as st
+
+    if not is_admin():
+        return
+    with st.expander("処理時間の内訳（管理者用）", expanded=False):
+        ids = st.session_state.get(_LAST_KEY)
+        if not ids:
+            st.caption("このセッションではまだ送信していません。")
+            return
+        rows = sorted(spans_for(ids), key=lambda r: r["ts"])
+        if not rows:
+            st.caption("記録が見つかりません（再起動で消えた場合は trace.jsonl を見てください）。")
+            return
+        t0 = rows[0]["ts"]
+        st.dataframe(
+            [{
+                "開始(ms)": round((r["ts"] - t0) * 1000),
+                "区間": r["span"],
+                "時間(ms)": r["ms"],
+                "スレッド": r["thread"],
+                "エラー": r["error"] or "",
+                "詳細": ", ".join(f"{k}={v}" for k, v in r.items() if k not in _BASE_KEYS),
+            } for r in rows],
+            hide_index=True, use_container_width=True,
+        )
+        st.caption("トレースID: " + ", ".join(ids) + "（trace.jsonl をこのIDで検索すると全部見られます）")
+
+
+_BASE_KEYS = {"ts", "trace", "span", "id", "parent", "ms", "thread", "error"}
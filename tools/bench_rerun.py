@@ -0,0 +1,295 @@
+# tools/bench_rerun.py
+# 日報アプリの再実行コストを測るベンチマーク（Streamlit の AppTest で画面なしに動かす）
+#
+# 使い方（リポジトリ直下で）:
+#   python tools/bench_rerun.py                              # 全ケースを測って表を出す
+#   python tools/bench_rerun.py -k siage                      # 名前に siage を含むケースだけ
+#   python tools/bench_rerun.py --save-baseline bench.json    # 今の結果を基準として保存
+#   python tools/bench_rerun.py --baseline bench.json         # 基準より悪くなったら終了コード1
+#
+# ケースごとに測るもの:
+#   first_sec    … 入力済みの状態での最初の表示
+#   rerun_sec    … 何も変えずに再実行したときの時間（中央値）
+#   widgets      … 入力欄の数
+#   payload_kb   … 画面に送る要素の大きさ（websocket で送る量の目安）
+#   state_kb     … セッションの状態の大きさ（pickle した大きさ）
+#   submit_sec   … 送信ボタンを押してから画面が返るまで
+#   sheet_sec    … 送信ボタンを押してから偽のシートに書かれるまで（アウトボックス経由）
+#
+# Googleには接続しない：hokusei_fake の偽のシートを get_client の代わりに使う。
+
+import argparse
+import json
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+os.environ.setdefault("HOKUSEI_OUTBOX_DIR", tempfile.mkdtemp(prefix="hokusei-bench-"))
+
+from streamlit.testing.v1 import AppTest  # noqa: E402
+from streamlit.testing.v1.element_tree import ElementTree, Widget  # noqa: E402
+
+from hokusei_fake import FakeClient  # noqa: E402
+from hokusei_sheets import set_client  # noqa: E402
+from hokusei_summary import SUMMARY_TAB  # noqa: E402
+from hokusei_tasks import _value_size  # noqa: E402
+
+CLIENT_EMAIL = "bench@example.invalid"
+MEMO_SCOPES = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive.file",
+    "https://www.googleapis.com/auth/drive",
+]
+SECRET_KEYS = [
+    "type", "project_id", "private_key_id", "private_key", "client_email", "client_id",
+    "auth_uri", "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url", "universe_domain",
+]
+
+# 基準からどれだけ悪くなったら失敗にするか
+TIME_TOLERANCE = 0.30     # 時間は30%（かつ下の秒数以上）
+TIME_MIN_DELTA = 0.02
+SIZE_TOLERANCE = 0.10     # 入力欄の数・大きさは10%
+TIME_METRICS = ("first_sec", "rerun_sec", "submit_sec")
+SIZE_METRICS = ("widgets", "payload_kb", "state_kb")
+
+
+########################################
+# AppTest で data_editor を操作する
+########################################
+
+# AppTest は data_editor の値を送らないので、ケースで決めた編集内容を足して送る
+_get_widget_states = ElementTree.get_widget_states
+
+def _get_widget_states_with_editors(self):
+    states = _get_widget_states(self)
+    editors = getattr(self._runner, "bench_editors", None) or {}
+    for node in self:
+        if getattr(node, "type", None) == "arrow_data_frame" and node.proto.id:
+            for key, editing_state in editors.items():
+                if node.proto.id.endswith("-" + key):
+                    w = states.widgets.add()
+                    w.id = node.proto.id
+                    w.string_value = json.dumps(editing_state, ensure_ascii=False)
+    return states
+
+ElementTree.get_widget_states = _get_widget_states_with_editors
+
+
+########################################
+# ケース
+########################################
+
+def _trial_task(i: int, steps: int, companions: int) -> tuple[dict, dict]:
+    """仕上げの客先トライ1件（工程数 steps・同行者 companions 人）"""
+    names = ["吉田", "中村", "渡辺", "福田", "苫米地", "矢部", "小野", "塩入", "トム", "ユン"]
+    state = {
+        f"customer_{i}": "ジーテクト",
+        f"genre_{i}": "客先トライ",
+        f"move_time_{i}": "1",
+        f"steps_{i}": steps,
+        f"work_time_{i}": str(steps),
+        f"trial_jobs_{i}": {"jobs": [f"{i:02d}A001"], "auto": None},  # 2行目以降は連番で入る
+    }
+    editors = {
+        f"companions_grid_{i}": {
+            "edited_rows": {}, "deleted_rows": [],
+            "added_rows": [{"同行者": names[j % len(names)]} for j in range(companions)],
+        },
+    }
+    return state, editors
+
+
+def _normal_tasks(n: int, genre: str, number: str = "51A{i:03d}") -> dict:
+    state = {}
+    for i in range(1, n + 1):
+        state.update({
+            f"customer_{i}": "ジーテクト",
+            f"genre_{i}": genre,
+            f"number_{i}": number.format(i=i),
+            f"time_{i}": "1.5",
+        })
+    return state
+
+
+def _siage_trials(n: int, steps: int, companions: int) -> tuple[dict, dict]:
+    state, editors = {}, {}
+    for i in range(1, n + 1):
+        s, e = _trial_task(i, steps, companions)
+        state.update(s)
+        editors.update(e)
+    return state, editors
+
+
+CASES = {
+    # 名前: (スクリプト, 名前の選択, セッションの初期値, data_editor の編集, 送信後に増える行数)
+    "cad_form10": ("hokusei-cad-nippo.py", "富寛", {"form_count": 10, **_normal_tasks(10, "新規")}, {}, 10),
+    "cad_mitsumori": ("hokusei-cad-nippo.py", "富寛",
+                      {"form_count": 1, "customer_1": "ジーテクト", "genre_1": "見積", "time_1": "2"}, {}, 1),
+    "sekkei_form10": ("hokusei-sekkei-nippo.py", "白熊", {"form_count": 10, **_normal_tasks(10, "新規")}, {}, 10),
+    "kikai_form10": ("hokusei-kikai-nippo.py", "大地", {"form_count": 10, **_normal_tasks(10, "新規")}, {}, 10),
+    "siage_form10": ("hokusei-siage-nippo.py", "吉田", {"form_count": 10, **_normal_tasks(10, "新規")}, {}, 11),
+    "siage_trial10x10": ("hokusei-siage-nippo.py", "吉田",
+                         {"form_count": 10, **_siage_trials(10, 10, 10)[0]}, _siage_trials(10, 10, 10)[1],
+                         # 本人: 送信日時 + (移動 + 工番10) × 10 / 同行者: (送信日時 + 移動 + 工番10) × 10人 × 10件
+                         1 + 11 * 10 + 12 * 10 * 10),
+    "memo": ("hokusei-memo-kyouyuu.py", None, {}, {}, 1),
+}
+
+
+########################################
+# 計測
+########################################
+
+def _spreadsheet_id(script: str) -> str:
+    text = (ROOT / script).read_text(encoding="utf-8")
+    return re.search(r'(?:SPREADSHEET_ID|GOOGLE_SHEET_ID)\s*=\s*"([^"]+)"', text).group(1)
+
+
+def _rows_written(fake: FakeClient, spreadsheet_id: str) -> int:
+    sh = fake.open_by_key(spreadsheet_id)
+    # 日別集計タブは日報の行ではない（同じ日・同じ名前なら行は増えない）
+    return sum(1 for ws in sh.worksheets() if ws.title != SUMMARY_TAB
+               for row in ws.get_all_values() if any(row))
+
+
+def _widgets_and_payload(at: AppTest) -> tuple[int, int]:
+    widgets = 0
+    payload = 0
+    for node in at._tree:
+        if isinstance(node, Widget) or (getattr(node, "type", None) == "arrow_data_frame" and node.proto.id):
+            widgets += 1
+        proto = getattr(node, "proto", None)
+        if proto is not None and hasattr(proto, "ByteSize") and not hasattr(node, "children"):
+            payload += proto.ByteSize()
+    return widgets, payload
+
+
+def _state_size(at: AppTest) -> int:
+    state = at.session_state._state.filtered_state
+    return sum(_value_size(v) for v in state.values())
+
+
+def _timed_run(at: AppTest) -> float:
+    t0 = time.perf_counter()
+    at.run()
+    return time.perf_counter() - t0
+
+
+def run_case(name: str, fake: FakeClient, reruns: int) -> dict:
+    script, person, state, editors, expect_rows = CASES[name]
+    at = AppTest.from_file(str(ROOT / script), default_timeout=120)
+    at.secrets["google_cloud"] = {k: (CLIENT_EMAIL if k == "client_email" else "bench") for k in SECRET_KEYS}
+    at.bench_editors = editors
+    at.run()  # 最初の表示（名前未選択）
+    if person is not None:
+        at.selectbox[0].select(person)
+    for key, value in state.items():
+        at.session_state[key] = value
+    first = _timed_run(at)
+
+    times = [_timed_run(at) for _ in range(reruns)]
+    widgets, payload = _widgets_and_payload(at)
+    result = {
+        "first_sec": first,
+        "rerun_sec": statistics.median(times),
+        "widgets": widgets,
+        "payload_kb": payload / 1024,
+        "state_kb": _state_size(at) / 1024,
+        "errors": [str(e.value)[:200] for e in at.exception],
+    }
+    if name == "cad_mitsumori":
+        result["prefill_ok"] = at.text_input(key="number_1").value == "見積用造形、解析"
+    if name == "memo":
+        for box, value in zip(at.text_input, ["記入者", "メーカー", "51A001", "内容"]):
+            box.input(value)
+        at.run()
+
+    spreadsheet_id = _spreadsheet_id(script)
+    before = _rows_written(fake, spreadsheet_id)
+    buttons = [b for b in at.button if b.label == "送信"]
+    if not buttons:
+        result.update(submit_sec=None, sheet_sec=None)
+        result["errors"].append("送信ボタンが出ていない")
+        return result
+    t0 = time.perf_counter()
+    buttons[0].click().run()
+    result["submit_sec"] = time.perf_counter() - t0
+    deadline = t0 + 60
+    while _rows_written(fake, spreadsheet_id) < before + expect_rows and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    written = _rows_written(fake, spreadsheet_id) - before
+    result["sheet_sec"] = time.perf_counter() - t0 if written >= expect_rows else None
+    if written != expect_rows:
+        result["errors"].append(f"シートに書かれた行数 {written}（期待 {expect_rows}）")
+    return result
+
+
+def regressions(results: dict, baseline: dict) -> list[str]:
+    out = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for m in TIME_METRICS:
+            if res.get(m) is None or base.get(m) is None:
+                continue
+            if res[m] > base[m] * (1 + TIME_TOLERANCE) and res[m] - base[m] > TIME_MIN_DELTA:
+                out.append(f"{name}.{m}: {base[m]:.3f} → {res[m]:.3f} 秒")
+        for m in SIZE_METRICS:
+            if res[m] > base[m] * (1 + SIZE_TOLERANCE):
+                out.append(f"{name}.{m}: {base[m]:.1f} → {res[m]:.1f}")
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日報アプリの再実行ベンチマーク")
+    parser.add_argument("-k", dest="pattern", default="", help="名前にこの文字を含むケースだけ")
+    parser.add_argument("-n", "--reruns", type=int, default=5, help="再実行の回数（中央値を出す）")
+    parser.add_argument("--baseline", help="基準の結果（JSON）。悪くなっていたら終了コード1")
+    parser.add_argument("--save-baseline", help="今回の結果を基準として保存するファイル")
+    args = parser.parse_args()
+
+    fake = FakeClient(tabs={_spreadsheet_id("hokusei-kikai-nippo.py"): ["シート1", "自動運転"]})
+    set_client(CLIENT_EMAIL, fake)
+    set_client(CLIENT_EMAIL, fake, MEMO_SCOPES)
+
+    results = {}
+    print(f"{'case':18} {'first':>8} {'rerun':>8} {'widgets':>8} {'payload':>9} {'state':>8} {'submit':>8} {'sheet':>7}")
+    for name in CASES:
+        if args.pattern not in name:
+            continue
+        r = results[name] = run_case(name, fake, args.reruns)
+
+        def sec(v):
+            return f"{v * 1000:6.0f}ms" if v is not None else "      -"
+        print(
+            f"{name:18} {sec(r['first_sec'])} {sec(r['rerun_sec'])} {r['widgets']:8d} "
+            f"{r['payload_kb']:7.1f}KB {r['state_kb']:6.1f}KB {sec(r['submit_sec'])} "
+            + (f"{r['sheet_sec']:6.2f}s" if r["sheet_sec"] is not None else "     -")
+        )
+        for err in r["errors"]:
+            print(f"    ! {err}")
+        if r.get("prefill_ok") is False:
+            print("    ! 見積の工番が自動入力されていない")
+
+    if args.save_baseline:
+        Path(args.save_baseline).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+    failed = any(r["errors"] or r.get("prefill_ok") is False for r in results.values())
+    if args.baseline:
+        worse = regressions(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")))
+        for line in worse:
+            print(f"悪化: {line}")
+        failed = failed or bool(worse)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
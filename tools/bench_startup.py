@@ -0,0 +1,108 @@
+# tools/bench_startup.py
+# 日報アプリの起動時間を測る（初回表示までの時間・再実行の時間・共通ヘルパの読み込み時間）
+#
+# 使い方（リポジトリ直下で）:
+#   python tools/bench_startup.py                 # 4つの日報アプリ、各5回
+#   python tools/bench_startup.py -n 10 hokusei-siage-nippo.py
+#   python tools/bench_startup.py --json out.json
+#
+# 1回ごとに新しいプロセスで測る（import のキャッシュが効かない「コールドスタート」）。
+# Googleには接続しない：secrets はダミー、アウトボックスは一時ディレクトリ。
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APPS = [
+    "hokusei-cad-nippo.py",
+    "hokusei-sekkei-nippo.py",
+    "hokusei-kikai-nippo.py",
+    "hokusei-siage-nippo.py",
+]
+HEAVY_MODULES = ["gspread", "google.auth", "requests", "pandas"]
+
+# 子プロセスで実行するスクリプト（結果をJSONで1行出す）
+_CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import streamlit
+t_streamlit = time.perf_counter() - t0
+
+t0 = time.perf_counter()
+import hokusei_sheets, hokusei_outbox
+t_helpers = time.perf_counter() - t0
+heavy_after_helpers = [m for m in HEAVY if m in sys.modules]
+
+from streamlit.testing.v1 import AppTest
+keys = ["type", "project_id", "private_key_id", "private_key", "client_email", "client_id",
+        "auth_uri", "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url", "universe_domain"]
+at = AppTest.from_file(APP, default_timeout=60)
+at.secrets.update({"google_cloud": {k: "dummy" for k in keys}})
+
+t0 = time.perf_counter()
+at.run()
+t_first = time.perf_counter() - t0
+t0 = time.perf_counter()
+at.run()
+t_rerun = time.perf_counter() - t0
+
+print(json.dumps({
+    "streamlit_import": t_streamlit,
+    "helpers_import": t_helpers,
+    "first_render": t_first,
+    "rerun": t_rerun,
+    "exceptions": len(at.exception),
+    "heavy_after_helpers": heavy_after_helpers,
+}))
+"""
+
+
+def run_once(app: str) -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as tmp:
+        env["HOKUSEI_OUTBOX_DIR"] = tmp
+        code = f"HEAVY = {HEAVY_MODULES!r}\nAPP = {str(ROOT / app)!r}\n" + _CHILD
+        out = subprocess.run(
+            [sys.executable, "-c", code], cwd=ROOT, env=env,
+            capture_output=True, text=True, check=True,
+        )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日報アプリの起動時間ベンチマーク")
+    parser.add_argument("apps", nargs="*", default=APPS)
+    parser.add_argument("-n", "--repeat", type=int, default=5, help="アプリごとの計測回数（中央値を出す）")
+    parser.add_argument("--json", help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'app':28} {'helpers':>9} {'first':>9} {'rerun':>9}  heavy modules after helper import")
+    for app in args.apps:
+        runs = [run_once(app) for _ in range(args.repeat)]
+        summary = {
+            key: statistics.median(r[key] for r in runs)
+            for key in ("streamlit_import", "helpers_import", "first_render", "rerun")
+        }
+        summary["exceptions"] = max(r["exceptions"] for r in runs)
+        summary["heavy_after_helpers"] = sorted({m for r in runs for m in r["heavy_after_helpers"]})
+        results[app] = summary
+        print(
+            f"{app:28} {summary['helpers_import'] * 1000:7.1f}ms {summary['first_render'] * 1000:7.1f}ms "
+            f"{summary['rerun'] * 1000:7.1f}ms  {', '.join(summary['heavy_after_helpers']) or '-'}"
+            + (f"  (例外 {summary['exceptions']})" if summary["exceptions"] else "")
+        )
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,460 @@
+# tools/load_sessions.py
+# 終業時の「みんな一斉に送信」を再現する負荷試験
+#
+# 使い方（リポジトリ直下で）:
+#   python tools/load_sessions.py -w 40                        # 40人が4つの日報アプリで同時に送信
+#   python tools/load_sessions.py -w 80 --latency-ms 300 --429-rate 0.05 --timeout-rate 0.02
+#   python tools/load_sessions.py -w 20 --apps siage --json out.json
+#
+# アプリごとに本物の Streamlit サーバー（hokusei_server.py）を1つずつ起動し、作業者の数だけ
+# ブラウザの代わりの websocket クライアントをつなぐ。各作業者は名前・作業（仕上げのパネル・
+# トライの工程・同行者を含む）をランダムに入力し、全員そろったところで同時に「送信」を押す。
+# シートは hokusei_fake のローカルのシート（SQLite。全サーバーで共有）で、遅延・429・
+# タイムアウトを起こせる。Googleには接続しない。
+#
+# 出すもの:
+#   送信の処理量（件/秒）、送信ボタンの応答時間 p50/p95/p99、
+#   シートに全部書かれるまでの時間、書かれた行数、二重に書かれた行、書かれなかった行
+# 「書かれるはずの行」はアウトボックスに入った内容（送信ID付き）で、シートの行と突き合わせる。
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import Counter
+from pathlib import Path
+
+import toml
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.websocket import websocket_connect
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from hokusei_fake import FakeClient, _display, _from_cell_data, open_store  # noqa: E402
+from hokusei_outbox import ID_COLUMN, _tag_rows  # noqa: E402
+from hokusei_sheets import to_cell  # noqa: E402
+
+APPS = {
+    # 名前: (スクリプト, アウトボックス名, タブ, 作業を増やすボタン)
+    "siage": ("hokusei-siage-nippo.py", "siage", ["シート1"], "＋作業を追加"),
+    "kikai": ("hokusei-kikai-nippo.py", "kikai", ["シート1", "自動運転"], "次へ"),
+    "cad": ("hokusei-cad-nippo.py", "cad", ["シート1"], "次へ"),
+    "sekkei": ("hokusei-sekkei-nippo.py", "sekkei", ["シート1"], "次へ"),
+}
+SECRET_KEYS = [
+    "type", "project_id", "private_key_id", "private_key", "client_email", "client_id",
+    "auth_uri", "token_uri", "auth_provider_x509_cert_url", "client_x509_cert_url", "universe_domain",
+]
+CLIENT_EMAIL = "load@example.invalid"
+UNSET = "選択してください"
+SPECIAL_GENRES = ("社内トライ", "パネル", "客先トライ")
+COMPANIONS = ["吉田", "中村", "渡辺", "福田", "苫米地", "矢部", "小野", "塩入", "トム", "ユン"]
+DONE = (
+    ForwardMsg.FINISHED_SUCCESSFULLY,
+    ForwardMsg.FINISHED_FRAGMENT_RUN_SUCCESSFULLY,
+    ForwardMsg.FINISHED_WITH_COMPILE_ERROR,
+)
+
+
+def _spreadsheet_id(script: str) -> str:
+    text = (ROOT / script).read_text(encoding="utf-8")
+    return re.search(r'(?:SPREADSHEET_ID|GOOGLE_SHEET_ID)\s*=\s*"([^"]+)"', text).group(1)
+
+
+########################################
+# サーバー
+########################################
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(app: str, workdir: Path, env: dict) -> tuple[subprocess.Popen, int]:
+    """本番と同じく hokusei_server.py でアプリを起動し、応答するまで待つ（secrets は workdir/.streamlit から読まれる）"""
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "hokusei_server.py"), str(ROOT / APPS[app][0]),
+         "--server.port", str(port), "--server.address", "127.0.0.1", "--server.headless", "true",
+         "--server.fileWatcherType", "none", "--browser.gatherUsageStats", "false"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=open(workdir / f"{app}.log", "w"),
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1)
+            return proc, port
+        except OSError:
+            if proc.poll() is not None:
+                break
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{app} のサーバーが起動しない（{workdir / f'{app}.log'} を参照）")
+
+
+########################################
+# 作業者（1人 = ブラウザ1つ）
+########################################
+
+class Session:
+    """ブラウザの代わり：入力欄の値を覚えておき、再実行のたびに全部送る"""
+
+    def __init__(self, n: int, app: str, port: int, rng: random.Random, max_tasks: int):
+        self.n = n
+        self.app = app
+        self.port = port
+        self.rng = rng
+        self.tasks = rng.randint(1, max_tasks)
+        self.widgets: dict[str, tuple] = {}   # キー（なければラベル）→ (id, 要素の種類, proto, fragment_id)
+        self.values: dict[str, tuple] = {}    # キー → (WidgetState の欄, 値)
+        self.alerts: list[str] = []
+        self.submit_sec: float | None = None
+        self.error: str | None = None
+        self.ws = None
+
+    async def connect(self):
+        self.ws = await websocket_connect(
+            f"ws://127.0.0.1:{self.port}/_stcore/stream", max_message_size=64 * 1024 * 1024)
+
+    async def rerun(self, changed: str | None = None, trigger: str | None = None):
+        """値を送って再実行し、終わるまで受け取る（変えた入力欄が作業ブロックの中ならそのブロックだけ）"""
+        back = BackMsg()
+        back.rerun_script.query_string = ""
+        name = trigger or changed
+        if name and name in self.widgets:
+            back.rerun_script.fragment_id = self.widgets[name][3]
+        states = back.rerun_script.widget_states
+        for key, (field, value) in self.values.items():
+            if key in self.widgets:
+                w = states.widgets.add()
+                w.id = self.widgets[key][0]
+                setattr(w, field, value)
+        if trigger:
+            w = states.widgets.add()
+            w.id = self.widgets[trigger][0]
+            w.trigger_value = True
+        await self.ws.write_message(back.SerializeToString(), binary=True)
+
+        self.alerts = []
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), 300)
+            if raw is None:
+                raise ConnectionError("websocket closed")
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self._element(msg.delta.new_element, msg.delta.fragment_id)
+            elif kind == "script_finished" and msg.script_finished in DONE:
+                return
+
+    def _element(self, el, fragment_id: str):
+        kind = el.WhichOneof("type")
+        if kind in ("selectbox", "text_input", "button", "checkbox", "arrow_data_frame"):
+            proto = getattr(el, kind)
+            if not proto.id:
+                return  # 表示だけの表
+            user_key = proto.id.rsplit("-", 1)[-1]
+            name = user_key if user_key != "None" else proto.label
+            self.widgets[name] = (proto.id, kind, proto, fragment_id)
+        elif kind == "alert":
+            self.alerts.append(el.alert.body)
+        elif kind == "exception":
+            self.alerts.append("例外: " + el.exception.message)
+
+    # --- 入力 ---
+
+    async def select(self, key: str, choice=None):
+        options = list(self.widgets[key][2].options)
+        if choice is None:
+            choice = self.rng.choice([o for o in options if o != UNSET])
+        self.values[key] = ("int_value", options.index(str(choice)))
+        await self.rerun(changed=key)
+        return choice
+
+    async def type(self, key: str, text: str):
+        self.values[key] = ("string_value", text)
+        await self.rerun(changed=key)
+
+    async def edit(self, key: str, state: dict):
+        self.values[key] = ("string_value", json.dumps(state, ensure_ascii=False))
+        await self.rerun(changed=key)
+
+    async def click(self, label: str):
+        await self.rerun(trigger=label)
+
+    def _number(self, i: int) -> str:
+        # 作業者・作業ごとに違う工番（末尾3桁は仕上げの連番入力で増える）
+        return f"L{self.n:04d}T{i:02d}001"
+
+    async def prepare(self):
+        """名前・作業をランダムに入力して、送信ボタンが出た状態にする"""
+        try:
+            await self.connect()
+            await self.rerun()
+            await self.select("名前")
+            for i in range(1, self.tasks + 1):
+                if i > 1:
+                    await self.click(APPS[self.app][3])
+                    if f"customer_{i}" not in self.widgets:
+                        await self.rerun()  # 仕上げは追加ボタンで再実行しない（次の操作で欄が出る）
+                await self._task(i)
+            if "送信" not in self.widgets:
+                self.error = "送信ボタンが出ていない " + " / ".join(self.alerts)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"[:200]
+
+    async def _task(self, i: int):
+        customer = await self.select(f"customer_{i}")
+        if customer == "その他メーカー":
+            await self.type(f"new_customer_{i}", f"負荷試験{self.n}")
+        genre = await self.select(f"genre_{i}") if f"genre_{i}" in self.widgets else ""
+        hours = self.rng.choice([0.5, 1, 1.5, 2, 2.5, 3, 4])
+        if self.app == "siage" and genre in SPECIAL_GENRES:
+            await self._special(i, genre, hours)
+            return
+        number = self.widgets.get(f"number_{i}")
+        if number is not None and not number[2].default:  # 見積は工番が入っている
+            await self.type(f"number_{i}", self._number(i))
+        await self.type(f"time_{i}", str(hours))
+
+    async def _special(self, i: int, genre: str, hours: float):
+        """仕上げのパネル・トライ（工程数ぶんの工番、客先トライなら移動時間と同行者）"""
+        if genre == "客先トライ":
+            await self.type(f"move_time_{i}", "1")
+        steps = await self.select(f"steps_{i}", self.rng.randint(1, 3))
+        await self.type(f"work_time_{i}", str(max(hours, int(steps) * 0.5)))
+        await self.edit(f"trial_grid_{i}", {
+            "edited_rows": {"0": {"工番": self._number(i)}}, "added_rows": [], "deleted_rows": []})
+        if genre == "客先トライ":
+            names = self.rng.sample(COMPANIONS, self.rng.randint(0, 2))
+            await self.edit(f"companions_grid_{i}", {
+                "edited_rows": {}, "deleted_rows": [], "added_rows": [{"同行者": nm} for nm in names]})
+
+    async def submit(self):
+        t0 = time.perf_counter()
+        await self.click("送信")
+        self.submit_sec = time.perf_counter() - t0
+        if not any("送信しました" in a for a in self.alerts):
+            self.error = "送信完了の表示が出ていない " + " / ".join(self.alerts)
+        self.ws.close()
+
+
+########################################
+# 突き合わせ
+########################################
+
+def _outbox_rows(outbox_dir: Path, outbox: str) -> tuple[list, int, int]:
+    """アウトボックスに入った「書かれるはずの行」と、未反映・失敗の件数"""
+    path = outbox_dir / f"{outbox}.sqlite3"
+    if not path.exists():
+        return [], 0, 0
+    db = sqlite3.connect(path, timeout=30)
+    db.row_factory = sqlite3.Row
+    expected = []
+    for row in db.execute("SELECT * FROM outbox WHERE op != 'summary'"):  # 日別集計は日報の行ではない
+        payload = json.loads(row["payload"])
+        vio = payload.get("value_input_option", "RAW")
+        sheets = payload["sheets"] if "sheets" in payload else {row["worksheet"]: payload["rows"]}
+        for title, rows in sheets.items():
+            if row["submission_id"]:
+                rows = _tag_rows(rows, row["submission_id"])
+            for r in rows:
+                # シートに入った時と同じ表示値にする（batchUpdate は CellData を経由する）
+                if row["op"] == "append_multi":
+                    cells = [_from_cell_data(to_cell(v, vio)) for v in r]
+                else:
+                    cells = [_display(v) for v in r]
+                expected.append((row["spreadsheet_id"], title or "シート1", _trim(cells)))
+    pending, dead = (db.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (s,)).fetchone()[0]
+                     for s in ("pending", "dead"))
+    db.close()
+    return expected, pending, dead
+
+
+def _trim(cells) -> tuple:
+    cells = list(cells)
+    while cells and cells[-1] == "":
+        cells.pop()
+    return tuple(cells)
+
+
+def _sheet_rows(store_path: str, spreadsheet_id: str, tabs: list[str], sids: set) -> list:
+    """シートの行のうち、今回の送信IDが付いた行"""
+    client = FakeClient(tabs={spreadsheet_id: tabs}, store=open_store(store_path))
+    col = ord(ID_COLUMN) - ord("A")
+    return [
+        (spreadsheet_id, ws.title, _trim(r))
+        for ws in client.open_by_key(spreadsheet_id).worksheets()
+        for r in ws.get_all_values()
+        if len(r) > col and r[col] in sids
+    ]
+
+
+def reconcile(outbox_dir: Path, store_path: str, apps: list[str]) -> dict:
+    expected, pending, dead = [], 0, 0
+    for app in apps:
+        rows, p, d = _outbox_rows(outbox_dir, APPS[app][1])
+        expected += rows
+        pending += p
+        dead += d
+    col = ord(ID_COLUMN) - ord("A")
+    sids = {cells[col] for _, _, cells in expected if len(cells) > col}
+    written = []
+    for app in apps:
+        script, _, tabs, _ = APPS[app]
+        written += _sheet_rows(store_path, _spreadsheet_id(script), tabs, sids)
+    want, got = Counter(expected), Counter(written)
+    return {
+        "rows_expected": sum(want.values()),
+        "rows_written": sum(got.values()),
+        "duplicate_rows": sum((got - want).values()),
+        "lost_rows": sum((want - got).values()),
+        "outbox_pending": pending,
+        "outbox_dead": dead,
+    }
+
+
+def percentile(values: list[float], p: int) -> float | None:
+    if not values:
+        return None
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[p - 1]
+
+
+########################################
+# 実行
+########################################
+
+async def run_load(sessions: list[Session]) -> float:
+    """全員の入力を済ませ、そろったところで一斉に送信する。送信にかかった全体の秒数を返す"""
+    await asyncio.gather(*(s.prepare() for s in sessions))
+    ready = [s for s in sessions if s.error is None]
+    print(f"入力: {len(ready)}/{len(sessions)} 人（作業 {sum(s.tasks for s in ready)} 件）")
+
+    async def go(s: Session):
+        try:
+            await s.submit()
+        except Exception as e:
+            s.error = f"{type(e).__name__}: {e}"[:200]
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(go(s) for s in ready))
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日報アプリの同時送信の負荷試験")
+    parser.add_argument("-w", "--workers", type=int, default=20, help="同時に送信する人数")
+    parser.add_argument("--apps", default="siage,kikai,cad,sekkei", help="使うアプリ（カンマ区切り、順に割り振る）")
+    parser.add_argument("--tasks", type=int, default=5, help="1人あたりの作業数の上限（1〜この数をランダム）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--429-rate", dest="rate_429", type=float, default=0.0)
+    parser.add_argument("--quota-per-min", type=int, default=60,
+                        help="1分あたりの上限（サーバーごと。Googleと同じ60、0で無制限）")
+    parser.add_argument("--timeout-rate", type=float, default=0.0)
+    parser.add_argument("--timeout-sec", type=float, default=10)
+    parser.add_argument("--drain-sec", type=float, default=300, help="シートに書き終わるのを待つ上限")
+    parser.add_argument("--json", help="結果をJSONで保存するファイル")
+    args = parser.parse_args()
+
+    apps = [a.strip() for a in args.apps.split(",") if a.strip()]
+    workdir = Path(tempfile.mkdtemp(prefix="hokusei-load-"))
+    outbox_dir = workdir / "outbox"
+    store_path = str(workdir / "local-sheets.sqlite3")
+
+    secrets = {k: (CLIENT_EMAIL if k == "client_email" else "load") for k in SECRET_KEYS}
+    secrets.update(
+        sheets_backend="local",
+        local_store=store_path,
+        local_latency_ms=args.latency_ms,
+        local_jitter_ms=args.jitter_ms,
+        local_429_rate=args.rate_429,
+        local_quota_per_min=args.quota_per_min,
+        local_timeout_rate=args.timeout_rate,
+        local_timeout_sec=args.timeout_sec,
+        local_seed=args.seed,
+        local_tabs={_spreadsheet_id(APPS[a][0]): APPS[a][2] for a in apps},
+    )
+    (workdir / ".streamlit").mkdir()
+    (workdir / ".streamlit" / "secrets.toml").write_text(toml.dumps({"google_cloud": secrets}), encoding="utf-8")
+    env = dict(os.environ, HOKUSEI_OUTBOX_DIR=str(outbox_dir))
+
+    servers = {}
+    try:
+        for app in apps:
+            servers[app] = start_server(app, workdir, env)
+        rng = random.Random(args.seed)
+        sessions = [
+            Session(n, apps[n % len(apps)], servers[apps[n % len(apps)]][1], random.Random(rng.random()), args.tasks)
+            for n in range(args.workers)
+        ]
+        burst_sec = asyncio.run(run_load(sessions))
+
+        t0 = time.perf_counter()
+        deadline = t0 + args.drain_sec
+        while (sum(_outbox_rows(outbox_dir, APPS[a][1])[1] for a in apps)
+               and time.perf_counter() < deadline):
+            time.sleep(0.5)
+        drain_sec = time.perf_counter() - t0 + burst_sec
+        result_rows = reconcile(outbox_dir, store_path, apps)
+    finally:
+        for proc, _ in servers.values():
+            proc.terminate()
+        for proc, _ in servers.values():
+            proc.wait(timeout=30)
+
+    ready = [s for s in sessions if s.submit_sec is not None]
+    latencies = sorted(s.submit_sec for s in ready)
+    ok = [s for s in ready if s.error is None]
+    result = {
+        "workers": len(sessions),
+        "apps": apps,
+        "tasks": sum(s.tasks for s in ready),
+        "submits_ok": len(ok),
+        "submit_errors": [f"#{s.n} {s.app}: {s.error}" for s in sessions if s.error],
+        "burst_sec": burst_sec,
+        "submits_per_sec": len(ok) / burst_sec if burst_sec else None,
+        "p50_sec": percentile(latencies, 50),
+        "p95_sec": percentile(latencies, 95),
+        "p99_sec": percentile(latencies, 99),
+        "max_sec": latencies[-1] if latencies else None,
+        "drain_sec": drain_sec,
+        **result_rows,
+    }
+
+    def sec(v):
+        return f"{v * 1000:.0f}ms" if v is not None else "-"
+    print(f"送信: {len(ok)}/{len(ready)} 件 {burst_sec:.2f}秒（{result['submits_per_sec'] or 0:.1f} 件/秒）")
+    print(f"応答時間: p50 {sec(result['p50_sec'])} / p95 {sec(result['p95_sec'])}"
+          f" / p99 {sec(result['p99_sec'])} / 最大 {sec(result['max_sec'])}")
+    print(f"シート: {result['rows_written']}/{result['rows_expected']} 行 {drain_sec:.1f}秒"
+          f"（二重 {result['duplicate_rows']} / 抜け {result['lost_rows']}"
+          f" / 未反映 {result['outbox_pending']} / 失敗 {result['outbox_dead']}）")
+    for err in result["submit_errors"]:
+        print(f"  ! {err}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    failed = result["submit_errors"] or result["duplicate_rows"] or result["lost_rows"]
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# tools/rollup_jobs.py
+# 工番ごとの時間の集計（hokusei_rollup）
+#
+# 使い方（リポジトリ直下で）:
+#   python tools/rollup_jobs.py --job 51A111                   # 51A111 に4課で何時間かかったか（内訳つき）
+#   python tools/rollup_jobs.py --by job,department --top 30   # 工番×課の上位30件
+#   python tools/rollup_jobs.py --month 2025-10 --csv out.csv  # 10月分を工番/メーカー/作業内容/課/月で
+#   python tools/rollup_jobs.py --sync --job 51A111            # 先に差分同期してから（secrets が要る）
+#
+# 集計はローカルの控え（tools/sync_nippo.py で同期したSQLite）だけを読む。
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from hokusei_rollup import ROLLUP_KEYS, job_breakdown, job_hours, load, prepare, rollup  # noqa: E402
+from hokusei_sync import SYNC_DB, sync_all  # noqa: E402
+from sync_nippo import load_service_account  # noqa: E402
+
+
+def _next_month(month: str) -> str:
+    y, m = (int(x) for x in month.split("-"))
+    return f"{y + m // 12}-{m % 12 + 1:02d}-01"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="工番ごとの時間の集計")
+    parser.add_argument("--db", type=Path, default=SYNC_DB, help="控えのSQLite")
+    parser.add_argument("--sync", action="store_true", help="集計の前に差分同期する")
+    parser.add_argument("--secrets", type=Path, default=ROOT / ".streamlit" / "secrets.toml")
+    parser.add_argument("--job", help="この工番の合計と内訳だけ出す")
+    parser.add_argument("--by", default=",".join(ROLLUP_KEYS),
+                        help="集計の単位（カンマ区切り: job,customer,genre,department,month,name,category）")
+    parser.add_argument("--month", help="この月だけ（YYYY-MM）")
+    parser.add_argument("--misc", action="store_true", help="雑務・移動の行も集計に入れる")
+    parser.add_argument("--top", type=int, default=50, help="表示する件数（--csv のときは全件書く）")
+    parser.add_argument("--csv", type=Path, help="結果をCSVで保存")
+    args = parser.parse_args()
+
+    if args.sync:
+        sync_all(load_service_account(args.secrets), args.db)
+
+    t0 = time.perf_counter()
+    start, end = (f"{args.month}-01", _next_month(args.month)) if args.month else (None, None)
+    frame = prepare(load(start=start, end=end, db_path=args.db))
+    t1 = time.perf_counter()
+
+    if args.job:
+        total = job_hours(frame, args.job)
+        t2 = time.perf_counter()
+        result = job_breakdown(frame, args.job)
+        print(f"{args.job}: {total:.2f} 時間")
+    else:
+        result = rollup(frame, by=args.by.split(","), include_misc=args.misc)
+        t2 = time.perf_counter()
+
+    if args.csv:
+        result.to_csv(args.csv, index=False, encoding="utf-8-sig")  # Excel で文字化けしないようBOM付き
+    else:
+        print(result.head(args.top).to_string(index=False))
+    print(f"{len(frame)} 行 / 読み込み {t1 - t0:.2f} 秒・集計 {(t2 - t1) * 1000:.0f} ミリ秒", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
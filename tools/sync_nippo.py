@@ -0,0 +1,62 @@
+# tools/sync_nippo.py
+# 日報シートをローカルのSQLite（hokusei_sync）へ差分同期する
+#
+# 使い方（リポジトリ直下で）:
+#   python tools/sync_nippo.py                    # 前回の続きから取り込む（普段はこれ。cron などで定期実行）
+#   python tools/sync_nippo.py --only siage,cad   # 一部のワークシートだけ
+#   python tools/sync_nippo.py --full             # 全部取り込み直す
+#
+# 認証は各アプリと同じ .streamlit/secrets.toml の [google_cloud] を使う。
+# API の回数はスプレッドシートごとに Drive の版の確認1回。変わっていたら、さらに
+# open_by_key / worksheets の2回＋ワークシートごとに1〜2回。
+
+import argparse
+import json
+import sys
+import time
+import tomllib
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from hokusei_sync import SOURCES, SYNC_DB, sync_all  # noqa: E402
+
+
+def load_service_account(path: Path) -> dict:
+    with open(path, "rb") as f:
+        info = dict(tomllib.load(f)["google_cloud"])
+    # secretsのprivate_keyが"\\n"になっていたら復元（アプリと同じ）
+    if "private_key" in info and "\\n" in info["private_key"]:
+        info["private_key"] = info["private_key"].replace("\\n", "\n")
+    return info
+
+
+def main():
+    parser = argparse.ArgumentParser(description="日報シートの差分同期")
+    parser.add_argument("--secrets", type=Path, default=ROOT / ".streamlit" / "secrets.toml")
+    parser.add_argument("--db", type=Path, default=SYNC_DB, help="取り込み先のSQLite")
+    parser.add_argument("--only", help="同期するワークシート（カンマ区切り: " + ",".join(SOURCES) + "）")
+    parser.add_argument("--full", action="store_true", help="水位を無視して最初から取り込み直す")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出す")
+    args = parser.parse_args()
+
+    sources = args.only.split(",") if args.only else None
+    unknown = [s for s in sources or [] if s not in SOURCES]
+    if unknown:
+        parser.error(f"unknown source: {', '.join(unknown)}")
+
+    t0 = time.perf_counter()
+    results = sync_all(load_service_account(args.secrets), args.db, sources, full=args.full)
+    elapsed = time.perf_counter() - t0
+    if args.json:
+        print(json.dumps({"elapsed_sec": elapsed, "sources": results}, ensure_ascii=False))
+        return
+    for r in results:
+        note = "（取り込み直し）" if r["reset"] else "（変更なし）" if r.get("unchanged") else ""
+        print(f"{r['source']:<12} +{r['rows']:>6} 行  〜{r['last_row']}行目{note}")
+    print(f"{elapsed:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()